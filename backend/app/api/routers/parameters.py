@@ -1,14 +1,16 @@
-import datetime
-from typing import List, Optional
+import datetime, re
+from typing import Dict, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.api import deps
 from app.models.parameter import ParameterType, Parameter, ParameterData
 from app.models.user import User as UserModel
-from app.schemas.parameter import ParameterTypeRead, ParameterRead, ParameterDataRead
+from app.schemas.parameter import ParameterTypeRead, ParameterRead, ParameterDataBatchRead, ParameterDataBucketRead, ParameterDataPageRead, ParameterDataRead, ParameterLatestRead
 from app.services import parameter_service
+from app.services.timeseries_codec import COLUMNAR_MEDIA_TYPE, encode_columnar
 
 
 router = APIRouter(prefix="/parameters", tags=["Parameters & Data"])
@@ -50,6 +52,22 @@ async def read_parameters_for_actuator(*, actuator_id: int, db: Session = Depend
     return parameters
 
 
+@router.get("/latest/", response_model=List[ParameterLatestRead])
+async def read_latest_values(*, db: Session = Depends(deps.get_db),
+                             actuator_id: Optional[int] = Query(None, description="Все параметры актуатора"),
+                             aggregate_id: Optional[int] = Query(None, description="Все параметры всех актуаторов агрегата"),
+                             current_user: UserModel = Depends(deps.get_current_user)) -> List[Dict]:
+    """ Получает текущие значения всех параметров актуатора или агрегата одним запросом.
+    Нужно указать ровно один из actuator_id и aggregate_id. Доступ проверяется на уровне сервиса. """
+    if (actuator_id is None) == (aggregate_id is None):
+        raise HTTPException(status_code=400, detail="Укажите ровно один из параметров: actuator_id или aggregate_id.")
+
+    latest_values = parameter_service.get_latest_values(
+        db=db, current_user=current_user, actuator_id=actuator_id, aggregate_id=aggregate_id
+    )
+    return latest_values
+
+
 '''
 ============================================
     Эндпоинты для данных временных рядов
@@ -57,14 +75,15 @@ async def read_parameters_for_actuator(*, actuator_id: int, db: Session = Depend
 '''
 
 
-@router.get("/{parameter_id}/data/", response_model=List[ParameterDataRead])
-async def read_parameter_data(*, parameter_id: int, db: Session = Depends(deps.get_db),
-                              start_time: datetime.datetime = Query(..., description="Начало временного диапазона"),
-                              end_time: datetime.datetime = Query(..., description="Конец временного диапазона"),
-                              limit: Optional[int] = Query(None, description="Максимальное количество записей", ge=1),
-                              current_user: UserModel = Depends(deps.get_current_user)) -> List[ParameterData]:
-    """ Получает данные временного ряда для выбранного параметра за определенный период.
-    Доступ к параметру проверяется на уровне сервиса. """
+MAX_DOWNSAMPLED_POINTS = 10000
+MAX_BATCH_PARAMETERS = 20
+MAX_BATCH_RAW_POINTS = 200000  # Сырых точек на все параметры пакетного запроса без bucket
+MAX_PAGE_SIZE = 10000
+BUCKET_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+
+def _validate_time_range(start_time: datetime.datetime, end_time: datetime.datetime) -> None:
+    """ Проверяет временной диапазон запроса данных """
     if start_time >= end_time:
         raise HTTPException(
             status_code=400,
@@ -78,12 +97,164 @@ async def read_parameter_data(*, parameter_id: int, db: Session = Depends(deps.g
             detail=f"Запрашиваемый диапазон не может превышать {max_range_days} дней."
         )
 
+
+def _prefers_columnar(accept_header: str) -> bool:
+    """ Выбирает колоночный формат, только если клиент явно указал его в Accept с q > 0
+    и не предпочёл JSON (application/json, application/* или */*) с большим q """
+    columnar_q, json_q = 0.0, 0.0
+    for media_range in accept_header.split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.lower()
+        if media_type == COLUMNAR_MEDIA_TYPE:
+            columnar_q = max(columnar_q, quality)
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_q = max(json_q, quality)
+    return columnar_q > 0 and columnar_q >= json_q
+
+
+def _parse_bucket(bucket: str, start_time: datetime.datetime, end_time: datetime.datetime) -> datetime.timedelta:
+    """ Разбирает интервал агрегации вида 30s, 5m, 1h, 1d и проверяет, что интервалов будет не слишком много """
+    match = re.fullmatch(r"(\d{1,6})([smhd])", bucket.strip())  # Не больше 6 цифр: большее число переполнило бы timedelta
+    if not match or int(match.group(1)) == 0:
+        raise HTTPException(status_code=400, detail="Интервал bucket задаётся как число и единица: 30s, 5m, 1h, 1d.")
+    bucket_interval = datetime.timedelta(**{BUCKET_UNITS[match.group(2)]: int(match.group(1))})
+    if (end_time - start_time) / bucket_interval > MAX_DOWNSAMPLED_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком мелкий интервал bucket: получится больше {MAX_DOWNSAMPLED_POINTS} точек."
+        )
+    return bucket_interval
+
+
+@router.get("/data/batch/", response_model=ParameterDataBatchRead)
+async def read_parameters_data_batch(*, db: Session = Depends(deps.get_db),
+                                     parameter_ids: List[int] = Query(..., description="ID параметров: ?parameter_ids=1&parameter_ids=2"),
+                                     start_time: datetime.datetime = Query(..., description="Начало временного диапазона"),
+                                     end_time: datetime.datetime = Query(..., description="Конец временного диапазона"),
+                                     bucket: Optional[str] = Query(None, description="Выровнять ряды на общую сетку интервалов: 30s, 5m, 1h, 1d"),
+                                     current_user: UserModel = Depends(deps.get_current_user)) -> Dict:
+    """ Получает ряды нескольких параметров за один запрос (например, для графиков сравнения одного актуатора).
+    Права проверяются сразу для всего набора; если хотя бы один параметр недоступен - 403.
+    Без bucket сырых точек на все параметры должно быть не больше MAX_BATCH_RAW_POINTS, иначе - 400. """
+    _validate_time_range(start_time, end_time)
+    if len(set(parameter_ids)) > MAX_BATCH_PARAMETERS:
+        raise HTTPException(status_code=400, detail=f"За один запрос можно получить не больше {MAX_BATCH_PARAMETERS} параметров.")
+
+    data = parameter_service.get_parameters_data_batch(
+        db=db,
+        current_user=current_user,
+        parameter_ids=parameter_ids,
+        start_time=start_time,
+        end_time=end_time,
+        bucket=_parse_bucket(bucket, start_time, end_time) if bucket is not None else None,
+        max_raw_points=MAX_BATCH_RAW_POINTS
+    )
+    return data
+
+
+@router.get("/{parameter_id}/data/", response_model=List[Union[ParameterDataRead, ParameterDataBucketRead]],
+            responses={200: {"content": {COLUMNAR_MEDIA_TYPE: {}}, "description": "JSON или колоночный формат MSMT (Accept)"}})
+async def read_parameter_data(*, parameter_id: int, request: Request, response: Response, db: Session = Depends(deps.get_db),
+                              start_time: datetime.datetime = Query(..., description="Начало временного диапазона"),
+                              end_time: datetime.datetime = Query(..., description="Конец временного диапазона"),
+                              limit: Optional[int] = Query(None, description="Максимальное количество записей (постранично - через /data/page/)", ge=1),
+                              points: Optional[int] = Query(None, ge=3, le=MAX_DOWNSAMPLED_POINTS, description="Проредить ряд до стольких точек (LTTB)"),
+                              bucket: Optional[str] = Query(None, description="Агрегировать min/max/avg по интервалам: 30s, 5m, 1h, 1d"),
+                              current_user: UserModel = Depends(deps.get_current_user)) -> Union[List[Union[ParameterData, Dict]], Response]:
+    """ Получает данные временного ряда для выбранного параметра за определенный период.
+    С points или bucket ряд прореживается на сервере, и размер ответа зависит от разрешения графика, а не от длины периода.
+    При Accept: application/vnd.msm.timeseries сырые или прореженные (points) точки отдаются в колоночном бинарном
+    формате (см. timeseries_codec); агрегаты bucket всегда отдаются в JSON.
+    Доступ к параметру проверяется на уровне сервиса. """
+    _validate_time_range(start_time, end_time)
+
+    if points is not None and bucket is not None:
+        raise HTTPException(status_code=400, detail="Укажите только один способ прореживания: points или bucket.")
+
+    bucket_interval = _parse_bucket(bucket, start_time, end_time) if bucket is not None else None
+
+    response.headers["Vary"] = "Accept"  # Формат ответа зависит от Accept (и для JSON, чтобы общий кэш не отдал его клиенту MSMT)
+    if bucket_interval is None and _prefers_columnar(request.headers.get("accept", "")):
+        timestamps_us, values = parameter_service.get_parameter_data_columns(
+            db=db,
+            current_user=current_user,
+            parameter_id=parameter_id,
+            start_time=start_time,
+            end_time=end_time,
+            limit=limit,
+            points=points
+        )
+        return Response(
+            content=encode_columnar(parameter_id, timestamps_us, values),
+            media_type=COLUMNAR_MEDIA_TYPE,
+            headers={"Vary": "Accept"}
+        )
+
     data = parameter_service.get_parameter_data(
         db=db,
         current_user=current_user,
         parameter_id=parameter_id,
         start_time=start_time,
         end_time=end_time,
-        limit=limit
+        limit=limit,
+        points=points,
+        bucket=bucket_interval
+    )
+    return data
+
+
+@router.get("/{parameter_id}/data/page/", response_model=ParameterDataPageRead)
+async def read_parameter_data_page(*, parameter_id: int, db: Session = Depends(deps.get_db),
+                                   start_time: datetime.datetime = Query(..., description="Начало временного диапазона"),
+                                   end_time: datetime.datetime = Query(..., description="Конец временного диапазона"),
+                                   page_size: int = Query(1000, ge=1, le=MAX_PAGE_SIZE, description="Записей на странице"),
+                                   cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+                                   current_user: UserModel = Depends(deps.get_current_user)) -> Dict:
+    """ Постранично получает данные временного ряда параметра (keyset-пагинация).
+    Для следующей страницы передайте next_cursor из ответа в ?cursor= с теми же start_time и end_time. """
+    _validate_time_range(start_time, end_time)
+
+    data = parameter_service.get_parameter_data_page(
+        db=db,
+        current_user=current_user,
+        parameter_id=parameter_id,
+        start_time=start_time,
+        end_time=end_time,
+        page_size=page_size,
+        cursor=cursor
+    )
+    return data
+
+
+@router.get("/{parameter_id}/data/stream/")
+async def stream_parameter_data(*, parameter_id: int, db: Session = Depends(deps.get_db),
+                                start_time: datetime.datetime = Query(..., description="Начало временного диапазона"),
+                                end_time: datetime.datetime = Query(..., description="Конец временного диапазона"),
+                                output_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="ndjson или csv"),
+                                current_user: UserModel = Depends(deps.get_current_user)) -> StreamingResponse:
+    """ Потоково выгружает данные временного ряда параметра в NDJSON или CSV (для больших диапазонов и экспорта).
+    Строки читаются серверным курсором и отправляются пачками: память не растёт с длиной диапазона. """
+    if start_time >= end_time:  # Без ограничения длины диапазона, в отличие от _validate_time_range
+        raise HTTPException(
+            status_code=400,
+            detail="Время начала должно быть меньше времени окончания."
+        )
+
+    chunks = parameter_service.stream_parameter_data(
+        db=db,
+        current_user=current_user,
+        parameter_id=parameter_id,
+        start_time=start_time,
+        end_time=end_time,
+        output_format=output_format
     )
-    return data
\ No newline at end of file
+    headers = {"Content-Disposition": f'attachment; filename="parameter_{parameter_id}.csv"'} if output_format == "csv" else None
+    return StreamingResponse(chunks, media_type=parameter_service.STREAM_MEDIA_TYPES[output_format], headers=headers)
\ No newline at end of file
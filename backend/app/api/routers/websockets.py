@@ -1,10 +1,14 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, status
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, status
 from sqlalchemy.orm import Session
 
 from app.api import deps
 from app.db.session import get_db
 from app.models.user import User as UserModel
-from app.services.permissions import get_user_access_scope, can_user_access_parameter
+from app.services.parameter_service import get_backfill_frame
+from app.services.permissions import can_user_access_parameter, filter_accessible_parameters, get_user_access_scope
 from app.services.websocket_service import connection_manager
 
 
@@ -13,6 +17,9 @@ router = APIRouter(prefix="/ws", tags=["WebSockets"])
 
 @router.websocket("/live_data/{parameter_id_str}")
 async def websocket_endpoint(websocket: WebSocket, parameter_id_str: str,
+                             max_hz: Optional[float] = Query(None, gt=0, description="Не больше стольких кадров в секунду (только последние значения)"),
+                             binary: bool = Query(False, description="Отправлять данные бинарными кадрами (байты JSON)"),
+                             backfill: bool = Query(False, description="Сразу прислать историю параметра за последние минуты"),
                              current_user: UserModel = Depends(deps.get_current_user_ws),
                              db: Session = Depends(get_db)):
     """ WebSocket-эндпоинт для подписки на real-time обновления данных конкретного параметра.
@@ -34,17 +41,104 @@ async def websocket_endpoint(websocket: WebSocket, parameter_id_str: str,
         return
 
     print(f"[WS_Endpoint]  Пользователь {current_user.user_id} подключён к parameter_id: {parameter_id}")
-    await connection_manager.connect(websocket, parameter_id)
+    connection = await connection_manager.connect(websocket, parameter_id, max_hz=max_hz, binary=binary)
+    if backfill:  # Служебный кадр уходит раньше любых кадров с данными
+        connection.offer_control(json.dumps(get_backfill_frame(db=db, parameter_id=parameter_id)))
     try:
         while True:
             data = await websocket.receive_text()
             print(f"[WS_Endpoint]  Пользователю {current_user.user_id} для parameter_id={parameter_id} отправлено: {data}")
             if data.lower() == "ping":
-                await websocket.send_text("pong")
+                connection.offer_control("pong")
     except WebSocketDisconnect:
         print(f"[WS_Endpoint]  Пользователь {current_user.user_id} ОТКЛЮЧИЛСЯ от parameter_id: {parameter_id}")
     except Exception as e:
         print(f"[WS_Endpoint]  !!! ОШИБКА для пользователя {current_user.user_id}, parameter_id={parameter_id}: {type(e).__name__} - {e}")
     finally:
         connection_manager.disconnect(websocket, parameter_id)
-        print(f"[WS_Endpoint]  Соединение для пользователя {current_user.user_id}, parameter_id={parameter_id} удалено из менеджера.")
\ No newline at end of file
+        print(f"[WS_Endpoint]  Соединение для пользователя {current_user.user_id}, parameter_id={parameter_id} удалено из менеджера.")
+
+
+def _parse_parameter_ids(raw_ids) -> Optional[List[int]]:
+    """ Приводит список ID параметров из управляющего сообщения к List[int]. Возвращает None при неверном формате """
+    if not isinstance(raw_ids, list):
+        return None
+    try:
+        return [int(p_id) for p_id in raw_ids]
+    except (TypeError, ValueError):
+        return None
+
+
+@router.websocket("/live_data")
+async def websocket_multiplexed_endpoint(websocket: WebSocket,
+                                         parameter_ids: Optional[str] = Query(None, description="Начальные подписки через запятую: 1,2,3"),
+                                         max_hz: Optional[float] = Query(None, gt=0, description="Не больше стольких пачек кадров в секунду (только последние значения)"),
+                                         binary: bool = Query(False, description="Отправлять данные бинарными кадрами (байты JSON)"),
+                                         backfill: bool = Query(True, description="Присылать историю каждого нового параметра за последние минуты"),
+                                         current_user: UserModel = Depends(deps.get_current_user_ws),
+                                         db: Session = Depends(get_db)):
+    """ Мультиплексный WebSocket-эндпоинт: одно соединение, много подписок на параметры.
+    Управляющие сообщения: {"action": "subscribe" | "unsubscribe", "parameter_ids": [1, 2, 3]} и "ping".
+    Каждый кадр с данными содержит parameter_id; после подписки приходит кадр {"type": "backfill", ...} с историей.
+    Аутентификация обязательна. """
+    if not current_user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication required")
+        return
+
+    user_scope = get_user_access_scope(db=db, user=current_user)  # Права определяются один раз на соединение
+    connection = await connection_manager.connect_multiplexed(websocket, max_hz=max_hz, binary=binary)
+    print(f"[WS_Endpoint]  Пользователь {current_user.user_id} подключён к мультиплексному потоку.")
+
+    def _handle_subscribe(requested_ids: List[int]) -> None:
+        """ Проверяет права сразу на весь набор параметров и подписывает на разрешённые """
+        allowed_ids = filter_accessible_parameters(user_scope, requested_ids, db=db)
+        added_ids = connection_manager.subscribe(connection, [p_id for p_id in requested_ids if p_id in allowed_ids])
+        denied_ids = sorted(set(requested_ids) - allowed_ids)
+        if denied_ids:
+            print(f"[WS_Endpoint]  Пользователю {current_user.user_id} доступ к parameter_ids: {denied_ids} ЗАПРЕЩЁН")
+        over_limit_ids = sorted(allowed_ids - connection.parameter_ids)  # Сверх WS_CLIENT_MAX_SUBSCRIPTIONS
+        if over_limit_ids:
+            print(f"[WS_Endpoint]  Пользователю {current_user.user_id} превышен лимит подписок, parameter_ids: {over_limit_ids} не подписаны")
+            denied_ids = sorted(set(denied_ids) | set(over_limit_ids))
+        connection.offer_control(json.dumps({
+            "type": "subscribed", "parameter_ids": sorted(connection.parameter_ids), "denied": denied_ids
+        }))
+        if backfill:
+            for p_id in added_ids:
+                connection.offer_control(json.dumps(get_backfill_frame(db=db, parameter_id=p_id)))
+
+    try:
+        if parameter_ids:
+            initial_ids = _parse_parameter_ids(parameter_ids.split(","))
+            if initial_ids is None:
+                connection.offer_control(json.dumps({"type": "error", "detail": "Invalid parameter_ids format"}))
+            else:
+                _handle_subscribe(initial_ids)
+
+        while True:
+            data = await websocket.receive_text()
+            if data.lower() == "ping":
+                connection.offer_control("pong")
+                continue
+
+            try:
+                control = json.loads(data)
+                action = control.get("action")
+                requested_ids = _parse_parameter_ids(control.get("parameter_ids"))
+            except (ValueError, AttributeError):
+                action, requested_ids = None, None
+            if action not in ("subscribe", "unsubscribe") or requested_ids is None:
+                connection.offer_control(json.dumps({"type": "error", "detail": "Invalid control message"}))
+                continue
+
+            if action == "subscribe":
+                _handle_subscribe(requested_ids)
+            else:
+                connection_manager.unsubscribe(connection, requested_ids)
+                connection.offer_control(json.dumps({"type": "unsubscribed", "parameter_ids": sorted(connection.parameter_ids)}))
+    except WebSocketDisconnect:
+        print(f"[WS_Endpoint]  Пользователь {current_user.user_id} ОТКЛЮЧИЛСЯ от мультиплексного потока.")
+    except Exception as e:
+        print(f"[WS_Endpoint]  !!! ОШИБКА мультиплексного потока для пользователя {current_user.user_id}: {type(e).__name__} - {e}")
+    finally:
+        connection_manager.disconnect(websocket)
\ No newline at end of file
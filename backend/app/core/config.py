@@ -30,8 +30,53 @@ class Settings(BaseSettings):
     RABBITMQ_VIRTUAL_HOST: str = "/"
     RABBITMQ_QUEUE_NAME: str = "parameter_data_queue"
     RABBITMQ_LIVE_DATA_EXCHANGE_NAME: str = "live_data_fanout_exchange"
+    RABBITMQ_LIVE_DATA_TOPIC_EXCHANGE_NAME: str = "live_data_topic_exchange"  # Показания с ключом по parameter_id: для экземпляров API
+    RABBITMQ_LIVE_DATA_ROUTING_KEY_TEMPLATE: str = "parameter.{parameter_id}"
     RABBITMQ_URL: Optional[str] = None
 
+    # --- Настройки рассылки live-данных по WebSocket ---
+    WS_CLIENT_MAX_SUBSCRIPTIONS: int = 256  # Не больше стольких параметров на одно соединение (ограничивает и очередь кадров клиента)
+    WS_CLIENT_MAX_PENDING_CONTROL_FRAMES: int = 512  # Сколько неотправленных служебных кадров (ответы, backfill) может скопиться до отключения
+    WS_SEND_TIMEOUT_SECONDS: float = 10.0  # Клиент, не принявший один кадр за это время, отключается
+    WS_DEFAULT_MAX_HZ: Optional[float] = None  # Частота отправки по умолчанию, если клиент не указал ?max_hz (None - без ограничения)
+    WS_BACKFILL_SECONDS: int = 600  # За сколько последних секунд новый подписчик получает историю параметра (?backfill=true)
+
+    # --- Горячее окно временных рядов в процессе API ---
+    HOT_WINDOW_MAX_POINTS_PER_PARAMETER: int = 20000  # Размер кольцевого буфера параметра (16 байт на точку, ~320 КБ)
+
+    # --- Кэш последних значений параметров в процессе API ---
+    LAST_VALUE_CACHE_TTL_SECONDS: float = 5.0  # Сколько считать свежим значение из БД (live-значения свежие, пока у параметра есть подписчики)
+    LAST_VALUE_LOOKBACK_HOURS: int = 24  # Глубина поиска последнего значения в БД (ограничивает сканируемые чанки)
+
+    # --- Настройки потоковой выгрузки данных параметров ---
+    DATA_STREAM_CHUNK_ROWS: int = 5000  # Строк в одной пачке серверного курсора и одном куске ответа
+
+    # --- Настройки пакетной записи данных воркером ---
+    WORKER_BATCH_SIZE: int = 500  # Максимальное количество сообщений в одной пачке
+    WORKER_BATCH_FLUSH_INTERVAL_MS: int = 250  # Максимальное время ожидания пачки перед записью в БД
+
+    # --- Настройки индекса правил мониторинга в воркере ---
+    RULE_INDEX_MAX_AGE_SECONDS: int = 300  # Страховка: не реже этого интервала индекс полностью перестраивается из БД
+
+    # --- Индекс иерархии оборудования для проверок доступа ---
+    EQUIPMENT_INDEX_MAX_AGE_SECONDS: int = 300  # Страховка: не реже этого интервала индекс полностью перестраивается из БД
+
+    # --- Кэш областей видимости пользователей ---
+    ACCESS_SCOPE_CACHE_TTL_SECONDS: int = 300  # Время жизни вычисленной области видимости (сбрасывается и при изменении пользователя)
+
+    # --- Канал PostgreSQL NOTIFY для событий инвалидации кэшей (см. notify_cache_invalidation в main_script.sql) ---
+    CACHE_INVALIDATION_CHANNEL: str = "msm_cache_invalidation"
+    CACHE_INVALIDATION_CHECK_SECONDS: float = 30.0  # Как часто сверять номера версий таблиц с БД (пропущенные события)
+
+    # --- Настройки диспетчера уведомлений о тревогах ---
+    NOTIFICATION_CHANNELS: List[str] = ["log"]  # Имена каналов доставки: "log", "file" (см. notification_service)
+    NOTIFICATION_FILE_PATH: str = "notifications.log"  # Файл для канала "file" (локальная замена реальной доставки)
+    NOTIFICATION_COALESCE_WINDOW_MS: int = 1000  # Тревоги одного пользователя за это окно объединяются в одно уведомление
+    NOTIFICATION_USER_MAX_PER_MINUTE: int = 6  # Не больше стольких уведомлений одному пользователю в минуту (остальное копится)
+    NOTIFICATION_USER_MAX_PENDING: int = 50  # Сколько последних тревог пользователя хранить в ожидании доставки
+    NOTIFICATION_QUEUE_MAX_SIZE: int = 10000
+    NOTIFICATION_SETTINGS_CACHE_TTL_SECONDS: int = 300  # Время жизни кэша alarm_types пользователей
+
     # --- URL БД (будет вычислен) ---
     SQLALCHEMY_DATABASE_URL: Optional[PostgresDsn] = None
 
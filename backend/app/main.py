@@ -1,21 +1,28 @@
-import json
+import datetime
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from faststream.rabbit import ExchangeType, RabbitBroker, RabbitExchange, RabbitQueue
+from faststream.rabbit import ExchangeType, RabbitBroker, RabbitExchange, RabbitMessage, RabbitQueue
 
 from app.api.routers import alerts, auth, equipment, parameters, rules, settings, users, websockets
 from app.core.config import settings as app_settings
-from app.services.websocket_service import connection_manager
+from app.services.cache_invalidation import cache_invalidation_listener
+from app.services.equipment_index import equipment_hierarchy_index, HIERARCHY_TABLES
+from app.services.hot_window import hot_window_store
+from app.services.last_value_cache import last_value_cache
+from app.services.live_data_routing import live_data_bindings
+from app.services.permissions import access_scope_cache
+from app.services.websocket_service import connection_manager, LiveFrame
 
 
 # --- Инициализация FastStream для потребителя Websocket-данных внутри FastAPI ---
 websocket_consumer_broker = RabbitBroker(app_settings.RABBITMQ_URL)
 
+# --- Topic exchange с ключом по parameter_id: экземпляр API получает только параметры своих WebSocket-клиентов ---
 live_data_exchange_fastapi = RabbitExchange(
-    name=app_settings.RABBITMQ_LIVE_DATA_EXCHANGE_NAME,
-    type=ExchangeType.FANOUT,
+    name=app_settings.RABBITMQ_LIVE_DATA_TOPIC_EXCHANGE_NAME,
+    type=ExchangeType.TOPIC,
     durable=True
 )
 
@@ -28,36 +35,54 @@ websocket_consumer_queue = RabbitQueue(
 
 
 @websocket_consumer_broker.subscriber(queue=websocket_consumer_queue, exchange=live_data_exchange_fastapi)
-async def _consume_live_data_for_ws(data: dict):
-    """ Получает данные о значениях параметров из RabbitMQ и рассылает их соответствующим WebSocket-подписчикам """
-    print(f"[FastAPI]  Получил live data через RabbitMQ: {data}")
+async def _consume_live_data_for_ws(data: dict, message: RabbitMessage):
+    """ Получает данные о значениях параметров из RabbitMQ и рассылает их соответствующим WebSocket-подписчикам.
+    Кадр собирается один раз из сырого тела сообщения и разделяется всеми подписчиками (без повторного json.dumps).
+    Показание также обновляет кэш последних значений и попадает в горячее окно, пока у параметра есть подписчики. """
     parameter_id_val = data.get("parameter_id")
     if parameter_id_val is not None:
         try:
             parameter_id_int = int(parameter_id_val)
-            message_json = json.dumps(data)
-            await connection_manager.broadcast_to_parameter_subscribers(parameter_id_int, message_json)
-        except ValueError:
-            print(f"[FastAPI]  !!! ОШИБКА: Неверный формат parameter_id в сообщении: {parameter_id_val}")
+            connection_manager.broadcast_to_parameter_subscribers(LiveFrame.from_body(parameter_id_int, message.body))
+            if parameter_id_int in connection_manager.active_connections:
+                data_timestamp = datetime.datetime.fromisoformat(data["data_timestamp"])
+                parameter_value = float(data["parameter_value"])
+                last_value_cache.update(parameter_id_int, data_timestamp, parameter_value)
+                hot_window_store.append(parameter_id_int, data_timestamp, parameter_value)
+        except (KeyError, ValueError):
+            print(f"[FastAPI]  !!! ОШИБКА: Неверный формат сообщения (parameter_id={parameter_id_val}): {data}")
         except Exception as e_broadcast:
              print(f"[FastAPI]  !!! ОШИБКА во время рассылки для parameter_id {parameter_id_val}: {e_broadcast}")
     else:
         print(f"[FastAPI]  Получено сообщение без parameter_id: {data}")
 
 
+# --- Изменения таблиц оборудования из любого процесса приходят через PostgreSQL NOTIFY ---
+for hierarchy_table in HIERARCHY_TABLES:
+    cache_invalidation_listener.subscribe(hierarchy_table, equipment_hierarchy_index.mark_stale)
+cache_invalidation_listener.on_resync(equipment_hierarchy_index.mark_stale)
+for scope_table in ("shops", "lines"):  # Области видимости ссылаются на цехи и линии по имени и типу
+    cache_invalidation_listener.subscribe(scope_table, access_scope_cache.clear)
+cache_invalidation_listener.on_resync(access_scope_cache.clear)
+
+
 @asynccontextmanager
 async def lifespan(_app_instance: FastAPI):
     """ Управляет жизненным циклом WebSocket consumer-брокера в FastAPI.
     При запуске приложения инициализирует и запускает брокер, при остановке - корректно его закрывает. """
     print("[FastAPI]  Lifespan запускается...")
+    await cache_invalidation_listener.start()  # Индекс иерархии оборудования строится лениво при первой проверке доступа
     print("[FastAPI]  Попытка создать WebSocket consumer broker...")
     try:
-        await websocket_consumer_broker.connect()
+        connection = await websocket_consumer_broker.connect()
+        connection.reconnect_callbacks.add(hot_window_store.reset)  # После переподключения в горячем окне могут быть пропуски
+        connection.reconnect_callbacks.add(last_value_cache.expire_all)  # ...а live-значения кэша могли отстать от БД
         print(f"[FastAPI]  Объявляю exchange '{live_data_exchange_fastapi.name}' для WebSocket consumer...")
-        await websocket_consumer_broker.declare_exchange(live_data_exchange_fastapi)
+        robust_exchange = await websocket_consumer_broker.declare_exchange(live_data_exchange_fastapi)
         print(f"[FastAPI]  Объявляю очередь для WebSocket consumer...")
-        await websocket_consumer_broker.declare_queue(websocket_consumer_queue)
+        robust_queue = await websocket_consumer_broker.declare_queue(websocket_consumer_queue)
         print(f"[FastAPI]  Очередь для WebSocket consumer успешно объявлена.")
+        live_data_bindings.attach(robust_queue, robust_exchange)  # Привязки по parameter_id добавляются при подписке клиентов
         await websocket_consumer_broker.start()
         print("[FastAPI]  WebSocket consumer broker успешно запущен.")
     except Exception as e:
@@ -66,10 +91,12 @@ async def lifespan(_app_instance: FastAPI):
     print("- - - - - -\n[FastAPI]  Приложение FastAPI останавливается...")
     print("[FastAPI]  Попытка закрыть WebSocket consumer broker...")
     try:
+        await live_data_bindings.detach()
         await websocket_consumer_broker.close()
         print("[FastAPI]  WebSocket consumer broker успешно закрыт.")
     except Exception as e:
         print(f"[FastAPI]  !!! ОШИБКА при закрытии WebSocket consumer broker: {type(e).__name__} - {e}")
+    await cache_invalidation_listener.stop()
 
 
 # --- Описание приложения ---
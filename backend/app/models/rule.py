@@ -22,10 +22,14 @@ class MonitoringRule(Base):
     is_active: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default='true')
     comparison_operator: Mapped[str] = mapped_column(String(1), nullable=False)
     threshold: Mapped[float] = mapped_column(Float(precision=8), nullable=False)
+    deadband: Mapped[Optional[float]] = mapped_column(Float(precision=8))
+    min_duration_seconds: Mapped[Optional[int]] = mapped_column(Integer)
     created_at: Mapped[datetime.datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
 
     __table_args__ = (
         CheckConstraint("comparison_operator IN ('>', '<')", name='comparison_operator'),
+        CheckConstraint("deadband IS NULL OR deadband >= 0", name='deadband'),
+        CheckConstraint("min_duration_seconds IS NULL OR min_duration_seconds >= 0", name='min_duration_seconds'),
         UniqueConstraint('user_id', 'parameter_id', 'comparison_operator', 'threshold',
                          name='uq_monitoring_rules_user_parameter_operator_threshold'),
     )
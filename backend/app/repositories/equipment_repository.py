@@ -1,4 +1,4 @@
-from typing import cast, List, Optional
+from typing import cast, Dict, List, Optional
 
 from pydantic import BaseModel
 from sqlalchemy import distinct, select
@@ -132,6 +132,11 @@ class LineRepository(CRUDBase[Line, BaseModel, BaseModel]):
         result = db.execute(statement)
         return cast(List[int], result.scalars().all())
 
+    def get_shop_id_map(self, db: Session) -> Dict[int, int]:
+        """ Получает соответствие line_id -> shop_id для всех линий одним запросом """
+        result = db.execute(select(self.model.line_id, self.model.shop_id))
+        return {line_id: shop_id for line_id, shop_id in result.all()}
+
     def get_by_shop_and_ids(self, db: Session, *, shop_id: int, allowed_line_ids: List[int],
                             skip: int = 0, limit: int = 100) -> List[Line]:
         """ Получает линии для конкретного цеха, но только те, что есть в списке allowed_line_ids.
@@ -175,6 +180,11 @@ class AggregateRepository(CRUDBase[Aggregate, BaseModel, BaseModel]):
         result = db.execute(statement)
         return cast(List[Aggregate], result.scalars().all())
 
+    def get_line_id_map(self, db: Session) -> Dict[int, int]:
+        """ Получает соответствие aggregate_id -> line_id для всех агрегатов одним запросом """
+        result = db.execute(select(self.model.aggregate_id, self.model.line_id))
+        return {aggregate_id: line_id for aggregate_id, line_id in result.all()}
+
     def remove(self, db: Session, *, aggregate_id: int) -> Optional[Aggregate]:
         """ Удаляет агрегат по ID (с каскадным удалением актуаторов) """
         obj = self.get(db=db, aggregate_id=aggregate_id)
@@ -203,6 +213,11 @@ class ActuatorRepository(CRUDBase[Actuator, BaseModel, BaseModel]):
         result = db.execute(statement)
         return cast(List[Actuator], result.scalars().all())
 
+    def get_aggregate_id_map(self, db: Session) -> Dict[int, int]:
+        """ Получает соответствие actuator_id -> aggregate_id для всех актуаторов одним запросом """
+        result = db.execute(select(self.model.actuator_id, self.model.aggregate_id))
+        return {actuator_id: aggregate_id for actuator_id, aggregate_id in result.all()}
+
     def remove(self, db: Session, *, actuator_id: int) -> Optional[Actuator]:
         """ Удаляет актуатор по ID (с каскадным удалением параметров) """
         obj = self.get(db=db, actuator_id=actuator_id)
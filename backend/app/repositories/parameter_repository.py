@@ -1,8 +1,9 @@
 import datetime
-from typing import Any, cast, Dict, List, Optional, Union
+from typing import Any, cast, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 
 from pydantic import BaseModel
-from sqlalchemy import ColumnElement, select
+from sqlalchemy import any_, ARRAY, BigInteger, bindparam, cast as sql_cast, column, ColumnElement, Float, func, insert, Integer, Row, select, table, TIMESTAMP
+from sqlalchemy.sql.expression import TableClause
 from sqlalchemy.orm import joinedload, Session
 
 from app.models.equipment import AggregateType, ActuatorType, Shop, Line, Aggregate, Actuator  # noqa F401
@@ -51,6 +52,24 @@ class ParameterRepository(CRUDBase[Parameter, BaseModel, BaseModel]):
         result = db.execute(statement)
         return cast(List[Parameter], result.scalars().all())
 
+    def get_ids_by_actuator(self, db: Session, *, actuator_id: int) -> List[int]:
+        """ Получает ID всех параметров актуатора """
+        statement = select(self.model.parameter_id).where(self.model.actuator_id == actuator_id).order_by(self.model.parameter_id)
+        return cast(List[int], db.execute(statement).scalars().all())
+
+    def get_ids_by_aggregate(self, db: Session, *, aggregate_id: int) -> List[int]:
+        """ Получает ID всех параметров всех актуаторов агрегата одним запросом """
+        statement = (select(self.model.parameter_id)
+                     .join(Actuator, Actuator.actuator_id == self.model.actuator_id)
+                     .where(Actuator.aggregate_id == aggregate_id)
+                     .order_by(self.model.parameter_id))
+        return cast(List[int], db.execute(statement).scalars().all())
+
+    def get_actuator_id_map(self, db: Session) -> Dict[int, int]:
+        """ Получает соответствие parameter_id -> actuator_id для всех параметров одним запросом """
+        result = db.execute(select(self.model.parameter_id, self.model.actuator_id))
+        return {parameter_id: actuator_id for parameter_id, actuator_id in result.all()}
+
     def get_by_actuator_and_type(self, db: Session, *, actuator_id: int, parameter_type_id: int) -> Optional[Parameter]:
         """ Получает конкретный параметр по актуатору и типу """
         statement = (select(self.model)
@@ -59,6 +78,45 @@ class ParameterRepository(CRUDBase[Parameter, BaseModel, BaseModel]):
         result = db.execute(statement)
         return result.scalar_one_or_none()
 
+    def get_hierarchy_ids(self, db: Session, *, parameter_ids: List[int]) -> Dict[int, Tuple[int, int, int, int]]:
+        """ Получает (actuator_id, aggregate_id, line_id, shop_id) сразу для нескольких параметров одним запросом.
+        Несуществующие параметры в результат не попадают. """
+        if not parameter_ids:
+            return {}
+        statement = (
+            select(self.model.parameter_id, Actuator.actuator_id, Aggregate.aggregate_id, Line.line_id, Line.shop_id)
+            .join(Actuator, Actuator.actuator_id == self.model.actuator_id)
+            .join(Aggregate, Aggregate.aggregate_id == Actuator.aggregate_id)
+            .join(Line, Line.line_id == Aggregate.line_id)
+            .where(self.model.parameter_id == any_(_id_array(parameter_ids)))
+        )
+        result = db.execute(statement)
+        return {parameter_id: tuple(ids) for parameter_id, *ids in result.all()}
+
+    def _details_statement(self):
+        """ Строит запрос параметров с предзагрузкой всей иерархии оборудования,
+            необходимой для формирования сообщения тревоги """
+        return (
+            select(self.model)
+            .options(
+                joinedload(self.model.parameter_type),
+                joinedload(self.model.actuator).joinedload(Actuator.actuator_type),
+                joinedload(self.model.actuator).joinedload(Actuator.aggregate).joinedload(Aggregate.aggregate_type),
+                joinedload(self.model.actuator).joinedload(Actuator.aggregate).joinedload(Aggregate.line).joinedload(Line.shop)
+            )
+        )
+
+    def get_with_details(self, db: Session, *, parameter_id: int) -> Optional[Parameter]:
+        """ Получает параметр по ID со всей иерархией оборудования """
+        statement = self._details_statement().where(self.model.parameter_id == parameter_id)
+        result = db.execute(statement)
+        return result.scalar_one_or_none()
+
+    def get_all_with_details(self, db: Session) -> List[Parameter]:
+        """ Получает все параметры со всей иерархией оборудования одним запросом """
+        result = db.execute(self._details_statement())
+        return list(result.scalars().unique().all())
+
     def remove(self, db: Session, *, parameter_id: int) -> Optional[Parameter]:
         """ Удаляет параметр по ID (с каскадным удалением данных и правил) """
         obj = self.get(db=db, parameter_id=parameter_id)
@@ -74,6 +132,33 @@ class ParameterRepository(CRUDBase[Parameter, BaseModel, BaseModel]):
         return None
 
 
+# --- Непрерывные агрегаты TimescaleDB над parameter_data (см. main_script.sql), от самого грубого к самому мелкому ---
+class AggregateTier(NamedTuple):
+    interval: datetime.timedelta
+    view: TableClause
+
+
+def _aggregate_view(name: str) -> TableClause:
+    """ Описание представления непрерывного агрегата (без ORM-модели: только для чтения) """
+    return table(
+        name,
+        column("parameter_id", Integer), column("bucket_start", TIMESTAMP(timezone=True)),
+        column("min_value", Float), column("max_value", Float), column("avg_value", Float),
+        column("samples_count", BigInteger), column("last_value", Float)
+    )
+
+
+def _id_array(ids: List[int]):
+    """ Один параметр-массив для условия column = ANY(...) вместо раскрытия списка в IN (...) """
+    return bindparam("ids", list(ids), type_=ARRAY(Integer))
+
+
+AGGREGATE_TIERS = (
+    AggregateTier(datetime.timedelta(hours=1), _aggregate_view("parameter_data_1h")),
+    AggregateTier(datetime.timedelta(minutes=1), _aggregate_view("parameter_data_1m")),
+)
+
+
 # --- Репозиторий для данных параметров (Time-Series) ---
 class ParameterDataRepository(CRUDBase[ParameterData, ParameterDataCreate, BaseModel]):
 
@@ -81,6 +166,17 @@ class ParameterDataRepository(CRUDBase[ParameterData, ParameterDataCreate, BaseM
         """ Инициализация репозитория моделью ParameterData (конструктор базового класса) """
         super().__init__(model)
 
+    def bulk_create(self, db: Session, *, objs_in: List[ParameterDataCreate]) -> List[int]:
+        """ Массово создаёт записи данных параметров одним multi-row INSERT и одним commit.
+        Возвращает список parameter_data_id в том же порядке, что и objs_in. """
+        if not objs_in:
+            return []
+        statement = insert(self.model).returning(self.model.parameter_data_id, sort_by_parameter_order=True)
+        result = db.execute(statement, [obj_in.model_dump() for obj_in in objs_in])
+        created_ids = cast(List[int], result.scalars().all())
+        db.commit()
+        return created_ids
+
     def get_latest(self, db: Session, *, parameter_id: int) -> Optional[ParameterData]:
         """ Получает самую последнюю запись для параметра """
         statement = (select(self.model).where(self.model.parameter_id == parameter_id)
@@ -88,6 +184,17 @@ class ParameterDataRepository(CRUDBase[ParameterData, ParameterDataCreate, BaseM
         result = db.execute(statement)
         return result.scalar_one_or_none()
 
+    def get_latest_many(self, db: Session, *, parameter_ids: List[int], since: datetime.datetime) -> List[Row]:
+        """ Получает последнее показание сразу для нескольких параметров одним запросом (DISTINCT ON).
+        since ограничивает просматриваемые чанки гипертаблицы: параметры без данных после since в результат не попадают.
+        Каждая строка: parameter_id, data_timestamp, parameter_value """
+        statement = (select(self.model.parameter_id, self.model.data_timestamp, self.model.parameter_value)
+                     .distinct(self.model.parameter_id)
+                     .where(self.model.parameter_id == any_(_id_array(parameter_ids)),
+                            self.model.data_timestamp >= since)
+                     .order_by(self.model.parameter_id, self.model.data_timestamp.desc()))
+        return cast(List[Row], db.execute(statement).all())
+
     def get_range(self, db: Session, *, parameter_id: int,
                   start_time: datetime.datetime, end_time: datetime.datetime,
                   limit: Optional[int] = None) -> List[ParameterData]:
@@ -102,19 +209,118 @@ class ParameterDataRepository(CRUDBase[ParameterData, ParameterDataCreate, BaseM
         result = db.execute(statement)
         return cast(List[ParameterData], result.scalars().all())
 
-    def get_by_data_id_with_details(self, db: Session, *, parameter_data_id: int) -> Optional[ParameterData]:
-        """ Получает запись ParameterData по ее parameter_data_id
-            с предзагрузкой всех связанных данных, необходимых для формирования сообщения тревоги """
-        statement = (
-            select(self.model)
-            .options(
-        joinedload(self.model.parameter).joinedload(Parameter.parameter_type),
-                joinedload(self.model.parameter).joinedload(Parameter.actuator).joinedload(Actuator.actuator_type),
-                joinedload(self.model.parameter).joinedload(Parameter.actuator).joinedload(Actuator.aggregate).joinedload(Aggregate.aggregate_type),
-                joinedload(self.model.parameter).joinedload(Parameter.actuator).joinedload(Actuator.aggregate).joinedload(Aggregate.line).joinedload(Line.shop)
-            )
-            .where(self.model.parameter_data_id == parameter_data_id)
-        )
+    def get_page(self, db: Session, *, parameter_id: int,
+                 start_time: datetime.datetime, end_time: datetime.datetime,
+                 after: Optional[datetime.datetime], limit: int) -> List[ParameterData]:
+        """ Получает страницу данных по ключу (parameter_id, data_timestamp) - как в первичном ключе pk_parameter_data.
+        after - метка времени последней записи предыдущей страницы (None - первая страница).
+        Каждая страница - сканирование диапазона индекса, стоимость не зависит от номера страницы """
+        statement = (select(self.model)
+                     .where(self.model.parameter_id == parameter_id,
+                            self.model.data_timestamp >= start_time,
+                            self.model.data_timestamp <= end_time)
+                     .order_by(self.model.data_timestamp.asc())
+                     .limit(limit))
+        if after is not None:
+            statement = statement.where(self.model.data_timestamp > after)
+        result = db.execute(statement)
+        return cast(List[ParameterData], result.scalars().all())
+
+    def get_range_columns(self, db: Session, *, parameter_id: int,
+                          start_time: datetime.datetime, end_time: datetime.datetime,
+                          limit: Optional[int] = None) -> List[Row]:
+        """ Получает только (epoch_us, parameter_value) за диапазон, без создания ORM-объектов и datetime
+        (для прореживания и колоночного формата).
+        epoch_us - метка времени в микросекундах от эпохи, посчитанная в БД """
+        epoch_us = sql_cast(func.extract("epoch", self.model.data_timestamp) * 1000000, BigInteger).label("epoch_us")
+        statement = (select(epoch_us, self.model.parameter_value)
+                     .where(self.model.parameter_id == parameter_id,
+                            self.model.data_timestamp >= start_time,
+                            self.model.data_timestamp <= end_time)
+                     .order_by(self.model.data_timestamp.asc()))
+        if limit:
+            statement = statement.limit(limit)
+        return cast(List[Row], db.execute(statement).all())
+
+    def stream_range(self, db: Session, *, parameter_id: int,
+                     start_time: datetime.datetime, end_time: datetime.datetime,
+                     chunk_size: int) -> Iterator[Sequence[Row]]:
+        """ Потоково читает (data_timestamp, parameter_value) за диапазон через серверный курсор.
+        Отдаёт пачки по chunk_size кортежей: в памяти не бывает больше одной пачки, ORM-объекты не создаются """
+        statement = (select(self.model.data_timestamp, self.model.parameter_value)
+                     .where(self.model.parameter_id == parameter_id,
+                            self.model.data_timestamp >= start_time,
+                            self.model.data_timestamp <= end_time)
+                     .order_by(self.model.data_timestamp.asc())
+                     .execution_options(stream_results=True, yield_per=chunk_size))
+        yield from db.execute(statement).partitions()
+
+    def get_range_many_columns(self, db: Session, *, parameter_ids: List[int],
+                               start_time: datetime.datetime, end_time: datetime.datetime,
+                               limit: Optional[int] = None) -> List[Row]:
+        """ Получает (parameter_id, epoch_us, parameter_value) сразу для нескольких параметров одним сканированием
+        (parameter_id = ANY(...)), упорядоченные по parameter_id и времени. limit ограничивает общее число строк. """
+        epoch_us = sql_cast(func.extract("epoch", self.model.data_timestamp) * 1000000, BigInteger).label("epoch_us")
+        statement = (select(self.model.parameter_id, epoch_us, self.model.parameter_value)
+                     .where(self.model.parameter_id == any_(_id_array(parameter_ids)),
+                            self.model.data_timestamp >= start_time,
+                            self.model.data_timestamp <= end_time)
+                     .order_by(self.model.parameter_id.asc(), self.model.data_timestamp.asc()))
+        if limit:
+            statement = statement.limit(limit)
+        return cast(List[Row], db.execute(statement).all())
+
+    def get_buckets(self, db: Session, *, parameter_id: int,
+                    start_time: datetime.datetime, end_time: datetime.datetime,
+                    bucket: datetime.timedelta) -> List[Row]:
+        """ Агрегирует данные одного параметра за диапазон по интервалам bucket (см. get_buckets_many) """
+        return self.get_buckets_many(db=db, parameter_ids=[parameter_id], start_time=start_time, end_time=end_time, bucket=bucket)
+
+    def get_buckets_many(self, db: Session, *, parameter_ids: List[int],
+                         start_time: datetime.datetime, end_time: datetime.datetime,
+                         bucket: datetime.timedelta) -> List[Row]:
+        """ Агрегирует данные параметров за диапазон по интервалам bucket средствами TimescaleDB (time_bucket), одним запросом.
+        Читает самый грубый непрерывный агрегат, интервал которого делит bucket нацело (иначе - сырые данные).
+        На агрегатах границы диапазона округляются до интервала агрегата.
+        Каждая строка: parameter_id, bucket_start, min_value, max_value, avg_value, samples_count, last_value """
+        tier = next((t for t in AGGREGATE_TIERS if bucket % t.interval == datetime.timedelta(0)), None)
+        if tier is None:
+            bucket_start = func.time_bucket(bucket, self.model.data_timestamp).label("bucket_start")
+            statement = (select(self.model.parameter_id,
+                                bucket_start,
+                                func.min(self.model.parameter_value).label("min_value"),
+                                func.max(self.model.parameter_value).label("max_value"),
+                                func.avg(self.model.parameter_value).label("avg_value"),
+                                func.count().label("samples_count"),
+                                func.last(self.model.parameter_value, self.model.data_timestamp).label("last_value"))
+                         .where(self.model.parameter_id == any_(_id_array(parameter_ids)),
+                                self.model.data_timestamp >= start_time,
+                                self.model.data_timestamp <= end_time)
+                         .group_by(self.model.parameter_id, bucket_start)
+                         .order_by(self.model.parameter_id.asc(), bucket_start.asc()))
+            return cast(List[Row], db.execute(statement).all())
+
+        # Свёртка готовых интервалов агрегата: среднее взвешивается по количеству показаний
+        view = tier.view.c
+        bucket_start = func.time_bucket(bucket, view.bucket_start).label("bucket_start")
+        samples_count = func.sum(view.samples_count)
+        statement = (select(view.parameter_id,
+                            bucket_start,
+                            func.min(view.min_value).label("min_value"),
+                            func.max(view.max_value).label("max_value"),
+                            (func.sum(view.avg_value * view.samples_count) / samples_count).label("avg_value"),
+                            samples_count.label("samples_count"),
+                            func.last(view.last_value, view.bucket_start).label("last_value"))
+                     .where(view.parameter_id == any_(_id_array(parameter_ids)),
+                            view.bucket_start >= start_time,
+                            view.bucket_start <= end_time)
+                     .group_by(view.parameter_id, bucket_start)
+                     .order_by(view.parameter_id.asc(), bucket_start.asc()))
+        return cast(List[Row], db.execute(statement).all())
+
+    def get_by_data_id(self, db: Session, *, parameter_data_id: int) -> Optional[ParameterData]:
+        """ Получает запись ParameterData по её parameter_data_id (без связанных данных) """
+        statement = select(self.model).where(self.model.parameter_data_id == parameter_data_id)
         result = db.execute(statement)
         return result.scalar_one_or_none()
 
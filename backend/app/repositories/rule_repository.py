@@ -1,6 +1,6 @@
 from typing import Optional, List, cast
 
-from sqlalchemy import select, update as sqlalchemy_update
+from sqlalchemy import insert, select, update as sqlalchemy_update
 from sqlalchemy.orm import Session
 
 from app.models.rule import Alert, MonitoringRule
@@ -44,6 +44,12 @@ class MonitoringRuleRepository(CRUDBase[MonitoringRule, RuleCreate, RuleUpdate])
         result = db.execute(statement)
         return cast(List[MonitoringRule], result.scalars().all())
 
+    def get_all_active(self, db: Session) -> List[MonitoringRule]:
+        """ Получает ВСЕ АКТИВНЫЕ правила всех параметров (для построения индекса правил в воркере) """
+        statement = select(self.model).where(self.model.is_active == True)
+        result = db.execute(statement)
+        return cast(List[MonitoringRule], result.scalars().all())
+
     def create_with_owner(self, db: Session, *, obj_in: RuleCreate, user_id: int) -> MonitoringRule:
         """ Создаёт новое правило, указав владельца """
         obj_in_data = obj_in.model_dump()
@@ -108,6 +114,35 @@ class AlertRepository(CRUDBase[Alert, AlertCreateInternal, AlertUpdate]):
         result = db.execute(statement)
         return cast(List[Alert], result.scalars().all())
 
+    def bulk_create(self, db: Session, *, objs_in: List[AlertCreateInternal]) -> List[Optional[int]]:
+        """ Массово создаёт тревоги одним multi-row INSERT ... RETURNING alert_id и одним commit.
+        Если пачка не вставилась, вставляет строки по одной в savepoint-ах: ошибка одной строки не откатывает остальные.
+        Возвращает alert_id (или None для невставленной строки) в том же порядке, что и objs_in. """
+        if not objs_in:
+            return []
+        rows = [obj_in.model_dump() for obj_in in objs_in]
+
+        try:
+            statement = insert(self.model).returning(self.model.alert_id, sort_by_parameter_order=True)
+            created_ids = cast(List[Optional[int]], list(db.execute(statement, rows).scalars().all()))
+            db.commit()
+            return created_ids
+        except Exception as e_bulk:
+            print(f"Ошибка при массовом создании {len(rows)} Alert: {e_bulk}. Вставляю по одной...")
+            db.rollback()
+
+        created_ids = []
+        single_statement = insert(self.model).returning(self.model.alert_id)
+        for row in rows:
+            try:
+                with db.begin_nested():  # Savepoint: откатывается только эта строка
+                    created_ids.append(db.execute(single_statement, row).scalar_one())
+            except Exception as e_row:
+                print(f"Ошибка при создании Alert для rule_id = {row['rule_id']}: {e_row}")
+                created_ids.append(None)
+        db.commit()
+        return created_ids
+
     def mark_as_read(self, db: Session, *, db_obj: Alert) -> Alert:
         """ Отмечает тревогу как прочитанную """
         return self.update(db=db, db_obj=db_obj, obj_in={"is_read": True})
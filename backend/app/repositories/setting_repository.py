@@ -1,8 +1,10 @@
-from typing import Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from app.models.enums import AlarmTypesEnum
 from app.models.setting import UserSetting
 from app.repositories.base import CRUDBase
 from app.schemas.setting import SettingUpdate
@@ -28,6 +30,15 @@ class UserSettingRepository(CRUDBase[UserSetting, BaseModel, SettingUpdate]):
         db.refresh(new_settings)
         return new_settings
 
+    def get_alarm_types_by_user_ids(self, db: Session, *, user_ids: List[int]) -> Dict[int, List[AlarmTypesEnum]]:
+        """ Получает alarm_types сразу для нескольких пользователей одним запросом.
+        Пользователи без записи настроек в результат не попадают. """
+        if not user_ids:
+            return {}
+        statement = select(self.model.user_id, self.model.alarm_types).where(self.model.user_id.in_(user_ids))
+        result = db.execute(statement)
+        return {user_id: list(alarm_types) for user_id, alarm_types in result.all()}
+
 
 # --- Экземпляр репозитория ---
 setting_repository = UserSettingRepository(UserSetting)
\ No newline at end of file
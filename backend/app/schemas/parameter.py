@@ -1,5 +1,5 @@
 import datetime
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel
 
@@ -69,8 +69,49 @@ class ParameterDataCreate(ParameterDataBase):
 
 # --- Схема для чтения временных данных параметра ---
 class ParameterDataRead(ParameterDataBase):
-    parameter_data_id: int  # На всякий случай
+    parameter_data_id: Optional[int] = None  # None для показаний из горячего окна API (ещё не прочитанных из БД)
 
     model_config = {
         "from_attributes": True
-    }
\ No newline at end of file
+    }
+
+
+# --- Схема для последнего значения параметра ---
+class ParameterLatestRead(BaseModel):
+    parameter_id: int
+    parameter_value: Optional[float] = None  # None - за последние LAST_VALUE_LOOKBACK_HOURS показаний не было
+    data_timestamp: Optional[datetime.datetime] = None
+
+
+# --- Схема для страницы временных данных параметра (keyset-пагинация) ---
+class ParameterDataPageRead(BaseModel):
+    items: List[ParameterDataRead]
+    next_cursor: Optional[str] = None  # Передаётся в ?cursor= для следующей страницы; None - данных больше нет
+
+
+# --- Схема для агрегированного интервала временного ряда (прореживание ?bucket=) ---
+class ParameterDataBucketRead(BaseModel):
+    parameter_id: int
+    bucket_start: datetime.datetime
+    min_value: float
+    max_value: float
+    avg_value: float
+    samples_count: int
+    last_value: float
+
+    model_config = {
+        "from_attributes": True
+    }
+
+
+# --- Схема для ряда одного параметра в пакетном ответе (столбцами, без повторения полей на каждой точке) ---
+class ParameterSeriesRead(BaseModel):
+    parameter_id: int
+    data_timestamps: Optional[List[datetime.datetime]] = None  # Только для сырых данных; при выравнивании - общая сетка bucket_starts
+    parameter_values: List[Optional[float]]  # При выравнивании: среднее за интервал или None, если данных нет
+
+
+# --- Схема пакетного ответа по нескольким параметрам ---
+class ParameterDataBatchRead(BaseModel):
+    bucket_starts: Optional[List[datetime.datetime]] = None  # Общая временная сетка (только при ?bucket=)
+    series: List[ParameterSeriesRead]
\ No newline at end of file
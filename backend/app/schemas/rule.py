@@ -17,6 +17,8 @@ class RuleBase(BaseModel):
     rule_name: Optional[str] = Field(None, max_length=110)
     comparison_operator: str = Field(..., pattern=r"^(<|>)$", max_length=1)
     threshold: float
+    deadband: Optional[float] = Field(None, ge=0)  # Гистерезис: тревога снимается, только когда значение отойдёт от порога на deadband
+    min_duration_seconds: Optional[int] = Field(None, ge=0)  # Тревога поднимается, только если нарушение длится не меньше этого времени
     is_active: bool = True
 
 
@@ -41,6 +43,8 @@ class RuleUpdate(BaseModel):
     rule_name: Optional[str] = Field(None, max_length=110)
     comparison_operator: Optional[str] = Field(default=None, pattern=r"^(<|>)$", max_length=1)
     threshold: Optional[float] = None
+    deadband: Optional[float] = Field(default=None, ge=0)
+    min_duration_seconds: Optional[int] = Field(default=None, ge=0)
     is_active: Optional[bool] = None
 
 
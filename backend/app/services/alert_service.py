@@ -1,4 +1,5 @@
-from typing import List, Optional
+import datetime
+from typing import List, Optional, Tuple
 
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
@@ -7,9 +8,11 @@ from app.db.session import SessionLocal
 from app.models.parameter import ParameterData  # noqa F401
 from app.models.rule import Alert, MonitoringRule  # noqa F401
 from app.models.user import User
-from app.repositories.parameter_repository import parameter_data_repository
-from app.repositories.rule_repository import rule_repository, alert_repository
+from app.repositories.rule_repository import alert_repository
 from app.schemas.rule import AlertCreateInternal
+from app.services.notification_service import AlertNotification, notification_dispatcher
+from app.services.parameter_context import ParameterContext, parameter_context_cache
+from app.services.rule_engine import alert_state_tracker, IndexedRule, rule_index
 
 
 '''
@@ -19,111 +22,81 @@ from app.schemas.rule import AlertCreateInternal
 '''
 
 
-# --- Сервис уведомлений (заглушка) ---
-# TODO: КАК МОЖНО СКОРЕЕ нужно убрать заглушку. Возможно, эта функция будет асинхронной.
-def _send_notification(user_id: int, message: str):
-    """ Отправляет уведомление пользователю (заглушка) """
-    print(f"--- УВЕДОМЛЕНИЕ ДЛЯ User {user_id} ---")
-    print(message)
-    print(f"--------------------------------------")
+def _build_alert_message(context: Optional[ParameterContext], rule: IndexedRule, value: float) -> str:
+    """ Формирует текст сообщения тревоги по готовому контексту параметра и нарушенному правилу (без обращений к ORM) """
+    if context is None:
+        return f"Тревога по правилу с ID = {rule.rule_id}: значение {value:.2f} {rule.comparison_operator} {rule.threshold}"
+
+    path_str, param_name_str, unit_str = context
+    # rule_name_str = f"'{rule.rule_name}'" if rule.rule_name else f"(ID: {rule.rule_id})"  # Решил, что не стоит использовать rule_name
+    return (    f"Тревога! [{path_str}]: "
+                f"Параметр '{param_name_str}' = {value:.2f} {unit_str} "
+                f"нарушил правило ({rule.comparison_operator} {rule.threshold} {unit_str})"
+    )[:250]
+
+
+def _to_unix_seconds(moment: datetime.datetime) -> float:
+    """ Переводит метку времени в Unix-время. Наивное время считается UTC (как в БД), а не местным временем процесса """
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+# --- Нарушение правила: (правило, parameter_id, значение, parameter_data_id) ---
+Violation = Tuple[IndexedRule, int, float, int]
+
+
+def _create_alerts(db: Session, violations: List[Violation]) -> List[AlertNotification]:
+    """ Создаёт тревоги по всем нарушениям одной вставкой и одним commit.
+    Возвращает успешно созданные тревоги для отправки уведомлений. """
+    alerts_in = []
+    for rule, parameter_id, parameter_value, parameter_data_id in violations:
+        print(f"[Alert_Service]  Правило с ID = {rule.rule_id} НАРУШЕНО для ParameterData с ID = {parameter_data_id}")
+        alerts_in.append(AlertCreateInternal(
+            rule_id=rule.rule_id,
+            parameter_data_id=parameter_data_id,
+            alert_message=_build_alert_message(parameter_context_cache.get(db, parameter_id), rule, parameter_value)
+        ))
+
+    created_ids = alert_repository.bulk_create(db=db, objs_in=alerts_in)
+
+    alerts_created = []
+    for (rule, *_), alert_in, alert_id in zip(violations, alerts_in, created_ids):
+        if alert_id is None:
+            continue
+        alerts_created.append(AlertNotification(alert_id=alert_id, user_id=rule.user_id, message=alert_in.alert_message))
+    print(f"[Alert_Service]  Создано тревог: {len(alerts_created)} из {len(violations)}")
+    return alerts_created
 
 
 # --- Основная логика обработки новых данных ---
-def process_new_parameter_data(parameter_data_id: int) -> None:
-    """ Обрабатывает новую запись данных параметра: проверяет правила и создает тревоги.
-    Эта функция вызывается фоновым воркером (alert_worker.py). """
-    db: Session | None = None
-    print(f"[Alert_Service]  Обработка ParameterData с ID = {parameter_data_id}")
+def process_parameter_readings_batch(*, parameter_ids: List[int], parameter_values: List[float],
+                                     data_timestamps: List[datetime.datetime], parameter_data_ids: List[int]) -> None:
+    """ Проверяет правила мониторинга сразу для пачки показаний: одна векторная проверка и одна сессия БД.
+    Тревога создаётся только при переходе правила из NORMAL в ALARM (с учётом deadband и min_duration_seconds). """
+    db = SessionLocal()
     try:
-        # 1. Получает запись ParameterData с предзагруженными деталями
-        db = SessionLocal()
-        data_entry = parameter_data_repository.get_by_data_id_with_details(
-            db=db, parameter_data_id=parameter_data_id
-        )
+        # 1. Убеждается, что индекс правил загружен и не устарел
+        rule_index.ensure_fresh(db)
 
-        if not data_entry:
-            print(f"[Alert_Service]  Ошибка: Запись ParameterData с ID = {parameter_data_id} не найдена.")
-            return
-        if not data_entry.parameter:
-            print(f"[Alert_Service]  Ошибка: Связанный Parameter для ParameterData с ID = {parameter_data_id} не найден.")
-            return
-
-        # 2. Получает активные правила для этого параметра
-        active_rules = rule_repository.get_active_by_parameter(
-            db=db, parameter_id=data_entry.parameter_id
+        # 2. Прогоняет всю пачку через машину состояний тревог за один проход
+        transitions = alert_state_tracker.process_batch(
+            parameter_ids, parameter_values, [_to_unix_seconds(ts) for ts in data_timestamps]
         )
-
-        if not active_rules:
-            print(f"[Alert_Service]  Нет активных правил для parameter_id: {data_entry.parameter_id}")
+        print(f"[Alert_Service]  Пачка из {len(parameter_ids)} показаний проверена: новых тревог - {len(transitions)}")
+        if not transitions:
             return
 
-        value_to_check = data_entry.parameter_value
-        alerts_created_this_run = []
-
-        # 3. Проверяет каждое активное правило
-        for rule in active_rules:
-            threshold = rule.threshold
-            operator = rule.comparison_operator
-            rule_violated = False
-
-            if operator == '>' and value_to_check > threshold:
-                rule_violated = True
-            elif operator == '<' and value_to_check < threshold:
-                rule_violated = True
-
-            if rule_violated:
-                print(f"[Alert_Service]  Правило с ID = {rule.rule_id} НАРУШЕНО для ParameterData с ID = {parameter_data_id}")
-                try:
-                    param = data_entry.parameter
-                    param_type = param.parameter_type
-                    actuator = param.actuator
-                    actuator_type = actuator.actuator_type
-                    aggregate = actuator.aggregate
-                    aggregate_type = aggregate.aggregate_type
-                    line = aggregate.line
-                    shop = line.shop
-
-                    param_name_str = param_type.parameter_type_name if param_type else "N/A"
-                    unit_str = param_type.parameter_unit or "" if param_type else ""
-                    act_type_str = actuator_type.actuator_type_name if actuator_type else "N/A"
-                    agg_type_str = aggregate_type.aggregate_type_name if aggregate_type else "N/A"
-                    line_type_str = line.line_type.value if line else "N/A"
-                    shop_name_str = shop.shop_name if shop else "N/A"
-                    # rule_name_str = f"'{rule.rule_name}'" if rule.rule_name else f"(ID: {rule.rule_id})"  # Решил, что не стоит использовать rule_name
-
-                    alert_message = (   f"Тревога! [{shop_name_str} / {line_type_str}  линия / {agg_type_str} / {act_type_str}]: "
-                                        f"Параметр '{param_name_str}' = {value_to_check:.2f} {unit_str} "
-                                        f"нарушил правило ({operator} {threshold} {unit_str})"
-                    )[:250]
-                except AttributeError as e:
-                    print(f"[Alert_Service]  Ошибка при формировании сообщения: {e}")
-                    alert_message = f"Тревога по правилу с ID = {rule.rule_id}: значение {value_to_check:.2f} {operator} {threshold}"
-
-                # Подготовка данных для создания Alert
-                alert_create_data = AlertCreateInternal(
-                    rule_id=rule.rule_id,
-                    parameter_data_id=data_entry.parameter_data_id,
-                    alert_message=alert_message
-                )
-
-                # Создание записи Alert
-                try:
-                    created_alert = alert_repository.create(db=db, obj_in=alert_create_data)
-                    alerts_created_this_run.append({"alert_obj": created_alert, "user_id": rule.user_id})
-                    print(f"[Alert_Service]  Создана тревога с ID = {created_alert.alert_id} для пользователя с ID = {rule.user_id}")
-                except Exception as e_create:
-                    print(f"[Alert_Service]  Ошибка создания записи Alert для rule_id = {rule.rule_id}: {e_create}")
-                    db.rollback()
-
-        # 4. Отправка уведомлений (ПОСЛЕ всех проверок и создания алертов)
-        # Пока отправляет по одному.
-        for alert_info in alerts_created_this_run:
-            _send_notification(user_id=alert_info["user_id"], message=alert_info["alert_obj"].alert_message)
-
-        print(f"[Alert_Service]  Обработка ParameterData с ID = {parameter_data_id} завершена.")
+        # 3. Создаёт тревоги по всем переходам в ALARM одной вставкой
+        alerts_created_this_run = _create_alerts(db, [
+            (rule, parameter_ids[reading_idx], parameter_values[reading_idx], parameter_data_ids[reading_idx])
+            for reading_idx, rule in transitions
+        ])
+
+        # 4. Передаёт тревоги диспетчеру уведомлений (доставка идёт в фоне и не задерживает проверку правил)
+        notification_dispatcher.submit(alerts_created_this_run)
     finally:
-        if db:
-            db.close()
+        db.close()
 
 
 '''
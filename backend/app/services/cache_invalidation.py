@@ -0,0 +1,210 @@
+import asyncio, json
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from app.core.config import settings
+
+
+# --- Типы обработчиков событий ---
+RowChangeHandler = Callable[[str, Optional[Dict[str, Any]]], None]  # (op: 'INSERT' | 'UPDATE' | 'DELETE' | 'TRUNCATE', row: dict или None для триггеров FOR EACH STATEMENT)
+ResyncHandler = Callable[[], None]  # Полная перезагрузка кэша (выполняется в executor, может ходить в БД)
+
+
+# --- Слушатель событий инвалидации кэшей (PostgreSQL LISTEN/NOTIFY) ---
+class CacheInvalidationListener:
+    def __init__(self, channel: str, check_interval_seconds: float, reconnect_delay_seconds: float = 5.0):
+        """ Слушает канал channel, в который триггеры БД публикуют изменения строк (см. notify_cache_invalidation в main_script.sql).
+        Каждое событие несёт номер версии своей таблицы (cache_invalidation_versions): номера идут подряд в порядке
+        коммитов, поэтому разрыв в них означает пропущенное событие. Раз в check_interval_seconds номера сверяются с БД,
+        чтобы заметить и пропуск последнего события. """
+        self.channel = channel
+        self.check_interval_seconds = check_interval_seconds
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self._row_handlers: Dict[str, List[RowChangeHandler]] = {}
+        self._resync_handlers: List[ResyncHandler] = []
+        self._connection: Optional[Any] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._check_task: Optional[asyncio.Task] = None
+        self._versions: Dict[str, int] = {}  # Последняя полученная версия по каждой таблице
+        self._stopped = False
+
+    def subscribe(self, table_name: str, handler: RowChangeHandler) -> None:
+        """ Регистрирует обработчик изменений строк таблицы table_name (вызывается в event loop, должен быть быстрым) """
+        self._row_handlers.setdefault(table_name, []).append(handler)
+
+    def on_resync(self, handler: ResyncHandler) -> None:
+        """ Регистрирует обработчик полной перезагрузки: вызывается при пропуске событий, после переподключения и при ошибке обработки события """
+        self._resync_handlers.append(handler)
+
+    async def start(self) -> bool:
+        """ Подключается к БД и начинает слушать канал. Возвращает False, если подключиться не удалось
+        (в этом случае попытки переподключения продолжаются в фоне) """
+        self._loop = asyncio.get_running_loop()
+        self._stopped = False
+        if self._check_task is None or self._check_task.done():
+            self._check_task = self._loop.create_task(self._check_loop())
+        if self._connect():
+            return True
+        self._schedule_reconnect()
+        return False
+
+    async def stop(self) -> None:
+        """ Прекращает слушать канал и закрывает соединение """
+        self._stopped = True
+        for task in (self._reconnect_task, self._check_task):
+            if task is not None:
+                task.cancel()
+        self._reconnect_task = self._check_task = None
+        self._disconnect()
+        print(f"[Cache_Invalidation]  Прослушивание канала '{self.channel}' остановлено.")
+
+    def _connect(self) -> bool:
+        """ Открывает отдельное autocommit-соединение, выполняет LISTEN, запоминает текущие версии таблиц
+        и регистрирует соединение в event loop """
+        try:
+            connection = psycopg2.connect(
+                dbname=settings.DB_NAME, user=settings.DB_USER, password=settings.DB_PASSWORD,
+                host=settings.DB_HOST, port=settings.DB_PORT
+            )
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel};")
+                versions = self._fetch_versions(connection)  # После LISTEN: более новые события уже придут в канал
+        except psycopg2.Error as e:
+            print(f"[Cache_Invalidation]  !!! ОШИБКА подключения к каналу '{self.channel}': '{type(e).__name__}' - '{e}'")
+            return False
+
+        self._connection = connection
+        self._versions = versions
+        self._loop.add_reader(connection.fileno(), self._on_readable)
+        print(f"[Cache_Invalidation]  Слушаю канал '{self.channel}'.")
+        return True
+
+    def _disconnect(self) -> None:
+        """ Снимает соединение с event loop и закрывает его """
+        if self._connection is None:
+            return
+        try:
+            self._loop.remove_reader(self._connection.fileno())
+        except Exception:  # Соединение могло уже закрыться вместе с дескриптором
+            pass
+        try:
+            self._connection.close()
+        except psycopg2.Error:
+            pass
+        self._connection = None
+
+    def _schedule_reconnect(self) -> None:
+        """ Запускает фоновые попытки переподключения (если они ещё не запущены) """
+        if self._stopped or (self._reconnect_task is not None and not self._reconnect_task.done()):
+            return
+        self._reconnect_task = self._loop.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self) -> None:
+        """ Переподключается к каналу до успеха, затем запускает полную перезагрузку кэшей """
+        while not self._stopped:
+            await asyncio.sleep(self.reconnect_delay_seconds)
+            if self._connect():
+                await self._run_resync("переподключение к каналу")
+                return
+
+    @staticmethod
+    def _fetch_versions(connection) -> Dict[str, int]:
+        """ Читает текущие версии всех таблиц. Уведомления, закоммиченные до этого запроса, psycopg2 к его концу
+        уже сложил в connection.notifies """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT table_name, version FROM cache_invalidation_versions;")
+            return {table_name: int(version) for table_name, version in cursor.fetchall()}
+
+    def _on_readable(self) -> None:
+        """ Забирает пришедшие уведомления и передаёт их обработчикам """
+        try:
+            self._connection.poll()
+        except psycopg2.Error as e:
+            self._on_connection_error(e)
+            return
+        self._drain_notifies()
+
+    def _drain_notifies(self) -> None:
+        """ Передаёт обработчикам все уже полученные уведомления """
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            self._handle_payload(notify.payload)
+
+    def _on_connection_error(self, error: psycopg2.Error) -> None:
+        """ Закрывает сломанное соединение и запускает переподключение (после него - полная перезагрузка) """
+        print(f"[Cache_Invalidation]  !!! ОШИБКА соединения с каналом '{self.channel}': '{type(error).__name__}' - '{error}'. Переподключаюсь...")
+        self._disconnect()
+        self._schedule_reconnect()
+
+    async def _check_loop(self) -> None:
+        """ Периодически сверяет версии таблиц в БД с полученными событиями """
+        while not self._stopped:
+            await asyncio.sleep(self.check_interval_seconds)
+            if self._connection is not None:
+                self._check_versions()
+
+    def _check_versions(self) -> None:
+        """ Сначала обрабатывает события, закоммиченные до чтения версий, затем ищет таблицы,
+        версия которых в БД ушла дальше последнего полученного события """
+        try:
+            versions = self._fetch_versions(self._connection)
+        except psycopg2.Error as e:
+            self._on_connection_error(e)
+            return
+        self._drain_notifies()
+
+        lagging = sorted(t for t, version in versions.items() if version > self._versions.get(t, 0))
+        if lagging:
+            self._versions.update(versions)
+            self._loop.create_task(self._run_resync(f"пропущены события таблиц {', '.join(lagging)}"))
+
+    def _handle_payload(self, payload: str) -> None:
+        """ Разбирает событие, проверяет непрерывность версий его таблицы и применяет изменение строки.
+        Версия таблицы увеличивается под блокировкой строки до COMMIT, поэтому события одной таблицы
+        приходят строго с номерами подряд, а откаченные транзакции номер не расходуют. """
+        try:
+            event = json.loads(payload)
+            table_name = event["table"]
+            op = event["op"]
+            row = event["row"]
+            version = int(event["version"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[Cache_Invalidation]  !!! ОШИБКА разбора события '{payload}': '{e}'. Запускаю полную перезагрузку.")
+            self._loop.create_task(self._run_resync("некорректное событие"))
+            return
+
+        last_version = self._versions.get(table_name, 0)
+        has_gap = version > last_version + 1  # Версии не больше last_version уже учтены при подключении
+        self._versions[table_name] = max(last_version, version)
+
+        handler_failed = False
+        for handler in self._row_handlers.get(table_name, []):
+            try:
+                handler(op, row)
+            except Exception as e_handler:
+                print(f"[Cache_Invalidation]  !!! ОШИБКА обработчика события {op} {table_name}: '{type(e_handler).__name__}' - '{e_handler}'")
+                handler_failed = True
+
+        if has_gap:
+            self._loop.create_task(self._run_resync(f"разрыв версий таблицы {table_name} ({last_version} -> {version})"))
+        elif handler_failed:
+            self._loop.create_task(self._run_resync(f"ошибка обработки события {op} {table_name}"))
+
+    async def _run_resync(self, reason: str) -> None:
+        """ Выполняет все обработчики полной перезагрузки в executor """
+        print(f"[Cache_Invalidation]  Полная перезагрузка кэшей: {reason}.")
+        for handler in self._resync_handlers:
+            try:
+                await self._loop.run_in_executor(None, handler)
+            except Exception as e_resync:
+                print(f"[Cache_Invalidation]  !!! ОШИБКА полной перезагрузки кэша: '{type(e_resync).__name__}' - '{e_resync}'")
+
+
+cache_invalidation_listener = CacheInvalidationListener(
+    channel=settings.CACHE_INVALIDATION_CHANNEL,
+    check_interval_seconds=settings.CACHE_INVALIDATION_CHECK_SECONDS
+)
\ No newline at end of file
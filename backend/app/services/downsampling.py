@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """ Largest-Triangle-Three-Buckets: выбирает points индексов точек, лучше всего сохраняющих форму графика.
+    x должен быть отсортирован по возрастанию. Первая и последняя точки сохраняются всегда. """
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    x = x.astype(np.float64) - float(x[0])  # Сдвиг к нулю: площади считаются без потери точности на больших метках времени
+    y = y.astype(np.float64)
+
+    # Границы корзин: первая и последняя точки - отдельные корзины, остальные делятся на points - 2 корзины
+    edges = (np.arange(points - 1) * ((size - 2) / (points - 2))).astype(np.int64) + 1
+    edges[-1] = size - 1
+
+    # Средние точки корзин через префиксные суммы (без цикла по точкам)
+    x_sums = np.concatenate(([0.0], np.cumsum(x)))
+    y_sums = np.concatenate(([0.0], np.cumsum(y)))
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i < points - 3:
+            next_start, next_end = end, edges[i + 2]
+        else:
+            next_start, next_end = size - 1, size  # Для последней корзины «следующая» - последняя точка
+        avg_x = (x_sums[next_end] - x_sums[next_start]) / (next_end - next_start)
+        avg_y = (y_sums[next_end] - y_sums[next_start]) / (next_end - next_start)
+
+        # Удвоенная площадь треугольника (точка a, кандидат, средняя точка следующей корзины)
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
\ No newline at end of file
@@ -0,0 +1,147 @@
+import threading, time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.repositories.equipment_repository import actuator_repository, aggregate_repository, line_repository
+from app.repositories.parameter_repository import parameter_repository
+
+
+# --- Таблицы оборудования, изменение которых меняет связи иерархии ---
+HIERARCHY_TABLES = ("shops", "lines", "aggregates", "actuators", "parameters")
+
+
+# --- Индекс иерархии оборудования в памяти: ссылки на родителя от параметра до цеха ---
+class EquipmentHierarchyIndex:
+    def __init__(self, max_age_seconds: float):
+        """ Индекс пуст и помечен устаревшим до первого rebuild(). Полная перезагрузка выполняется
+        при событии инвалидации и не реже, чем раз в max_age_seconds (страховка на случай пропущенных событий) """
+        self.max_age_seconds = max_age_seconds
+        self._actuator_of_parameter: Dict[int, int] = {}
+        self._aggregate_of_actuator: Dict[int, int] = {}
+        self._line_of_aggregate: Dict[int, int] = {}
+        self._shop_of_line: Dict[int, int] = {}
+        self._is_stale = True
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def rebuild(self, db: Session) -> int:
+        """ Загружает связи всех уровней иерархии четырьмя запросами. Возвращает количество параметров. """
+        self._is_stale = False  # Сбрасывается до чтения: изменение во время загрузки снова пометит индекс устаревшим
+        actuator_of_parameter = parameter_repository.get_actuator_id_map(db=db)
+        aggregate_of_actuator = actuator_repository.get_aggregate_id_map(db=db)
+        line_of_aggregate = aggregate_repository.get_line_id_map(db=db)
+        shop_of_line = line_repository.get_shop_id_map(db=db)
+        with self._lock:
+            self._actuator_of_parameter = actuator_of_parameter
+            self._aggregate_of_actuator = aggregate_of_actuator
+            self._line_of_aggregate = line_of_aggregate
+            self._shop_of_line = shop_of_line
+            self._loaded_at = time.monotonic()
+        print(f"[Equipment_Index]  Индекс иерархии оборудования перестроен: {len(shop_of_line)} линий, {len(actuator_of_parameter)} параметров.")
+        return len(actuator_of_parameter)
+
+    def mark_stale(self, op: Optional[str] = None, row: Optional[Dict[str, Any]] = None) -> None:
+        """ Помечает индекс устаревшим (обработчик событий инвалидации): он перестроится при следующем обращении """
+        self._is_stale = True
+
+    def ensure_fresh(self, db: Session) -> None:
+        """ Перестраивает индекс, если он устарел или давно не перезагружался """
+        if self._is_stale or time.monotonic() - self._loaded_at > self.max_age_seconds:
+            self.rebuild(db)
+
+    def get_shop_of_line(self, db: Session, line_id: int) -> Optional[int]:
+        """ Возвращает ID цеха линии или None, если линии нет. Линию, которой ещё нет в индексе
+        (например, уведомление о её создании ещё не пришло), догружает из БД. """
+        self.ensure_fresh(db)
+        shop_id = self._shop_of_line.get(line_id)
+        if shop_id is None:
+            line = line_repository.get(db=db, line_id=line_id)
+            if not line:
+                return None
+            shop_id = self._remember(self._shop_of_line, line_id, line.shop_id)
+        return shop_id
+
+    def get_line_of_aggregate(self, db: Session, aggregate_id: int) -> Optional[int]:
+        """ Возвращает ID линии агрегата (или None; отсутствующий в индексе агрегат догружается из БД) """
+        self.ensure_fresh(db)
+        line_id = self._line_of_aggregate.get(aggregate_id)
+        if line_id is None:
+            aggregate = aggregate_repository.get(db=db, aggregate_id=aggregate_id)
+            if not aggregate:
+                return None
+            line_id = self._remember(self._line_of_aggregate, aggregate_id, aggregate.line_id)
+        return line_id
+
+    def get_aggregate_of_actuator(self, db: Session, actuator_id: int) -> Optional[int]:
+        """ Возвращает ID агрегата актуатора (или None; отсутствующий в индексе актуатор догружается из БД) """
+        self.ensure_fresh(db)
+        aggregate_id = self._aggregate_of_actuator.get(actuator_id)
+        if aggregate_id is None:
+            actuator = actuator_repository.get(db=db, actuator_id=actuator_id)
+            if not actuator:
+                return None
+            aggregate_id = self._remember(self._aggregate_of_actuator, actuator_id, actuator.aggregate_id)
+        return aggregate_id
+
+    def get_actuator_of_parameter(self, db: Session, parameter_id: int) -> Optional[int]:
+        """ Возвращает ID актуатора параметра (или None; отсутствующий в индексе параметр догружается из БД) """
+        self.ensure_fresh(db)
+        actuator_id = self._actuator_of_parameter.get(parameter_id)
+        if actuator_id is None:
+            parameter = parameter_repository.get(db=db, parameter_id=parameter_id)
+            if not parameter:
+                return None
+            actuator_id = self._remember(self._actuator_of_parameter, parameter_id, parameter.actuator_id)
+        return actuator_id
+
+    def get_line_of_actuator(self, db: Session, actuator_id: int) -> Optional[int]:
+        """ Возвращает ID линии актуатора (или None, если актуатора нет) """
+        aggregate_id = self.get_aggregate_of_actuator(db, actuator_id)
+        return None if aggregate_id is None else self.get_line_of_aggregate(db, aggregate_id)
+
+    def get_line_of_parameter(self, db: Session, parameter_id: int) -> Optional[int]:
+        """ Возвращает ID линии параметра (или None, если параметра нет) """
+        actuator_id = self.get_actuator_of_parameter(db, parameter_id)
+        return None if actuator_id is None else self.get_line_of_actuator(db, actuator_id)
+
+    def get_shop_ids_for_lines(self, db: Session, line_ids: Iterable[int]) -> Set[int]:
+        """ Возвращает ID цехов, к которым относятся линии (несуществующие линии пропускаются) """
+        shop_ids = (self.get_shop_of_line(db, line_id) for line_id in line_ids)
+        return {shop_id for shop_id in shop_ids if shop_id is not None}
+
+    def get_line_and_shop_ids(self, db: Session, parameter_ids: Iterable[int]) -> Dict[int, Tuple[int, int]]:
+        """ Возвращает (line_id, shop_id) для нескольких параметров за один проход по индексу.
+        Параметры, которых нет в индексе, догружаются одним запросом на весь набор; несуществующие в результат не попадают. """
+        self.ensure_fresh(db)
+        result: Dict[int, Tuple[int, int]] = {}
+        missing: List[int] = []
+        for parameter_id in parameter_ids:
+            actuator_id = self._actuator_of_parameter.get(parameter_id)
+            aggregate_id = None if actuator_id is None else self._aggregate_of_actuator.get(actuator_id)
+            line_id = None if aggregate_id is None else self._line_of_aggregate.get(aggregate_id)
+            shop_id = None if line_id is None else self._shop_of_line.get(line_id)
+            if shop_id is None:
+                missing.append(parameter_id)
+            else:
+                result[parameter_id] = (line_id, shop_id)
+        if missing:
+            loaded = parameter_repository.get_hierarchy_ids(db=db, parameter_ids=missing)
+            with self._lock:
+                for parameter_id, (actuator_id, aggregate_id, line_id, shop_id) in loaded.items():
+                    self._actuator_of_parameter[parameter_id] = actuator_id
+                    self._aggregate_of_actuator[actuator_id] = aggregate_id
+                    self._line_of_aggregate[aggregate_id] = line_id
+                    self._shop_of_line[line_id] = shop_id
+                    result[parameter_id] = (line_id, shop_id)
+        return result
+
+    def _remember(self, links: Dict[int, int], child_id: int, parent_id: int) -> int:
+        """ Добавляет догруженную из БД связь в индекс """
+        with self._lock:
+            links[child_id] = parent_id
+        return parent_id
+
+
+equipment_hierarchy_index = EquipmentHierarchyIndex(max_age_seconds=settings.EQUIPMENT_INDEX_MAX_AGE_SECONDS)
\ No newline at end of file
@@ -0,0 +1,160 @@
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def to_epoch_us(moment: datetime.datetime) -> int:
+    """ Переводит момент времени в микросекунды от эпохи (наивное время считается UTC, как в БД) """
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return (moment - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_epoch_us(epoch_us: int) -> datetime.datetime:
+    """ Обратное преобразование к datetime в UTC """
+    return _EPOCH + datetime.timedelta(microseconds=int(epoch_us))
+
+
+# --- Кольцевой буфер последних показаний одного параметра (int64 микросекунды + float64 значения) ---
+class _ParameterRing:
+    def __init__(self, capacity: int):
+        """ Память ограничена capacity точками (16 байт на точку), самые старые точки перезаписываются """
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.start = 0
+        self.size = 0
+        # С этого момента в буфере есть все показания параметра. None - полнота не подтверждена:
+        # первое live-показание не доказывает, что до него ничего не потеряно (см. HotWindowStore.confirm)
+        self.covered_since_us: Optional[int] = None
+
+    def append(self, timestamp_us: int, value: float) -> None:
+        """ Добавляет показание; при переполнении вытесняет самое старое и сдвигает начало покрытия """
+        capacity = len(self.timestamps)
+        if self.size and timestamp_us < self.timestamps[(self.start + self.size - 1) % capacity]:
+            # Показание не по порядку не вставляется: покрытие сдвигается за него, чтобы не отдавать неполные данные
+            if self.covered_since_us is not None:
+                self.covered_since_us = max(self.covered_since_us, timestamp_us + 1)
+            return
+        end = (self.start + self.size) % capacity
+        self.timestamps[end] = timestamp_us
+        self.values[end] = value
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+            if self.covered_since_us is not None:
+                self.covered_since_us = max(self.covered_since_us, int(self.timestamps[self.start]))
+
+    def ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Возвращает содержимое буфера в порядке времени (копии массивов) """
+        stop = self.start + self.size
+        if stop <= len(self.timestamps):
+            return self.timestamps[self.start:stop].copy(), self.values[self.start:stop].copy()
+        stop -= len(self.timestamps)
+        return (np.concatenate((self.timestamps[self.start:], self.timestamps[:stop])),
+                np.concatenate((self.values[self.start:], self.values[:stop])))
+
+    def confirm(self, start_us: int, timestamps_us: np.ndarray, values: np.ndarray) -> bool:
+        """ Подтверждает полноту буфера показаниями из БД за период с start_us (по возрастанию времени).
+        Подтверждение возможно, только если данные БД доходят до первого live-показания буфера: тогда БД покрывает
+        всё до него, а буфер - всё после. Показания БД раньше буфера дописываются в его начало. """
+        if self.size == 0 or len(timestamps_us) == 0:
+            return False
+        live_timestamps, live_values = self.ordered()
+        first_live_us = int(live_timestamps[0])
+        if int(timestamps_us[-1]) < first_live_us:
+            return False
+        older = int(np.searchsorted(timestamps_us, first_live_us, side="left"))
+        merged_timestamps = np.concatenate((timestamps_us[:older], live_timestamps))
+        merged_values = np.concatenate((values[:older], live_values))
+
+        capacity = len(self.timestamps)
+        kept = min(len(merged_timestamps), capacity)
+        self.timestamps[:kept] = merged_timestamps[-kept:]
+        self.values[:kept] = merged_values[-kept:]
+        self.start, self.size = 0, kept
+        self.covered_since_us = start_us if kept == len(merged_timestamps) else int(self.timestamps[0])
+        return True
+
+
+# --- Горячее окно временных рядов в процессе API: последние показания параметров с WebSocket-подписчиками ---
+class HotWindowStore:
+    def __init__(self, capacity: int):
+        """ Буферы живут только пока у параметра есть подписчики в этом экземпляре (только тогда экземпляр получает их данные из topic exchange).
+        Буфер отдаёт данные только после подтверждения полноты чтением из БД (confirm).
+        Используется только из event loop, поэтому без блокировок. """
+        self.capacity = capacity
+        self._rings: Dict[int, _ParameterRing] = {}
+
+    def append(self, parameter_id: int, timestamp: datetime.datetime, value: float) -> None:
+        """ Добавляет показание из RabbitMQ в буфер параметра """
+        ring = self._rings.get(parameter_id)
+        if ring is None:
+            ring = self._rings[parameter_id] = _ParameterRing(self.capacity)
+        ring.append(to_epoch_us(timestamp), value)
+
+    def drop(self, parameter_id: int) -> None:
+        """ Удаляет буфер параметра: данные по нему больше не приходят, и буфер перестал бы быть полным """
+        self._rings.pop(parameter_id, None)
+
+    def reset(self, *_args) -> None:
+        """ Удаляет все буферы (обработчик переподключения к RabbitMQ: очередь могла потерять показания).
+        Новые буферы снова копятся из live-потока и используются только после подтверждения из БД. """
+        self._rings.clear()
+        print("[Hot_Window]  Горячее окно сброшено после переподключения к RabbitMQ.")
+
+    def confirm(self, parameter_id: int, start_time: datetime.datetime,
+                timestamps_us: np.ndarray, values: np.ndarray) -> bool:
+        """ Подтверждает полноту буфера параметра показаниями, только что прочитанными из БД за период с start_time """
+        ring = self._rings.get(parameter_id)
+        return ring is not None and ring.confirm(to_epoch_us(start_time), timestamps_us, values)
+
+    def get_range(self, parameter_id: int, start_time: datetime.datetime, end_time: datetime.datetime,
+                  limit: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """ Возвращает показания за [start_time, end_time] по возрастанию времени,
+        или None, если полнота буфера не подтверждена или диапазон начинается раньше подтверждённого покрытия """
+        ring = self._rings.get(parameter_id)
+        start_us = to_epoch_us(start_time)
+        if ring is None or ring.covered_since_us is None or start_us < ring.covered_since_us:
+            return None
+        timestamps, values = ring.ordered()
+        lo = int(np.searchsorted(timestamps, start_us, side="left"))
+        hi = int(np.searchsorted(timestamps, to_epoch_us(end_time), side="right"))
+        if limit:
+            hi = min(hi, lo + limit)
+        return timestamps[lo:hi], values[lo:hi]
+
+    def backfill_frame(self, parameter_id: int, since: datetime.datetime) -> Optional[Dict]:
+        """ Снимок показаний с момента since для нового подписчика (None, если буфер не покрывает этот период) """
+        window = self.get_range(parameter_id, since, datetime.datetime.now(datetime.timezone.utc))
+        if window is None:
+            return None
+        return build_backfill_frame(parameter_id, *window)
+
+
+def build_backfill_frame(parameter_id: int, timestamps_us: np.ndarray, values: np.ndarray) -> Dict:
+    """ Кадр с историей параметра для WebSocket-клиента: отдельные массивы времени и значений """
+    return {
+        "type": "backfill",
+        "parameter_id": parameter_id,
+        "data_timestamps": [from_epoch_us(ts).isoformat() for ts in timestamps_us.tolist()],
+        "parameter_values": values.tolist()
+    }
+
+
+def window_to_rows(parameter_id: int, window: Tuple[np.ndarray, np.ndarray]) -> List[Dict]:
+    """ Преобразует показания из горячего окна в строки формата ParameterDataRead (без parameter_data_id) """
+    timestamps_us, values = window
+    return [
+        {"parameter_id": parameter_id, "parameter_value": value, "data_timestamp": from_epoch_us(ts), "parameter_data_id": None}
+        for ts, value in zip(timestamps_us.tolist(), values.tolist())
+    ]
+
+
+hot_window_store = HotWindowStore(settings.HOT_WINDOW_MAX_POINTS_PER_PARAMETER)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import datetime, time
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.repositories.parameter_repository import parameter_data_repository
+
+
+# --- Последнее известное показание параметра ---
+class LastValue(NamedTuple):
+    data_timestamp: Optional[datetime.datetime]  # None - за период LAST_VALUE_LOOKBACK_HOURS данных не было
+    parameter_value: Optional[float]
+    cached_at: Optional[float]  # time.monotonic() загрузки из БД; None - значение из live-потока подписанного параметра
+
+
+# --- Кэш последних значений параметров в процессе API ---
+class LastValueCache:
+    def __init__(self, ttl_seconds: float):
+        """ Источник истины - БД: значения подгружаются одним запросом на весь набор и считаются свежими ttl_seconds.
+        Быстрый путь - параметры с WebSocket-подписчиками на этом экземпляре: их показания приходят из RabbitMQ,
+        и значение свежее, пока подписка жива (после ухода последнего подписчика действует обычный TTL).
+        Используется только из event loop, поэтому без блокировок. """
+        self.ttl_seconds = ttl_seconds
+        self._values: Dict[int, LastValue] = {}
+
+    def update(self, parameter_id: int, data_timestamp: datetime.datetime, parameter_value: float) -> None:
+        """ Записывает показание из live-потока (более старое показание не затирает более новое) """
+        data_timestamp = _as_utc(data_timestamp)
+        current = self._values.get(parameter_id)
+        if current is not None and current.data_timestamp is not None and current.data_timestamp > data_timestamp:
+            return
+        self._values[parameter_id] = LastValue(data_timestamp, parameter_value, None)
+
+    def release(self, parameter_id: int) -> None:
+        """ Параметр больше не приходит из live-потока (ушёл последний подписчик): значение живёт ещё ttl_seconds """
+        current = self._values.get(parameter_id)
+        if current is not None and current.cached_at is None:
+            self._values[parameter_id] = current._replace(cached_at=time.monotonic())
+
+    def expire_all(self, *_args) -> None:
+        """ Помечает все значения устаревшими (обработчик переподключения к RabbitMQ: показания могли быть пропущены),
+        при следующем обращении они сверяются с БД """
+        self._values = {p_id: value._replace(cached_at=0.0) for p_id, value in self._values.items()}
+
+    def get_many(self, db: Session, parameter_ids: List[int]) -> Dict[int, LastValue]:
+        """ Возвращает последние значения параметров; отсутствующие и устаревшие догружает одним запросом DISTINCT ON """
+        now = time.monotonic()
+        missing_ids = [
+            p_id for p_id in parameter_ids
+            if p_id not in self._values or not self._is_fresh(self._values[p_id], now)
+        ]
+        if missing_ids:
+            since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=settings.LAST_VALUE_LOOKBACK_HOURS)
+            rows = parameter_data_repository.get_latest_many(db=db, parameter_ids=missing_ids, since=since)
+            found = {row.parameter_id: row for row in rows}
+            for p_id in missing_ids:
+                row, current = found.get(p_id), self._values.get(p_id)
+                row_timestamp = _as_utc(row.data_timestamp) if row is not None else None
+                if row is not None and (current is None or current.data_timestamp is None or row_timestamp >= current.data_timestamp):
+                    self._values[p_id] = LastValue(row_timestamp, row.parameter_value, now)
+                elif current is not None and current.data_timestamp is not None:
+                    self._values[p_id] = current._replace(cached_at=now)  # В кэше показание новее, чем уже записано в БД
+                else:
+                    self._values[p_id] = LastValue(None, None, now)
+        return {p_id: self._values[p_id] for p_id in parameter_ids}
+
+    def _is_fresh(self, value: LastValue, now: float) -> bool:
+        """ Значения из live-потока свежие, пока параметр подписан, загруженные из БД - ttl_seconds """
+        return value.cached_at is None or now - value.cached_at <= self.ttl_seconds
+
+
+def _as_utc(moment: datetime.datetime) -> datetime.datetime:
+    """ Приводит метку времени к aware UTC (наивное время считается UTC, как в БД), чтобы сравнения не падали """
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc)
+
+
+last_value_cache = LastValueCache(settings.LAST_VALUE_CACHE_TTL_SECONDS)
\ No newline at end of file
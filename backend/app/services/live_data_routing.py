@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Optional, Set
+
+from app.core.config import settings
+
+
+def live_data_routing_key(parameter_id: int) -> str:
+    """ Ключ маршрутизации показания параметра в topic exchange live-данных """
+    return settings.RABBITMQ_LIVE_DATA_ROUTING_KEY_TEMPLATE.format(parameter_id=parameter_id)
+
+
+# --- Динамические привязки очереди экземпляра API к topic exchange live-данных ---
+class LiveDataBindings:
+    def __init__(self):
+        """ Очередь экземпляра привязана только к ключам параметров, на которые есть WebSocket-подписчики.
+        Нужные привязки (_desired) меняются синхронно из ConnectionManager, а реальные bind/unbind
+        выполняет одна фоновая задача, поэтому быстрые подписка/отписка не перепутают порядок операций в RabbitMQ. """
+        self._queue: Optional[Any] = None  # aio_pika.RobustQueue (восстанавливает привязки при переподключении)
+        self._exchange: Optional[Any] = None  # aio_pika.RobustExchange
+        self._desired: Set[int] = set()
+        self._bound: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def attach(self, queue: Any, exchange: Any) -> None:
+        """ Подключает объявленные очередь и exchange и привязывает уже нужные параметры """
+        self._queue, self._exchange = queue, exchange
+        self._wakeup = asyncio.Event()
+        self._sync_task = asyncio.get_running_loop().create_task(self._sync_loop())
+        self._wakeup.set()
+        print(f"[Live_Routing]  Очередь привязывается к exchange '{exchange.name}' по подпискам клиентов.")
+
+    async def detach(self) -> None:
+        """ Останавливает фоновую задачу (очередь exclusive и удаляется вместе с соединением) """
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+        self._queue, self._exchange, self._wakeup = None, None, None
+        self._bound.clear()
+
+    def add(self, parameter_id: int) -> None:
+        """ Вызывается при появлении первого подписчика параметра в этом экземпляре """
+        self._desired.add(parameter_id)
+        self._request_sync()
+
+    def discard(self, parameter_id: int) -> None:
+        """ Вызывается, когда от параметра отписался последний подписчик этого экземпляра """
+        self._desired.discard(parameter_id)
+        self._request_sync()
+
+    def _request_sync(self) -> None:
+        """ Будит фоновую задачу (до attach изменения только запоминаются) """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _sync_loop(self) -> None:
+        """ Приводит привязки очереди в RabbitMQ к нужному набору параметров """
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                for parameter_id in sorted(self._desired - self._bound):
+                    await self._queue.bind(self._exchange, routing_key=live_data_routing_key(parameter_id))
+                    self._bound.add(parameter_id)
+                for parameter_id in sorted(self._bound - self._desired):
+                    await self._queue.unbind(self._exchange, routing_key=live_data_routing_key(parameter_id))
+                    self._bound.discard(parameter_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Live_Routing]  !!! ОШИБКА при изменении привязок очереди: {type(e).__name__} - {e}. Повтор через 5 сек.")
+                await asyncio.sleep(5)
+                self._wakeup.set()
+
+
+live_data_bindings = LiveDataBindings()
\ No newline at end of file
@@ -0,0 +1,313 @@
+import asyncio, datetime, json, threading, time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.enums import AlarmTypesEnum
+from app.repositories.setting_repository import setting_repository
+
+
+'''
+===================================
+    Каналы доставки уведомлений    
+===================================
+'''
+
+
+# --- Одна созданная тревога, ожидающая уведомления ---
+class AlertNotification(NamedTuple):
+    alert_id: int
+    user_id: int
+    message: str
+
+
+# --- Базовый канал доставки: реализации переопределяют send() ---
+class NotificationChannel(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def send(self, user_id: int, alarm_types: List[AlarmTypesEnum], text: str) -> None:
+        """ Доставляет пользователю user_id одно (возможно, объединённое) уведомление """
+
+
+# --- Канал "log": печать в stdout (как прежняя заглушка) ---
+class LogNotificationChannel(NotificationChannel):
+    name = "log"
+
+    async def send(self, user_id: int, alarm_types: List[AlarmTypesEnum], text: str) -> None:
+        """ Печатает уведомление в лог процесса """
+        print(f"--- УВЕДОМЛЕНИЕ ДЛЯ User {user_id} ({', '.join(t.value for t in alarm_types)}) ---")
+        print(text)
+        print(f"--------------------------------------")
+
+
+# --- Канал "file": дописывает уведомления в файл построчно (JSON), для локальной проверки и тестов ---
+class FileNotificationChannel(NotificationChannel):
+    name = "file"
+
+    def __init__(self, path: str):
+        """ Уведомления дописываются в файл path """
+        self.path = path
+        self._lock = threading.Lock()
+
+    async def send(self, user_id: int, alarm_types: List[AlarmTypesEnum], text: str) -> None:
+        """ Дописывает уведомление в файл (запись выполняется в executor) """
+        line = json.dumps({
+            "sent_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "user_id": user_id,
+            "alarm_types": [t.value for t in alarm_types],
+            "text": text
+        }, ensure_ascii=False)
+        await asyncio.get_running_loop().run_in_executor(None, self._append_line, line)
+
+    def _append_line(self, line: str) -> None:
+        """ Дописывает одну строку в файл """
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+# --- Реестр каналов: имя из settings.NOTIFICATION_CHANNELS -> фабрика канала ---
+NOTIFICATION_CHANNEL_FACTORIES: Dict[str, Callable[[], NotificationChannel]] = {
+    LogNotificationChannel.name: LogNotificationChannel,
+    FileNotificationChannel.name: lambda: FileNotificationChannel(settings.NOTIFICATION_FILE_PATH),
+}
+
+
+def register_notification_channel(name: str, factory: Callable[[], NotificationChannel]) -> None:
+    """ Регистрирует новый канал доставки, чтобы его можно было включить через settings.NOTIFICATION_CHANNELS """
+    NOTIFICATION_CHANNEL_FACTORIES[name] = factory
+
+
+'''
+==============================================
+    Кэш настроек уведомлений пользователей    
+==============================================
+'''
+
+
+# --- Кэш alarm_types из user_settings с TTL и сбросом по событиям инвалидации ---
+class AlarmTypesCache:
+    def __init__(self, ttl_seconds: int):
+        """ Записи живут не дольше ttl_seconds """
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, tuple] = {}  # user_id -> (alarm_types, момент загрузки)
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids: List[int]) -> Dict[int, List[AlarmTypesEnum]]:
+        """ Возвращает alarm_types пользователей; промахи догружаются из БД одним запросом (синхронно, вызывать в executor) """
+        now = time.monotonic()
+        result: Dict[int, List[AlarmTypesEnum]] = {}
+        missing: List[int] = []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is not None and now - entry[1] <= self.ttl_seconds:
+                    result[user_id] = entry[0]
+                else:
+                    missing.append(user_id)
+        if not missing:
+            return result
+
+        db = SessionLocal()
+        try:
+            loaded = setting_repository.get_alarm_types_by_user_ids(db=db, user_ids=missing)
+        finally:
+            db.close()
+        with self._lock:
+            for user_id in missing:
+                alarm_types = loaded.get(user_id, [AlarmTypesEnum.NOTIFICATION])  # Настроек ещё нет - значение по умолчанию
+                self._entries[user_id] = (alarm_types, now)
+                result[user_id] = alarm_types
+        return result
+
+    def apply_row_change(self, op: str, row: Optional[Dict[str, Any]]) -> None:
+        """ Сбрасывает запись пользователя при изменении его строки user_settings (событие инвалидации кэша) """
+        if row is None:
+            self.clear()
+            return
+        with self._lock:
+            self._entries.pop(int(row["user_id"]), None)
+
+    def clear(self) -> None:
+        """ Сбрасывает весь кэш """
+        with self._lock:
+            self._entries.clear()
+
+
+'''
+=============================
+    Диспетчер уведомлений    
+=============================
+'''
+
+
+# --- Ограничитель частоты уведомлений одного пользователя (token bucket) ---
+class _UserRateLimiter:
+    def __init__(self, max_per_minute: int):
+        """ Не больше max_per_minute доставок в минуту, с запасом на всплеск такого же размера """
+        self.capacity = max(1, max_per_minute)
+        self.refill_per_second = self.capacity / 60
+        self._buckets: Dict[int, tuple] = {}  # user_id -> (токены, момент последнего пополнения)
+
+    def try_acquire(self, user_id: int) -> bool:
+        """ Забирает один токен пользователя, если он есть """
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(user_id, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        return True
+
+    def prune(self) -> None:
+        """ Удаляет корзины, пополнившиеся до capacity: они неотличимы от отсутствующих, а без этого словарь растёт бесконечно """
+        now = time.monotonic()
+        full_user_ids = [
+            user_id for user_id, (tokens, updated_at) in self._buckets.items()
+            if tokens + (now - updated_at) * self.refill_per_second >= self.capacity
+        ]
+        for user_id in full_user_ids:
+            del self._buckets[user_id]
+
+
+# --- Асинхронный диспетчер: очередь -> объединение по пользователю -> ограничение частоты -> каналы ---
+class NotificationDispatcher:
+    def __init__(self, alarm_types_cache: AlarmTypesCache):
+        """ Каналы создаются при start() по settings.NOTIFICATION_CHANNELS """
+        self.alarm_types_cache = alarm_types_cache
+        self.coalesce_window = max(1, settings.NOTIFICATION_COALESCE_WINDOW_MS) / 1000
+        self.max_pending_per_user = max(1, settings.NOTIFICATION_USER_MAX_PENDING)
+        self.channels: List[NotificationChannel] = []
+        self._rate_limiter = _UserRateLimiter(settings.NOTIFICATION_USER_MAX_PER_MINUTE)
+        self._pending: Dict[int, List[AlertNotification]] = {}  # Тревоги, ещё не доставленные пользователю
+        self._skipped: Dict[int, int] = {}  # Сколько тревог пользователя вытеснено из _pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """ Создаёт каналы и запускает фоновую задачу разбора очереди """
+        if self._task is not None:
+            return
+        self.channels = []
+        for channel_name in settings.NOTIFICATION_CHANNELS:
+            factory = NOTIFICATION_CHANNEL_FACTORIES.get(channel_name)
+            if factory is None:
+                print(f"[Notification_Service]  !!! ОШИБКА: неизвестный канал уведомлений '{channel_name}', пропускаю.")
+                continue
+            self.channels.append(factory())
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=settings.NOTIFICATION_QUEUE_MAX_SIZE)
+        self._task = self._loop.create_task(self._run())
+        print(f"[Notification_Service]  Диспетчер уведомлений запущен. Каналы: {[c.name for c in self.channels]}")
+
+    async def stop(self) -> None:
+        """ Останавливает фоновую задачу и доставляет всё накопленное без учёта ограничения частоты """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while not self._queue.empty():
+            self._add_pending(self._queue.get_nowait())
+        await self._deliver_pending(ignore_rate_limit=True)
+        print("[Notification_Service]  Диспетчер уведомлений остановлен.")
+
+    def submit(self, notifications: List[AlertNotification]) -> None:
+        """ Ставит уведомления в очередь. Потокобезопасно: вызывается из потока обработки правил и не ждёт доставки """
+        if not notifications:
+            return
+        if self._loop is None or self._loop.is_closed():
+            print(f"[Notification_Service]  !!! ОШИБКА: диспетчер не запущен, {len(notifications)} уведомлений не будут доставлены.")
+            return
+        self._loop.call_soon_threadsafe(self._enqueue, notifications)
+
+    def _enqueue(self, notifications: List[AlertNotification]) -> None:
+        """ Кладёт уведомления в очередь (выполняется в event loop) """
+        for notification in notifications:
+            try:
+                self._queue.put_nowait(notification)
+            except asyncio.QueueFull:
+                print(f"[Notification_Service]  !!! Очередь уведомлений переполнена, тревога с ID = {notification.alert_id} без уведомления.")
+
+    async def _run(self) -> None:
+        """ Собирает тревоги за окно объединения и доставляет их пачкой """
+        while True:
+            try:
+                if self._pending:  # Есть придержанные ограничителем - просыпается не позже следующего окна
+                    first = await asyncio.wait_for(self._queue.get(), self.coalesce_window)
+                else:
+                    first = await self._queue.get()
+                self._add_pending(first)
+            except asyncio.TimeoutError:
+                pass
+
+            deadline = self._loop.time() + self.coalesce_window
+            while (remaining := deadline - self._loop.time()) > 0:
+                try:
+                    self._add_pending(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._deliver_pending(ignore_rate_limit=False)
+            except Exception as e_deliver:
+                print(f"[Notification_Service]  !!! ОШИБКА при доставке уведомлений: '{type(e_deliver).__name__}' - '{e_deliver}'")
+            self._rate_limiter.prune()
+
+    def _add_pending(self, notification: AlertNotification) -> None:
+        """ Добавляет тревогу в ожидание пользователя, вытесняя самые старые сверх лимита """
+        user_pending = self._pending.setdefault(notification.user_id, [])
+        user_pending.append(notification)
+        if len(user_pending) > self.max_pending_per_user:
+            overflow = len(user_pending) - self.max_pending_per_user
+            del user_pending[:overflow]
+            self._skipped[notification.user_id] = self._skipped.get(notification.user_id, 0) + overflow
+
+    async def _deliver_pending(self, ignore_rate_limit: bool) -> None:
+        """ Доставляет по одному объединённому уведомлению каждому пользователю, у которого не исчерпан лимит """
+        ready_user_ids = [
+            user_id for user_id in self._pending
+            if ignore_rate_limit or self._rate_limiter.try_acquire(user_id)
+        ]
+        if not ready_user_ids:
+            return
+
+        alarm_types_by_user = await self._loop.run_in_executor(None, self.alarm_types_cache.get_many, ready_user_ids)
+        deliveries = []
+        for user_id in ready_user_ids:
+            notifications = self._pending.pop(user_id)
+            skipped = self._skipped.pop(user_id, 0)
+            alarm_types = alarm_types_by_user.get(user_id, [])
+            if not alarm_types:  # Пользователь отключил все виды оповещений
+                continue
+            deliveries.append(self._send_to_channels(user_id, alarm_types, self._format(notifications, skipped)))
+        await asyncio.gather(*deliveries)
+
+    async def _send_to_channels(self, user_id: int, alarm_types: List[AlarmTypesEnum], text: str) -> None:
+        """ Отправляет уведомление во все каналы; ошибка одного канала не мешает остальным """
+        for channel in self.channels:
+            try:
+                await channel.send(user_id, alarm_types, text)
+            except Exception as e_channel:
+                print(f"[Notification_Service]  !!! ОШИБКА канала '{channel.name}' для User {user_id}: '{type(e_channel).__name__}' - '{e_channel}'")
+
+    @staticmethod
+    def _format(notifications: List[AlertNotification], skipped: int) -> str:
+        """ Формирует текст объединённого уведомления """
+        if len(notifications) == 1 and not skipped:
+            return notifications[0].message
+        lines = [f"Новых тревог: {len(notifications) + skipped}"]
+        lines.extend(f"- {n.message}" for n in notifications)
+        if skipped:
+            lines.append(f"... и ещё {skipped} более ранних тревог")
+        return "\n".join(lines)
+
+
+alarm_types_cache = AlarmTypesCache(ttl_seconds=settings.NOTIFICATION_SETTINGS_CACHE_TTL_SECONDS)
+notification_dispatcher = NotificationDispatcher(alarm_types_cache)
\ No newline at end of file
@@ -0,0 +1,92 @@
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.parameter import Parameter
+from app.repositories.parameter_repository import parameter_repository
+
+
+# --- Таблицы оборудования, изменение которых меняет тексты путей к параметрам ---
+EQUIPMENT_TABLES = (
+    "shops", "lines", "aggregates", "actuators", "parameters",
+    "aggregate_types", "actuator_types", "parameter_types"
+)
+
+
+# --- Готовые к форматированию метаданные параметра для сообщения тревоги ---
+class ParameterContext(NamedTuple):
+    path: str  # "Цех / N  линия / Тип агрегата / Тип исполнительного механизма"
+    parameter_name: str
+    unit: str
+
+    @classmethod
+    def from_parameter(cls, param: Parameter) -> "ParameterContext":
+        """ Собирает контекст из параметра с предзагруженной иерархией оборудования """
+        param_type = param.parameter_type
+        actuator = param.actuator
+        actuator_type = actuator.actuator_type
+        aggregate = actuator.aggregate
+        aggregate_type = aggregate.aggregate_type
+        line = aggregate.line
+        shop = line.shop
+
+        param_name_str = param_type.parameter_type_name if param_type else "N/A"
+        unit_str = param_type.parameter_unit or "" if param_type else ""
+        act_type_str = actuator_type.actuator_type_name if actuator_type else "N/A"
+        agg_type_str = aggregate_type.aggregate_type_name if aggregate_type else "N/A"
+        line_type_str = line.line_type.value if line else "N/A"
+        shop_name_str = shop.shop_name if shop else "N/A"
+        return cls(f"{shop_name_str} / {line_type_str}  линия / {agg_type_str} / {act_type_str}", param_name_str, unit_str)
+
+
+# --- Кэш контекстов всех параметров: заполняется целиком и сбрасывается при изменении таблиц оборудования ---
+class ParameterContextCache:
+    def __init__(self):
+        """ Кэш пуст и помечен устаревшим до первого rebuild() """
+        self._contexts: Dict[int, ParameterContext] = {}
+        self._is_stale = True
+        self._lock = threading.Lock()
+
+    def rebuild(self, db: Session) -> int:
+        """ Загружает контексты всех параметров одним запросом. Возвращает количество параметров. """
+        self._is_stale = False  # Сбрасывается до чтения: изменение во время загрузки снова пометит кэш устаревшим
+        contexts: Dict[int, ParameterContext] = {}
+        for param in parameter_repository.get_all_with_details(db=db):
+            try:
+                contexts[param.parameter_id] = ParameterContext.from_parameter(param)
+            except AttributeError as e:
+                print(f"[Parameter_Context]  Ошибка при получении иерархии для parameter_id = {param.parameter_id}: {e}")
+        with self._lock:
+            self._contexts = contexts
+        print(f"[Parameter_Context]  Кэш контекстов параметров перестроен: {len(contexts)} параметров.")
+        return len(contexts)
+
+    def mark_stale(self, op: Optional[str] = None, row: Optional[Dict[str, Any]] = None) -> None:
+        """ Помечает кэш устаревшим (обработчик событий инвалидации): он перестроится при следующем обращении """
+        self._is_stale = True
+
+    def get(self, db: Session, parameter_id: int) -> Optional[ParameterContext]:
+        """ Возвращает контекст параметра. Перестраивает устаревший кэш; параметр, которого ещё нет в кэше,
+        догружает по одному (например, если уведомление о его создании ещё не пришло). """
+        if self._is_stale:
+            self.rebuild(db)
+
+        context = self._contexts.get(parameter_id)
+        if context is not None:
+            return context
+
+        param = parameter_repository.get_with_details(db=db, parameter_id=parameter_id)
+        if not param:
+            return None
+        try:
+            context = ParameterContext.from_parameter(param)
+        except AttributeError as e:
+            print(f"[Parameter_Context]  Ошибка при получении иерархии для parameter_id = {parameter_id}: {e}")
+            return None
+        with self._lock:
+            self._contexts[parameter_id] = context
+        return context
+
+
+parameter_context_cache = ParameterContextCache()
\ No newline at end of file
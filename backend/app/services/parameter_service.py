@@ -1,14 +1,20 @@
-import datetime
-from typing import List, Optional
+import base64, csv, datetime, io, json, struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
+from app.db.session import SessionLocal
 from app.models.parameter import ParameterType, Parameter, ParameterData
 from app.models.user import User
 from app.repositories.parameter_repository import parameter_type_repository, parameter_repository, parameter_data_repository
+from app.services.downsampling import lttb_indices
 from app.services.equipment_service import get_user_access_scope
-from app.services.permissions import can_user_access_actuator, can_user_access_parameter
+from app.services.hot_window import build_backfill_frame, from_epoch_us, hot_window_store, to_epoch_us, window_to_rows
+from app.services.last_value_cache import last_value_cache
+from app.services.permissions import can_user_access_actuator, can_user_access_aggregate, can_user_access_parameter, filter_accessible_parameters
 
 
 '''
@@ -51,15 +57,243 @@ def get_parameter_details(*, db: Session, current_user: User, parameter_id: int)
     return parameter
 
 
-def get_parameter_data(*, db: Session, current_user: User, parameter_id: int,
-                       start_time: datetime.datetime, end_time: datetime.datetime,
-                       limit: Optional[int] = None) -> List[ParameterData]:
-    """ Получает данные временного ряда для параметра, доступного пользователю """
+def get_latest_values(*, db: Session, current_user: User,
+                      actuator_id: Optional[int] = None, aggregate_id: Optional[int] = None) -> List[Dict]:
+    """ Получает текущие (последние) значения всех параметров актуатора или агрегата, доступного пользователю.
+    Значения берутся из кэша последних значений; при промахе - одним запросом на весь набор параметров. """
     scope = get_user_access_scope(db=db, user=current_user)
 
-    # 1. Получает параметр и проверяет доступ к нему (через его актуатор)
+    # 1. Проверяет доступ к актуатору или агрегату и получает его параметры
+    if actuator_id is not None:
+        if not can_user_access_actuator(db=db, scope=scope, target_actuator_id=actuator_id):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к параметрам этого актуатора")
+        parameter_ids = parameter_repository.get_ids_by_actuator(db=db, actuator_id=actuator_id)
+    else:
+        if not can_user_access_aggregate(db=db, scope=scope, target_aggregate_id=aggregate_id):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к параметрам этого агрегата")
+        parameter_ids = parameter_repository.get_ids_by_aggregate(db=db, aggregate_id=aggregate_id)
+
+    # 2. Получает последние значения
+    latest = last_value_cache.get_many(db, parameter_ids)
+    return [
+        {"parameter_id": p_id, "parameter_value": latest[p_id].parameter_value, "data_timestamp": latest[p_id].data_timestamp}
+        for p_id in parameter_ids
+    ]
+
+
+def _check_parameter_data_access(*, db: Session, current_user: User, parameter_id: int) -> None:
+    """ Проверяет доступ пользователя к данным параметра (через его актуатор) """
+    scope = get_user_access_scope(db=db, user=current_user)
     if not can_user_access_parameter(db=db, scope=scope, target_parameter_id=parameter_id):
          raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к данным этого параметра")
 
-    # 2. Получает данные временного ряда
-    return parameter_data_repository.get_range(db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, limit=limit)
\ No newline at end of file
+
+def _confirm_hot_window(parameter_id: int, start_time: datetime.datetime,
+                        rows: List[ParameterData]) -> Tuple[np.ndarray, np.ndarray]:
+    """ Передаёт прочитанные из БД показания в горячее окно для подтверждения его полноты. Возвращает их как массивы. """
+    timestamps_us = np.fromiter((to_epoch_us(row.data_timestamp) for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row.parameter_value for row in rows), dtype=np.float64, count=len(rows))
+    hot_window_store.confirm(parameter_id, start_time, timestamps_us, values)
+    return timestamps_us, values
+
+
+def _load_columns(*, db: Session, parameter_id: int, start_time: datetime.datetime, end_time: datetime.datetime,
+                  limit: Optional[int] = None, points: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Загружает ряд как два массива (epoch_us, значения): из горячего окна или двумя столбцами из БД.
+    При заданном points ряд прореживается LTTB (limit тогда не применяется) """
+    window = hot_window_store.get_range(parameter_id, start_time, end_time, limit=None if points else limit)
+    if window is None:
+        rows = parameter_data_repository.get_range_columns(
+            db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, limit=None if points else limit
+        )
+        window = (np.fromiter((row.epoch_us for row in rows), dtype=np.int64, count=len(rows)),
+                  np.fromiter((row.parameter_value for row in rows), dtype=np.float64, count=len(rows)))
+        hot_window_store.confirm(parameter_id, start_time, *window)
+    if points is None:
+        return window
+    timestamps_us, values = window
+    selected = lttb_indices(timestamps_us, values, points)
+    return timestamps_us[selected], values[selected]
+
+
+def get_parameter_data(*, db: Session, current_user: User, parameter_id: int,
+                       start_time: datetime.datetime, end_time: datetime.datetime,
+                       limit: Optional[int] = None, points: Optional[int] = None,
+                       bucket: Optional[datetime.timedelta] = None) -> List[Union[ParameterData, Dict]]:
+    """ Получает данные временного ряда для параметра, доступного пользователю.
+    points - прореживание LTTB до points точек, bucket - агрегаты min/max/avg по интервалам (limit тогда не применяется).
+    Если диапазон целиком попадает в горячее окно процесса, сырые точки берутся из памяти без запроса к БД. """
+    # 1. Проверяет доступ к параметру
+    _check_parameter_data_access(db=db, current_user=current_user, parameter_id=parameter_id)
+
+    # 2. Агрегаты по интервалам считаются в БД (time_bucket)
+    if bucket is not None:
+        rows = parameter_data_repository.get_buckets(
+            db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, bucket=bucket
+        )
+        return [row._asdict() for row in rows]
+
+    # 3. Сырые точки: из горячего окна, если оно покрывает весь диапазон, иначе ORM-записи из БД
+    if points is None:
+        window = hot_window_store.get_range(parameter_id, start_time, end_time, limit=limit)
+        if window is not None:
+            return window_to_rows(parameter_id, window)
+        rows = parameter_data_repository.get_range(db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, limit=limit)
+        _confirm_hot_window(parameter_id, start_time, rows)
+        return rows
+
+    # 4. Прореживание LTTB: в память поднимаются только два столбца, наружу уходит не больше points точек
+    return window_to_rows(parameter_id, _load_columns(
+        db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, points=points
+    ))
+
+
+def get_parameter_data_columns(*, db: Session, current_user: User, parameter_id: int,
+                               start_time: datetime.datetime, end_time: datetime.datetime,
+                               limit: Optional[int] = None, points: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ То же, что get_parameter_data (без bucket), но в виде массивов (epoch_us, значения) для колоночного формата """
+    _check_parameter_data_access(db=db, current_user=current_user, parameter_id=parameter_id)
+    return _load_columns(
+        db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, limit=limit, points=points
+    )
+
+
+_CURSOR_FORMAT = struct.Struct("<Iq")  # parameter_id, data_timestamp последней записи страницы (микросекунды от эпохи)
+
+
+def _encode_cursor(parameter_id: int, last_timestamp: datetime.datetime) -> str:
+    """ Непрозрачный курсор следующей страницы """
+    return base64.urlsafe_b64encode(_CURSOR_FORMAT.pack(parameter_id, to_epoch_us(last_timestamp))).decode("ascii")
+
+
+def _decode_cursor(cursor: str, parameter_id: int) -> datetime.datetime:
+    """ Разбирает курсор и проверяет, что он выдан для этого же параметра """
+    try:
+        cursor_parameter_id, epoch_us = _CURSOR_FORMAT.unpack(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        after = from_epoch_us(epoch_us)
+    except (OverflowError, ValueError, struct.error):  # OverflowError - метка времени вне диапазона datetime
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный курсор")
+    if cursor_parameter_id != parameter_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Курсор выдан для другого параметра")
+    return after
+
+
+def get_parameter_data_page(*, db: Session, current_user: User, parameter_id: int,
+                            start_time: datetime.datetime, end_time: datetime.datetime,
+                            page_size: int, cursor: Optional[str] = None) -> Dict:
+    """ Получает одну страницу данных параметра по возрастанию времени и курсор следующей страницы """
+    _check_parameter_data_access(db=db, current_user=current_user, parameter_id=parameter_id)
+    after = _decode_cursor(cursor, parameter_id) if cursor else None
+
+    # Запрашивает на одну запись больше: так без COUNT понятно, есть ли следующая страница
+    items = parameter_data_repository.get_page(
+        db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time, after=after, limit=page_size + 1
+    )
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = _encode_cursor(parameter_id, items[-1].data_timestamp)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def get_parameters_data_batch(*, db: Session, current_user: User, parameter_ids: List[int],
+                              start_time: datetime.datetime, end_time: datetime.datetime,
+                              bucket: Optional[datetime.timedelta] = None, max_raw_points: Optional[int] = None) -> Dict:
+    """ Получает ряды сразу нескольких параметров: права проверяются для всего набора одним запросом,
+    данные читаются одним сканированием parameter_id = ANY(...).
+    Без bucket в память читается не больше max_raw_points + 1 строк; если точек больше - 400 с просьбой указать bucket.
+    С bucket ряды выравниваются на общую сетку интервалов (среднее за интервал, None - нет данных). """
+    # 1. Проверяет доступ ко всем параметрам сразу
+    scope = get_user_access_scope(db=db, user=current_user)
+    requested_ids = list(dict.fromkeys(parameter_ids))
+    allowed_ids = filter_accessible_parameters(scope, requested_ids, db=db)
+    denied_ids = [p_id for p_id in requested_ids if p_id not in allowed_ids]
+    if denied_ids:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Нет доступа к данным параметров: {denied_ids}")
+
+    # 2. Сырые ряды: одно сканирование, затем разбиение по parameter_id
+    if bucket is None:
+        series = {p_id: ([], []) for p_id in requested_ids}
+        rows = parameter_data_repository.get_range_many_columns(
+            db=db, parameter_ids=requested_ids, start_time=start_time, end_time=end_time,
+            limit=max_raw_points + 1 if max_raw_points is not None else None
+        )
+        if max_raw_points is not None and len(rows) > max_raw_points:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"В диапазоне больше {max_raw_points} точек: укажите bucket или сократите диапазон."
+            )
+        for p_id, epoch_us, value in rows:
+            timestamps, values = series[p_id]
+            timestamps.append(from_epoch_us(epoch_us))
+            values.append(value)
+        return {"series": [
+            {"parameter_id": p_id, "data_timestamps": timestamps, "parameter_values": values}
+            for p_id, (timestamps, values) in series.items()
+        ]}
+
+    # 3. Выравнивание: агрегаты всех параметров одним запросом, общая сетка - все встретившиеся интервалы
+    rows = parameter_data_repository.get_buckets_many(
+        db=db, parameter_ids=requested_ids, start_time=start_time, end_time=end_time, bucket=bucket
+    )
+    bucket_starts = sorted({row.bucket_start for row in rows})
+    grid_index = {bucket_start: idx for idx, bucket_start in enumerate(bucket_starts)}
+    aligned = {p_id: [None] * len(bucket_starts) for p_id in requested_ids}
+    for row in rows:
+        aligned[row.parameter_id][grid_index[row.bucket_start]] = float(row.avg_value)
+    return {
+        "bucket_starts": bucket_starts,
+        "series": [{"parameter_id": p_id, "parameter_values": values} for p_id, values in aligned.items()]
+    }
+
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def stream_parameter_data(*, db: Session, current_user: User, parameter_id: int,
+                          start_time: datetime.datetime, end_time: datetime.datetime,
+                          output_format: str) -> Iterator[str]:
+    """ Проверяет доступ и возвращает генератор кусков ответа NDJSON или CSV для StreamingResponse.
+    Права проверяются сразу (до начала ответа), данные читаются лениво по мере отправки. """
+    _check_parameter_data_access(db=db, current_user=current_user, parameter_id=parameter_id)
+    return _generate_data_chunks(parameter_id, start_time, end_time, output_format)
+
+
+def _generate_data_chunks(parameter_id: int, start_time: datetime.datetime, end_time: datetime.datetime,
+                          output_format: str) -> Iterator[str]:
+    """ Читает данные серверным курсором и превращает каждую пачку строк в один кусок ответа.
+    Открывает собственную сессию: сессия запроса к этому моменту может быть уже закрыта. """
+    db = SessionLocal()
+    try:
+        if output_format == "csv":
+            yield "parameter_id,data_timestamp,parameter_value\r\n"
+        chunks = parameter_data_repository.stream_range(
+            db=db, parameter_id=parameter_id, start_time=start_time, end_time=end_time,
+            chunk_size=settings.DATA_STREAM_CHUNK_ROWS
+        )
+        for rows in chunks:
+            if output_format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows((parameter_id, ts.isoformat(), value) for ts, value in rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps({"parameter_id": parameter_id, "parameter_value": value, "data_timestamp": ts.isoformat()}) + "\n"
+                    for ts, value in rows
+                )
+    finally:
+        db.close()
+
+
+def get_backfill_frame(*, db: Session, parameter_id: int) -> Dict:
+    """ Собирает кадр с историей параметра за последние WS_BACKFILL_SECONDS для нового WebSocket-подписчика.
+    Права доступа должны быть уже проверены. Если горячее окно ещё не накопило этот период, история читается из БД. """
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=settings.WS_BACKFILL_SECONDS)
+    frame = hot_window_store.backfill_frame(parameter_id, since)
+    if frame is not None:
+        return frame
+
+    rows = parameter_data_repository.get_range(
+        db=db, parameter_id=parameter_id, start_time=since, end_time=datetime.datetime.now(datetime.timezone.utc)
+    )
+    return build_backfill_frame(parameter_id, *_confirm_hot_window(parameter_id, since, rows))
\ No newline at end of file
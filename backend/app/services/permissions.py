@@ -1,14 +1,15 @@
-import enum
-from typing import Any, Dict, List
+import enum, threading, time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.models.enums import LineTypesEnum
 from app.models.equipment import Line  # noqa F401
 from app.models.user import User
-from app.repositories.equipment_repository import shop_repository, line_repository, aggregate_repository, actuator_repository
-from app.repositories.parameter_repository import parameter_repository
+from app.repositories.equipment_repository import shop_repository, line_repository
+from app.services.equipment_index import equipment_hierarchy_index
 
 
 # --- Enum для типов доступа ---
@@ -40,9 +41,57 @@ ROLE_SCOPES_CONFIG: Dict[str, Dict[str, Any]] = {
 }
 
 
+# --- Кэш вычисленных областей видимости пользователей с TTL и явным сбросом ---
+class AccessScopeCache:
+    def __init__(self, ttl_seconds: int):
+        """ Записи живут не дольше ttl_seconds. Запись годна, только пока job_title_id пользователя совпадает с тем,
+        для которого она вычислена, поэтому смена должности в другом экземпляре API не даёт старых прав. """
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, Tuple[Optional[int], AccessScope, float]] = {}  # user_id -> (job_title_id, scope, момент вычисления)
+        self._lock = threading.Lock()
+
+    def get(self, user: User) -> Optional[AccessScope]:
+        """ Возвращает область видимости из кэша или None, если записи нет или она устарела """
+        entry = self._entries.get(user.user_id)
+        if entry is None:
+            return None
+        job_title_id, scope, computed_at = entry
+        if job_title_id != user.job_title_id or time.monotonic() - computed_at > self.ttl_seconds:
+            return None
+        return scope
+
+    def put(self, user: User, scope: AccessScope) -> None:
+        """ Запоминает вычисленную область видимости пользователя """
+        with self._lock:
+            self._entries[user.user_id] = (user.job_title_id, scope, time.monotonic())
+
+    def invalidate(self, user_id: int) -> None:
+        """ Сбрасывает запись пользователя (вызывается при изменении или удалении пользователя) """
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self, op: Optional[str] = None, row: Optional[Dict[str, Any]] = None) -> None:
+        """ Сбрасывает весь кэш (в том числе как обработчик событий инвалидации таблиц цехов и линий) """
+        with self._lock:
+            self._entries.clear()
+
+
+access_scope_cache = AccessScopeCache(ttl_seconds=settings.ACCESS_SCOPE_CACHE_TTL_SECONDS)
+
+
 # --- Функция определения прав доступа ---
 def get_user_access_scope(*, db: Session, user: User) -> AccessScope:
-    """ Определяет область видимости пользователя на основе его должности """
+    """ Определяет область видимости пользователя на основе его должности.
+    Результат кэшируется: запросы к БД по именам цеха и линии выполняются только при промахе. """
+    scope = access_scope_cache.get(user)
+    if scope is None:
+        scope = _resolve_access_scope(db=db, user=user)
+        access_scope_cache.put(user, scope)
+    return scope
+
+
+def _resolve_access_scope(*, db: Session, user: User) -> AccessScope:
+    """ Вычисляет область видимости пользователя по ROLE_SCOPES_CONFIG """
     if not user.job_title:
         return AccessScope(scope_type=ScopeTypeEnum.NONE)
 
@@ -93,7 +142,7 @@ def can_user_access_shop(scope: AccessScope, target_shop_id: int, *, db: Session
     if scope.scope_type == ScopeTypeEnum.SHOP:
         return target_shop_id in scope.allowed_shop_ids
     if scope.scope_type == ScopeTypeEnum.LINE:
-        shop_ids = line_repository.get_shop_ids_for_lines(db=db, line_ids=scope.allowed_line_ids)
+        shop_ids = equipment_hierarchy_index.get_shop_ids_for_lines(db, scope.allowed_line_ids)
         return target_shop_id in shop_ids
     return False
 
@@ -105,30 +154,46 @@ def can_user_access_line(scope: AccessScope, target_line_id: int, *, db: Session
     if scope.scope_type == ScopeTypeEnum.LINE:
         return target_line_id in scope.allowed_line_ids
     if scope.scope_type == ScopeTypeEnum.SHOP:
-        line = line_repository.get(db=db, line_id=target_line_id)
-        return line is not None and line.shop_id in scope.allowed_shop_ids
+        shop_id = equipment_hierarchy_index.get_shop_of_line(db, target_line_id)
+        return shop_id is not None and shop_id in scope.allowed_shop_ids
     return False
 
 
 def can_user_access_aggregate(scope: AccessScope, target_aggregate_id: int, *, db: Session) -> bool:
     """ Может ли пользователь видеть данный агрегат? (через доступ к линии) """
-    aggregate = aggregate_repository.get(db=db, aggregate_id=target_aggregate_id)
-    if not aggregate:
+    line_id = equipment_hierarchy_index.get_line_of_aggregate(db, target_aggregate_id)
+    if line_id is None:
         return False
-    return can_user_access_line(db=db, scope=scope, target_line_id=aggregate.line_id)
+    return can_user_access_line(db=db, scope=scope, target_line_id=line_id)
 
 
 def can_user_access_actuator(scope: AccessScope, target_actuator_id: int, *, db: Session) -> bool:
-    """ Может ли пользователь видеть данный актуатор? (через доступ к агрегату) """
-    actuator = actuator_repository.get(db=db, actuator_id=target_actuator_id)
-    if not actuator:
+    """ Может ли пользователь видеть данный актуатор? (через доступ к линии) """
+    line_id = equipment_hierarchy_index.get_line_of_actuator(db, target_actuator_id)
+    if line_id is None:
         return False
-    return can_user_access_aggregate(db=db, scope=scope, target_aggregate_id=actuator.aggregate_id)
+    return can_user_access_line(db=db, scope=scope, target_line_id=line_id)
 
 
 def can_user_access_parameter(scope: AccessScope, target_parameter_id: int, *, db: Session) -> bool:
-    """ Может ли пользователь видеть данный параметр? (через доступ к актуатору) """
-    parameter = parameter_repository.get(db=db, parameter_id=target_parameter_id)
-    if not parameter:
+    """ Может ли пользователь видеть данный параметр? (через доступ к линии) """
+    line_id = equipment_hierarchy_index.get_line_of_parameter(db, target_parameter_id)
+    if line_id is None:
         return False
-    return can_user_access_actuator(db=db, scope=scope, target_actuator_id=parameter.actuator_id)
\ No newline at end of file
+    return can_user_access_line(db=db, scope=scope, target_line_id=line_id)
+
+
+def filter_accessible_parameters(scope: AccessScope, parameter_ids: Iterable[int], *, db: Session) -> Set[int]:
+    """ Какие из параметров пользователь может видеть? Проверяет весь набор по индексу иерархии оборудования """
+    requested_ids = set(parameter_ids)
+    if not requested_ids or scope.scope_type == ScopeTypeEnum.NONE:
+        return set()
+
+    hierarchy = equipment_hierarchy_index.get_line_and_shop_ids(db, requested_ids)
+    if scope.scope_type == ScopeTypeEnum.ALL:
+        return set(hierarchy)
+    if scope.scope_type == ScopeTypeEnum.SHOP:
+        return {p_id for p_id, (_, shop_id) in hierarchy.items() if shop_id in scope.allowed_shop_ids}
+    if scope.scope_type == ScopeTypeEnum.LINE:
+        return {p_id for p_id, (line_id, _) in hierarchy.items() if line_id in scope.allowed_line_ids}
+    return set()
\ No newline at end of file
@@ -0,0 +1,302 @@
+import enum, threading, time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.rule import MonitoringRule
+from app.repositories.rule_repository import rule_repository
+
+
+# --- Облегчённое представление активного правила внутри индекса ---
+class IndexedRule(NamedTuple):
+    rule_id: int
+    user_id: int
+    parameter_id: int
+    comparison_operator: str
+    threshold: float
+    deadband: float = 0.0
+    min_duration_seconds: float = 0.0
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "IndexedRule":
+        """ Создаёт IndexedRule из строки monitoring_rules, пришедшей в событии инвалидации кэша """
+        return cls(
+            rule_id=int(row["rule_id"]),
+            user_id=int(row["user_id"]),
+            parameter_id=int(row["parameter_id"]),
+            comparison_operator=row["comparison_operator"],
+            threshold=float(row["threshold"]),
+            deadband=float(row.get("deadband") or 0.0),
+            min_duration_seconds=float(row.get("min_duration_seconds") or 0.0)
+        )
+
+    @classmethod
+    def from_model(cls, rule: MonitoringRule) -> "IndexedRule":
+        """ Создаёт IndexedRule из ORM-модели MonitoringRule """
+        return cls(
+            rule_id=rule.rule_id,
+            user_id=rule.user_id,
+            parameter_id=rule.parameter_id,
+            comparison_operator=rule.comparison_operator,
+            threshold=rule.threshold,
+            deadband=rule.deadband or 0.0,
+            min_duration_seconds=rule.min_duration_seconds or 0.0
+        )
+
+
+# --- Колоночное представление всех правил индекса для пакетной проверки (отсортировано по parameter_id) ---
+class _RuleColumns(NamedTuple):
+    version: int
+    parameter_ids: np.ndarray  # int64
+    is_greater: np.ndarray  # bool: True для '>', False для '<'
+    thresholds: np.ndarray  # float64
+    deadbands: np.ndarray  # float64
+    rule_ids: np.ndarray  # int64
+    user_ids: np.ndarray  # int64
+    rules: List[IndexedRule]  # Те же правила в том же порядке (для построения результата)
+
+    @classmethod
+    def from_rules(cls, version: int, rules: List[IndexedRule]) -> "_RuleColumns":
+        """ Раскладывает правила по столбцам NumPy, отсортировав их по parameter_id """
+        rules = sorted(rules, key=lambda r: r.parameter_id)
+        return cls(
+            version=version,
+            parameter_ids=np.fromiter((r.parameter_id for r in rules), dtype=np.int64, count=len(rules)),
+            is_greater=np.fromiter((r.comparison_operator == '>' for r in rules), dtype=bool, count=len(rules)),
+            thresholds=np.fromiter((r.threshold for r in rules), dtype=np.float64, count=len(rules)),
+            deadbands=np.fromiter((r.deadband for r in rules), dtype=np.float64, count=len(rules)),
+            rule_ids=np.fromiter((r.rule_id for r in rules), dtype=np.int64, count=len(rules)),
+            user_ids=np.fromiter((r.user_id for r in rules), dtype=np.int64, count=len(rules)),
+            rules=rules
+        )
+
+
+# --- Резидентный индекс активных правил мониторинга с колоночным снимком для пакетной проверки ---
+class RuleIndex:
+    def __init__(self, max_age_seconds: int):
+        """ Индекс пуст до первого rebuild(). Полная перезагрузка выполняется не реже, чем раз в max_age_seconds """
+        self.max_age_seconds = max_age_seconds
+        self.is_loaded = False
+        self.version = 0  # Увеличивается при каждом изменении индекса
+        self._rules_by_id: Dict[int, IndexedRule] = {}
+        self._loaded_at = 0.0
+        self._columns: _RuleColumns | None = None  # Пересобирается лениво, когда version уходит вперёд
+        self._load_logs: List[List[Tuple[int, Optional[IndexedRule]]]] = []  # Изменения, пришедшие во время rebuild()
+        self._lock = threading.RLock()
+
+    def rebuild(self, db: Session) -> int:
+        """ Полностью перестраивает индекс по активным правилам из БД.
+        Чтение из БД идёт без блокировки, чтобы не задерживать обработку событий в event loop. Изменения,
+        пришедшие за время чтения, записываются в журнал и повторно применяются поверх снимка (они не старше его).
+        Возвращает количество проиндексированных правил. """
+        load_log: List[Tuple[int, Optional[IndexedRule]]] = []
+        with self._lock:
+            self._load_logs.append(load_log)
+        try:
+            rules = [IndexedRule.from_model(rule) for rule in rule_repository.get_all_active(db=db)]
+        except Exception:
+            with self._lock:
+                self._load_logs.remove(load_log)
+            raise
+        rules_by_id = {rule.rule_id: rule for rule in rules}
+        with self._lock:
+            self._load_logs.remove(load_log)
+            for rule_id, indexed_rule in load_log:
+                if indexed_rule is None:
+                    rules_by_id.pop(rule_id, None)
+                else:
+                    rules_by_id[rule_id] = indexed_rule
+            self._rules_by_id = rules_by_id
+            self._loaded_at = time.monotonic()
+            self.is_loaded = True
+            self.version += 1
+        print(f"[Rule_Engine]  Индекс правил перестроен: {len(rules_by_id)} активных правил для {len({r.parameter_id for r in rules_by_id.values()})} параметров.")
+        return len(rules_by_id)
+
+    def ensure_fresh(self, db: Session) -> None:
+        """ Строит индекс, если он ещё не загружен или устарел (страховка на случай пропущенных изменений) """
+        if not self.is_loaded or time.monotonic() - self._loaded_at > self.max_age_seconds:
+            self.rebuild(db)
+
+    def upsert_rule(self, rule: MonitoringRule) -> None:
+        """ Добавляет или обновляет правило в индексе. Неактивное правило из индекса удаляется.
+        Ничего не делает, если индекс ещё не загружен и не загружается (он будет построен целиком при первом обращении). """
+        if not self._is_tracking():
+            return
+        if not rule.is_active:
+            self.remove_rule(rule.rule_id)
+            return
+        self._upsert_indexed(IndexedRule.from_model(rule))
+
+    def apply_row_change(self, op: str, row: Dict[str, Any]) -> None:
+        """ Применяет событие инвалидации кэша по таблице monitoring_rules (INSERT / UPDATE / DELETE) """
+        if not self._is_tracking():
+            return
+        if op == "DELETE" or not row.get("is_active", True):
+            self.remove_rule(int(row["rule_id"]))
+            return
+        self._upsert_indexed(IndexedRule.from_row(row))
+
+    def _upsert_indexed(self, indexed_rule: IndexedRule) -> None:
+        """ Кладёт правило в индекс (колоночный снимок пересоберётся при следующей проверке) """
+        with self._lock:
+            self._log_change(indexed_rule.rule_id, indexed_rule)
+            self._rules_by_id[indexed_rule.rule_id] = indexed_rule
+            self.version += 1
+
+    def remove_rule(self, rule_id: int) -> None:
+        """ Удаляет правило из индекса (если оно там есть) """
+        if not self._is_tracking():
+            return
+        with self._lock:
+            self._log_change(rule_id, None)
+            if self._rules_by_id.pop(rule_id, None) is None:
+                return
+            self.version += 1
+
+    def _is_tracking(self) -> bool:
+        """ Изменения нужно применять, если индекс загружен или прямо сейчас загружается """
+        return self.is_loaded or bool(self._load_logs)
+
+    def _log_change(self, rule_id: int, indexed_rule: Optional[IndexedRule]) -> None:
+        """ Записывает изменение в журналы идущих перестроений (None - правило удалено). Вызывается под блокировкой """
+        for load_log in self._load_logs:
+            load_log.append((rule_id, indexed_rule))
+
+    def contains(self, rule_id: int) -> bool:
+        """ Проверяет, есть ли правило в индексе """
+        return rule_id in self._rules_by_id
+
+    def _get_columns(self) -> _RuleColumns:
+        """ Возвращает колоночный снимок правил, пересобирая его, если индекс изменился с момента прошлой сборки """
+        columns = self._columns
+        if columns is not None and columns.version == self.version:
+            return columns
+        with self._lock:
+            if self._columns is None or self._columns.version != self.version:
+                self._columns = _RuleColumns.from_rules(self.version, list(self._rules_by_id.values()))
+            return self._columns
+
+    def _join_batch(self, parameter_ids: Sequence[int], values: Sequence[float]):
+        """ Сопоставляет пачку показаний со всеми правилами их параметров (NumPy, без циклов Python).
+        Возвращает (снимок правил, индексы показаний, позиции правил, значения) для всех пар или None, если пар нет. """
+        columns = self._get_columns()
+        if len(parameter_ids) == 0 or len(columns.rules) == 0:
+            return None
+
+        reading_parameter_ids = np.asarray(parameter_ids, dtype=np.int64)
+        reading_values = np.asarray(values, dtype=np.float64)
+
+        # 1. Для каждого показания находит диапазон правил его параметра в отсортированной таблице
+        starts = np.searchsorted(columns.parameter_ids, reading_parameter_ids, side='left')
+        ends = np.searchsorted(columns.parameter_ids, reading_parameter_ids, side='right')
+        counts = ends - starts
+        total = int(counts.sum())
+        if total == 0:
+            return None
+
+        # 2. Разворачивает диапазоны в плоские пары (показание, правило)
+        reading_idx = np.repeat(np.arange(len(reading_parameter_ids)), counts)
+        offsets_in_range = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        rule_pos = np.repeat(starts, counts) + offsets_in_range
+        return columns, reading_idx, rule_pos, reading_values[reading_idx]
+
+    def evaluate_batch(self, parameter_ids: Sequence[int], values: Sequence[float],
+                       tracked_rule_ids: Set[int]) -> List[Tuple[int, IndexedRule, bool, bool]]:
+        """ Проверяет пачку показаний для машины состояний тревог.
+        Возвращает (индекс показания, правило, нарушено, вышло из зоны гистерезиса) для всех пар с правилами,
+        которые нарушены в этой пачке или уже имеют состояние (tracked_rule_ids). """
+        joined = self._join_batch(parameter_ids, values)
+        if joined is None:
+            return []
+        columns, reading_idx, rule_pos, pair_values = joined
+
+        is_greater = columns.is_greater[rule_pos]
+        pair_thresholds = columns.thresholds[rule_pos]
+        pair_deadbands = columns.deadbands[rule_pos]
+        violated = np.where(is_greater, pair_values > pair_thresholds, pair_values < pair_thresholds)
+        cleared = np.where(is_greater, pair_values <= pair_thresholds - pair_deadbands, pair_values >= pair_thresholds + pair_deadbands)
+
+        # Правило, нарушенное хотя бы раз в пачке, должно увидеть и остальные свои показания пачки (сброс серии / снятие тревоги)
+        pair_rule_ids = columns.rule_ids[rule_pos]
+        tracked = np.fromiter(tracked_rule_ids, dtype=np.int64, count=len(tracked_rule_ids))
+        relevant = np.isin(pair_rule_ids, np.concatenate((tracked, pair_rule_ids[violated])))
+
+        rules = columns.rules
+        return [
+            (i, rules[pos], v, c) for i, pos, v, c in zip(
+                reading_idx[relevant].tolist(), rule_pos[relevant].tolist(),
+                violated[relevant].tolist(), cleared[relevant].tolist()
+            )
+        ]
+
+
+# --- Состояние тревоги по правилу ---
+class AlertState(str, enum.Enum):
+    NORMAL = "normal"
+    ALARM = "alarm"
+
+
+# --- Запись резидентной карты состояний: правило, по которому она ведётся, и момент начала нарушения ---
+class _RuleAlertState(NamedTuple):
+    rule: IndexedRule
+    state: AlertState
+    violation_started_at: float  # Unix-время первого нарушения в текущей серии (для min_duration_seconds)
+
+
+# --- Машина состояний тревог NORMAL/ALARM с гистерезисом и защитой от дребезга ---
+class AlertStateTracker:
+    def __init__(self, index: RuleIndex):
+        """ Держит в памяти состояние только тех правил, у которых оно отличается от NORMAL без нарушения """
+        self.index = index
+        self._states: Dict[int, _RuleAlertState] = {}
+        self._index_version = -1
+        self._lock = threading.Lock()
+
+    def process_batch(self, parameter_ids: Sequence[int], values: Sequence[float],
+                      timestamps: Sequence[float]) -> List[Tuple[int, IndexedRule]]:
+        """ Прогоняет пачку показаний (в порядке поступления) через машину состояний.
+        Возвращает только переходы NORMAL -> ALARM: пары (индекс показания, правило), по которым нужно создать тревогу.
+        Тревога поднимается, когда нарушение длится не меньше min_duration_seconds, и снимается,
+        когда значение отходит от порога дальше, чем на deadband. """
+        with self._lock:
+            self._prune_removed_rules()
+            events = self.index.evaluate_batch(parameter_ids, values, set(self._states))
+            transitions: List[Tuple[int, IndexedRule]] = []
+
+            for reading_idx, rule, violated, cleared in events:
+                current = self._states.get(rule.rule_id)
+                if current is not None and current.rule != rule:  # Правило изменили: состояние начинается заново
+                    current = None
+
+                if current is not None and current.state == AlertState.ALARM:
+                    if cleared:
+                        del self._states[rule.rule_id]  # ALARM -> NORMAL
+                    continue
+
+                if not violated:
+                    self._states.pop(rule.rule_id, None)  # Серия нарушений прервалась
+                    continue
+
+                timestamp = timestamps[reading_idx]
+                started_at = current.violation_started_at if current is not None else timestamp
+                if timestamp - started_at >= rule.min_duration_seconds:
+                    self._states[rule.rule_id] = _RuleAlertState(rule, AlertState.ALARM, started_at)
+                    transitions.append((reading_idx, rule))
+                elif current is None:
+                    self._states[rule.rule_id] = _RuleAlertState(rule, AlertState.NORMAL, started_at)
+            return transitions
+
+    def _prune_removed_rules(self) -> None:
+        """ Убирает состояния удалённых и выключенных правил (только если индекс менялся) """
+        if self._index_version == self.index.version:
+            return
+        self._index_version = self.index.version
+        for rule_id in [r_id for r_id in self._states if not self.index.contains(r_id)]:
+            del self._states[rule_id]
+
+
+rule_index = RuleIndex(max_age_seconds=settings.RULE_INDEX_MAX_AGE_SECONDS)
+alert_state_tracker = AlertStateTracker(rule_index)
\ No newline at end of file
@@ -9,7 +9,8 @@ from app.models.rule import MonitoringRule
 from app.models.user import User
 from app.repositories.rule_repository import rule_repository
 from app.schemas.rule import RuleCreate, RuleUpdate
-from app.services.permissions import get_user_access_scope, can_user_access_parameter
+from app.services.permissions import get_user_access_scope, can_user_access_parameter, filter_accessible_parameters
+from app.services.rule_engine import rule_index
 
 
 '''
@@ -58,6 +59,7 @@ def create_rule(*, db: Session, rule_in: RuleCreate, current_user: User) -> Moni
 
     try:
         new_rule = rule_repository.create_with_owner(db=db, obj_in=rule_in, user_id=current_user.user_id)
+        rule_index.upsert_rule(new_rule)
         return new_rule
     except IntegrityError as e:
         db.rollback()
@@ -93,6 +95,7 @@ def update_rule(*, db: Session, rule_id: int, rule_in: RuleUpdate, current_user:
         )
 
     updated_rule = rule_repository.update(db=db, db_obj=db_rule, obj_in=update_data)
+    rule_index.upsert_rule(updated_rule)
     return updated_rule
 
 
@@ -100,7 +103,10 @@ def delete_rule(*, db: Session, rule_id: int, current_user: User) -> Optional[Mo
     """ Удаляет правило, если оно принадлежит текущему пользователю """
     db_rule_to_delete = get_rule(db=db, rule_id=rule_id, current_user=current_user)
 
-    deleted_rule = rule_repository.remove(db=db, rule_id=db_rule_to_delete.rule_id)
+    rule_id_to_delete = db_rule_to_delete.rule_id
+    deleted_rule = rule_repository.remove(db=db, rule_id=rule_id_to_delete)
+    if deleted_rule:
+        rule_index.remove_rule(rule_id_to_delete)
     return deleted_rule
 
 
@@ -112,47 +118,59 @@ def delete_rule(*, db: Session, rule_id: int, current_user: User) -> Optional[Mo
 
 
 def export_user_rules(*, db: Session, current_user: User) -> List[Dict[str, Any]]:
-    """ Формирует данные правил пользователя для экспорта """
+    """ Формирует данные правил пользователя для экспорта (только по параметрам, к которым у него сейчас есть доступ) """
     rules = get_user_rules(db=db, current_user=current_user, limit=10000)
+    scope = get_user_access_scope(db=db, user=current_user)
+    allowed_ids = filter_accessible_parameters(scope, (rule.parameter_id for rule in rules), db=db)
     export_data = []
 
     for rule in rules:
+        if rule.parameter_id not in allowed_ids:
+            continue
         export_data.append({
             "parameter_id": rule.parameter_id,
             "rule_name": rule.rule_name,
             "is_active": rule.is_active,
             "comparison_operator": rule.comparison_operator,
             "threshold": rule.threshold,
+            "deadband": rule.deadband,
+            "min_duration_seconds": rule.min_duration_seconds,
             # TODO: В БУДУЩЕМ можно будет добавить parameter_type_name, actuator_name и т.д.
         })
     return export_data
 
 
 def import_user_rules(*, db: Session, current_user: User, rules_data: List[Dict[str, Any]]) -> Dict[str, int]:
-    """ Импортирует созданные кем-то правила для пользователя, используя bulk insert """
+    """ Импортирует созданные кем-то правила для пользователя, используя bulk insert.
+    Доступ ко всем параметрам проверяется одним вызовом filter_accessible_parameters. """
     skipped_count = 0
     created_rules_count = 0
     scope = get_user_access_scope(db=db, user=current_user)
-    rules_to_create: List[RuleCreate] = []
+    validated_rules: List[RuleCreate] = []
 
     for rule_data in rules_data:
         parameter_id = rule_data.get("parameter_id")
         if parameter_id is None: skipped_count += 1; continue
-        if not can_user_access_parameter(db=db, scope=scope, target_parameter_id=parameter_id):
-            skipped_count += 1; continue
         try:
             rule_in = RuleCreate(**rule_data)
-            rules_to_create.append(rule_in)
+            validated_rules.append(rule_in)
         except Exception as e:
             print(f"Ошибка валидации данных правила для parameter_id {parameter_id}: {e}")
             skipped_count += 1
 
+    allowed_ids = filter_accessible_parameters(scope, (rule_in.parameter_id for rule_in in validated_rules), db=db)
+    rules_to_create = [rule_in for rule_in in validated_rules if rule_in.parameter_id in allowed_ids]
+    skipped_count += len(validated_rules) - len(rules_to_create)
+
     if rules_to_create:
         try:
             created_rules = rule_repository.bulk_create_with_owner(
                 db=db, rules_in=rules_to_create, user_id=current_user.user_id
             )
             created_rules_count = len(created_rules)
+            if rule_index.is_loaded:  # Без загруженного индекса не трогает атрибуты (после commit они перечитываются из БД)
+                for created_rule in created_rules:
+                    rule_index.upsert_rule(created_rule)
         except Exception as e:
             print(f"Ошибка при массовой вставке правил: {e}")
             db.rollback()
@@ -0,0 +1,50 @@
+import struct
+from typing import Tuple
+
+import numpy as np
+
+
+'''
+================================================================
+    Колоночный бинарный формат временного ряда (MSMT, версия 1)
+================================================================
+
+    Все числа little-endian. Заголовок - 24 байта, массивы выровнены по 8 байтам:
+
+        смещение  размер  тип      поле
+        0         4       char[4]  magic = b"MSMT"
+        4         2       uint16   version = 1
+        6         2       uint16   flags = 0 (зарезервировано)
+        8         4       uint32   parameter_id
+        12        4       uint32   reserved = 0
+        16        8       uint64   count - количество точек
+        24        8*count int64    data_timestamp - микросекунды от эпохи Unix (UTC)
+        24+8*count 8*count float64 parameter_value
+
+    Клиент читает массивы напрямую из буфера ответа (например, numpy.frombuffer / Float64Array) без разбора JSON.
+'''
+
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.msm.timeseries"
+COLUMNAR_MAGIC = b"MSMT"
+COLUMNAR_VERSION = 1
+_HEADER = struct.Struct("<4sHHIIQ")
+
+
+def encode_columnar(parameter_id: int, timestamps_us: np.ndarray, values: np.ndarray) -> bytes:
+    """ Собирает ответ в формате MSMT: заголовок и буферы массивов склеиваются одной операцией,
+    без поэлементной сериализации (на little-endian платформе массивы не копируются до склейки) """
+    timestamps_le = np.ascontiguousarray(timestamps_us, dtype="<i8")
+    values_le = np.ascontiguousarray(values, dtype="<f8")
+    header = _HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 0, parameter_id, 0, len(timestamps_le))
+    return b"".join((header, timestamps_le.data, values_le.data))
+
+
+def decode_columnar(payload: bytes) -> Tuple[int, np.ndarray, np.ndarray]:
+    """ Разбирает ответ MSMT в (parameter_id, timestamps_us, values); массивы - представления над payload без копирования """
+    magic, version, _flags, parameter_id, _reserved, count = _HEADER.unpack_from(payload)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError("Неизвестный формат временного ряда")
+    timestamps_us = np.frombuffer(payload, dtype="<i8", count=count, offset=_HEADER.size)
+    values = np.frombuffer(payload, dtype="<f8", count=count, offset=_HEADER.size + 8 * count)
+    return parameter_id, timestamps_us, values
\ No newline at end of file
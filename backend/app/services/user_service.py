@@ -8,6 +8,7 @@ from app.models.user import User
 from app.repositories.user_repository import user_repository
 from app.schemas.user import UserCreate, UserUpdateAdmin, UserUpdatePassword
 from app.services.auth_service import get_password_hash, verify_password
+from app.services.permissions import access_scope_cache
 
 
 def create_user(*, db: Session, user_in: UserCreate) -> User:
@@ -74,6 +75,7 @@ def update_user(*, db: Session, user_to_update: User, user_in: UserUpdateAdmin)
     updated_user = user_repository.update(
         db=db, db_obj=user_to_update, obj_in=update_data
     )
+    access_scope_cache.invalidate(user_to_update.user_id)  # Должность могла измениться
     return updated_user
 
 
@@ -110,4 +112,5 @@ def delete_user(*, db: Session, user_id_to_delete: int, current_admin_user: User
         )
 
     deleted_user = user_repository.remove(db=db, user_id=user_id_to_delete)
+    access_scope_cache.invalidate(user_id_to_delete)
     return deleted_user
\ No newline at end of file
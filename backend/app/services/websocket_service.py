@@ -1,46 +1,269 @@
-from typing import Dict, Set
+import asyncio, time
+from collections import deque, OrderedDict
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Set
 
 from fastapi import WebSocket
 
+from app.core.config import settings
+from app.services.hot_window import hot_window_store
+from app.services.last_value_cache import last_value_cache
+from app.services.live_data_routing import live_data_bindings
+
+
+# --- Кадр live-данных: собирается один раз на показание и разделяется всеми подписчиками ---
+class LiveFrame(NamedTuple):
+    parameter_id: int
+    text: str  # Для текстовых WebSocket-кадров (ASGI-сервер заново кодирует его в UTF-8 для каждого сокета)
+    binary: bytes  # Для бинарных WebSocket-кадров (те же байты JSON, что пришли из RabbitMQ, уходят без перекодирования)
+
+    @classmethod
+    def from_body(cls, parameter_id: int, body: bytes) -> "LiveFrame":
+        """ Собирает кадр из сырого тела сообщения RabbitMQ без повторной сериализации JSON """
+        return cls(parameter_id=parameter_id, text=body.decode("utf-8"), binary=body)
+
+
+# --- Одно WebSocket-соединение с собственной очередью отправки и задачей-писателем ---
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager",
+                 max_hz: Optional[float] = None, binary: bool = False):
+        """ Очередь хранит не больше одного неотправленного кадра на параметр: новый кадр заменяет старый (conflation).
+        При заданном max_hz накопленные кадры отправляются не чаще max_hz раз в секунду (только последние значения).
+        При binary=True данные уходят бинарными кадрами (служебные ответы - всегда текстом). """
+        self.websocket = websocket
+        self.manager = manager
+        self.binary = binary
+        self.min_flush_interval = 1 / max_hz if max_hz else 0.0
+        self.parameter_ids: Set[int] = set()
+        self.is_closed = False
+        self._pending: "OrderedDict[int, LiveFrame]" = OrderedDict()  # parameter_id -> последний неотправленный кадр
+        self._control: Deque[str] = deque()  # Ответы на управляющие сообщения: не объединяются и уходят первыми
+        self._control_overflowed = False
+        self._waiter: Optional[asyncio.Future] = None  # Future, которого ждёт простаивающий писатель
+        self.send_started_at: Optional[float] = None  # Момент начала текущей отправки (None - писатель не отправляет)
+        self._writer_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """ Запускает задачу-писателя """
+        self._writer_task = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def offer(self, parameter_id: int, frame: LiveFrame) -> None:
+        """ Ставит кадр в очередь без ожидания. Очередь ограничена числом подписок (не больше одного кадра на параметр),
+        поэтому не переполняется; клиента, который не принимает кадры, исключает сторож по времени отправки """
+        if self.is_closed:
+            return
+        if parameter_id in self._pending:
+            self._pending[parameter_id] = frame  # Старое значение параметра ещё не ушло - отправится только последнее
+            return
+        was_empty = not self._pending
+        self._pending[parameter_id] = frame
+        if was_empty:  # Писатель будится один раз за цикл отправки: непустую очередь он и так разберёт до конца
+            self._wake()
+
+    def offer_control(self, frame: str) -> None:
+        """ Ставит в очередь служебный кадр (ответ клиенту), чтобы в сокет писала только задача-писатель.
+        Клиент, у которого скопилось WS_CLIENT_MAX_PENDING_CONTROL_FRAMES неотправленных служебных кадров
+        (шлёт управляющие сообщения, но не читает ответы), исключается - как при переполнении кадров с данными. """
+        if self.is_closed or self._control_overflowed:
+            return
+        if len(self._control) >= settings.WS_CLIENT_MAX_PENDING_CONTROL_FRAMES:
+            print("[WS_Service]  Клиент не читает ответы на управляющие сообщения, соединение будет отключено.")
+            self._control_overflowed = True  # Исключение планируется один раз
+            self._control.clear()
+            self.manager.spawn(self.manager.evict(self))
+            return
+        self._control.append(frame)
+        self._wake()
+
+    def _wake(self) -> None:
+        """ Будит писателя, если он простаивает (уже разбуженного или занятого отправкой не трогает) """
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def close(self) -> None:
+        """ Останавливает писателя и закрывает сокет (если он ещё открыт) """
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self._pending.clear()
+        self._control.clear()
+        if self._writer_task is not None and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:  # Сокет уже закрыт клиентом
+            pass
+
+    async def _write_loop(self) -> None:
+        """ Отправляет кадры из очереди; при ошибке или таймауте отправки исключает соединение.
+        Служебные кадры уходят сразу, кадры с данными - пачкой на каждом тике (не чаще min_flush_interval). """
+        loop = asyncio.get_running_loop()
+        next_flush_at = 0.0
+        try:
+            while not self.is_closed:
+                if not self._control and not self._pending:
+                    await self._wait(loop, None)
+                while self._control:
+                    await self._send_text(self._control.popleft())
+                if not self._pending:
+                    continue
+
+                if self.min_flush_interval:
+                    delay = next_flush_at - loop.time()
+                    if delay > 0:  # Ждёт тика (или служебного кадра); новые значения тем временем заменяют старые в _pending
+                        await self._wait(loop, delay)
+                        continue
+
+                while self._pending:
+                    _, frame = self._pending.popitem(last=False)
+                    if self.binary:
+                        await self._send_bytes(frame.binary)
+                    else:
+                        await self._send_text(frame.text)
+                if self.min_flush_interval:
+                    next_flush_at = loop.time() + self.min_flush_interval
+        except asyncio.CancelledError:
+            raise
+        except Exception as e_send:  # WebSocketException, ConnectionClosed, etc.
+            print(f"[WS_Service]  !!! ОШИБКА при отправке клиенту: {type(e_send).__name__} - {e_send}. Соединение исключено.")
+            await self.manager.evict(self)
+
+    async def _wait(self, loop: asyncio.AbstractEventLoop, timeout: Optional[float]) -> None:
+        """ Ждёт, пока _wake() разбудит писателя, но не дольше timeout секунд (None - без ограничения) """
+        self._waiter = loop.create_future()
+        timer = loop.call_later(timeout, self._wake) if timeout is not None else None
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+            if timer is not None:
+                timer.cancel()
+
+    async def _send_text(self, text: str) -> None:
+        """ Отправляет один текстовый кадр (зависшую отправку прерывает сторож менеджера) """
+        self.send_started_at = time.monotonic()
+        await self.websocket.send_text(text)
+        self.send_started_at = None
+
+    async def _send_bytes(self, data: bytes) -> None:
+        """ Отправляет один бинарный кадр (зависшую отправку прерывает сторож менеджера) """
+        self.send_started_at = time.monotonic()
+        await self.websocket.send_bytes(data)
+        self.send_started_at = None
+
 
 # --- Класс-менеджер, управляющий активными WebSocket-соединениями и подписками клиентов на параметры ---
 class ConnectionManager:
     def __init__(self):
-        """ Ключ - parameter_id, значение - множество активных WebSocket соединений """
-        self.active_connections: Dict[int, Set[WebSocket]] = {}
+        """ Ключ - parameter_id, значение - множество активных соединений """
+        self.active_connections: Dict[int, Set[ClientConnection]] = {}
+        self._by_websocket: Dict[WebSocket, ClientConnection] = {}
+        self._watchdog_task: Optional[asyncio.Task] = None
+        self._background_tasks: Set[asyncio.Task] = set()  # Ссылки на фоновые закрытия, чтобы их не собрал GC
         print("[WS_Service]  ConnectionManager инициализирован.")
 
-    async def connect(self, websocket: WebSocket, parameter_id: int):
-        """ Регистрирует новое WebSocket-соединение для указанного parameter_id """
-        await websocket.accept()
-        if parameter_id not in self.active_connections:
-            self.active_connections[parameter_id] = set()
-        self.active_connections[parameter_id].add(websocket)
+    async def connect(self, websocket: WebSocket, parameter_id: int,
+                      max_hz: Optional[float] = None, binary: bool = False) -> ClientConnection:
+        """ Регистрирует новое WebSocket-соединение для указанного parameter_id и запускает его писателя """
+        connection = await self.connect_multiplexed(websocket, max_hz=max_hz, binary=binary)
+        self._subscribe(connection, parameter_id)
         print(f"[WS_Service]  Новое соединение для parameter_id={parameter_id}. Всего для параметра: {len(self.active_connections[parameter_id])}")
+        return connection
+
+    async def connect_multiplexed(self, websocket: WebSocket,
+                                  max_hz: Optional[float] = None, binary: bool = False) -> ClientConnection:
+        """ Регистрирует WebSocket-соединение без подписок (подписки добавляются через subscribe) """
+        await websocket.accept()
+        connection = ClientConnection(websocket, self, max_hz=max_hz or settings.WS_DEFAULT_MAX_HZ, binary=binary)
+        connection.start()
+        self._by_websocket[websocket] = connection
+        if self._watchdog_task is None or self._watchdog_task.done():
+            self._watchdog_task = asyncio.get_running_loop().create_task(self._watch_stuck_sends())
+        return connection
+
+    def subscribe(self, connection: ClientConnection, parameter_ids: Iterable[int]) -> List[int]:
+        """ Подписывает соединение на параметры (права должны быть уже проверены). Возвращает новые подписки.
+        Подписок у одного соединения не больше WS_CLIENT_MAX_SUBSCRIPTIONS: параметры сверх лимита не подписываются. """
+        added = [p_id for p_id in dict.fromkeys(parameter_ids) if p_id not in connection.parameter_ids]
+        added = added[:max(0, settings.WS_CLIENT_MAX_SUBSCRIPTIONS - len(connection.parameter_ids))]
+        for parameter_id in added:
+            self._subscribe(connection, parameter_id)
+        return added
+
+    def unsubscribe(self, connection: ClientConnection, parameter_ids: Iterable[int]) -> List[int]:
+        """ Отписывает соединение от параметров. Возвращает снятые подписки """
+        removed = [p_id for p_id in parameter_ids if p_id in connection.parameter_ids]
+        for parameter_id in removed:
+            connection.parameter_ids.discard(parameter_id)
+            subscribers = self.active_connections.get(parameter_id)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.active_connections[parameter_id]
+                    live_data_bindings.discard(parameter_id)  # Последний подписчик ушёл: экземпляру больше не нужны эти данные
+                    hot_window_store.drop(parameter_id)
+                    last_value_cache.release(parameter_id)
+        return removed
+
+    def disconnect(self, websocket: WebSocket, parameter_id: Optional[int] = None):
+        """ Удаляет WebSocket-соединение из списка активных (со всеми его подписками) """
+        target = f"parameter_id={parameter_id}" if parameter_id is not None else "мультиплексного соединения"
+        connection = self._by_websocket.pop(websocket, None)
+        if connection is None:
+            print(f"[WS_Service]  Не найдено активного соединения для {target}, чтобы его удалить.")
+            return
+        self._unsubscribe_all(connection)
+        self.spawn(connection.close())
+        print(f"[WS_Service]  Соединение закрыто для {target}.")
+
+    async def evict(self, connection: ClientConnection) -> None:
+        """ Немедленно исключает неработающее или не успевающее соединение и закрывает его """
+        if self._by_websocket.get(connection.websocket) is connection:
+            del self._by_websocket[connection.websocket]
+        self._unsubscribe_all(connection)
+        await connection.close()
+
+    def broadcast_to_parameter_subscribers(self, frame: LiveFrame):
+        """ Ставит готовый кадр в очереди всех WebSocket-клиентов, подписанных на frame.parameter_id.
+        Кадр не копируется и не сериализуется заново. Не ждёт отправки: медленный клиент не задерживает остальных. """
+        parameter_id = frame.parameter_id
+        connections = self.active_connections.get(parameter_id)
+        if not connections:
+            return
+        for connection in connections:
+            connection.offer(parameter_id, frame)
+
+    def spawn(self, coroutine) -> asyncio.Task:
+        """ Запускает фоновую задачу (закрытие, исключение) и хранит ссылку на неё до завершения """
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _watch_stuck_sends(self) -> None:
+        """ Сторож: исключает клиентов, у которых один кадр отправляется дольше WS_SEND_TIMEOUT_SECONDS.
+        Один таймер на все соединения вместо wait_for на каждую отправку. Завершается, когда соединений не остаётся. """
+        check_interval = min(1.0, settings.WS_SEND_TIMEOUT_SECONDS)
+        while self._by_websocket:
+            await asyncio.sleep(check_interval)
+            deadline = time.monotonic() - settings.WS_SEND_TIMEOUT_SECONDS
+            stuck = [c for c in self._by_websocket.values() if c.send_started_at is not None and c.send_started_at < deadline]
+            for connection in stuck:
+                print(f"[WS_Service]  Клиент не принял кадр за {settings.WS_SEND_TIMEOUT_SECONDS} сек, соединение исключено.")
+                self.spawn(self.evict(connection))  # Закрытие зависшего клиента может само зависнуть
+
+    def _subscribe(self, connection: ClientConnection, parameter_id: int) -> None:
+        """ Подписывает соединение на parameter_id """
+        connection.parameter_ids.add(parameter_id)
+        subscribers = self.active_connections.get(parameter_id)
+        if subscribers is None:
+            subscribers = self.active_connections[parameter_id] = set()
+            live_data_bindings.add(parameter_id)  # Первый подписчик: очередь экземпляра начинает получать параметр
+        subscribers.add(connection)
 
-    def disconnect(self, websocket: WebSocket, parameter_id: int):
-        """ Удаляет WebSocket-соединение из списка активных """
-        if parameter_id in self.active_connections:
-            self.active_connections[parameter_id].discard(websocket)
-            if not self.active_connections[parameter_id]:
-                del self.active_connections[parameter_id]
-            print(f"[WS_Service]  Соединение закрыто для parameter_id={parameter_id}.")
-        else:
-            print(f"[WS_Service]  Не найдено активных соединений для parameter_id={parameter_id}, чтобы их удалить.")
-
-    async def broadcast_to_parameter_subscribers(self, parameter_id: int, message_json: str):
-        """ Отправляет JSON-сообщение всем WebSocket-клиентам, подписанным на данный parameter_id """
-        if parameter_id in self.active_connections:
-            living_connections: Set[WebSocket] = set()
-            for connection in self.active_connections[parameter_id]:
-                try:
-                    await connection.send_text(message_json)
-                    living_connections.add(connection)
-                except Exception as e_broadcast_send:  # WebSocketException, ConnectionClosed, etc.
-                    print(f"[WS_Service]  !!! ОШИБКА при отправке сообщения клиенту для parameter_id={parameter_id}.")
-                    print(f"[WS_Service]  {type(e_broadcast_send).__name__} - {e_broadcast_send}. Соединение будет удалено при разрыве.")
-            if living_connections:
-                print(f"[WS_Service]  Отправлено {len(living_connections)} клиентам для parameter_id={parameter_id}: {message_json}")
+    def _unsubscribe_all(self, connection: ClientConnection) -> None:
+        """ Снимает все подписки соединения """
+        self.unsubscribe(connection, list(connection.parameter_ids))
 
 
 connection_manager = ConnectionManager()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import asyncio, json, os, sys, time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from app.services.websocket_service import ConnectionManager, LiveFrame  # noqa E402
+
+
+'''
+===========================================================================================
+    Бенчмарк рассылки live-данных: CPU на 1000 подписчиков до и после LiveFrame из тела    
+===========================================================================================
+'''
+
+SUBSCRIBERS = 1000
+MESSAGES = 200
+BURST_PARAMETERS = 10  # Столько параметров приходит за один тик event loop в варианте с пачкой
+
+
+# --- Поддельный WebSocket: делает то же, что ASGI-сервер с текстовым кадром (кодирует str в UTF-8) ---
+class _FakeWebSocket:
+    def __init__(self):
+        """ Считает отправленные кадры, чтобы убедиться, что ни один не схлопнулся """
+        self.sent = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        text.encode("utf-8")
+        self.sent += 1
+
+    async def send_bytes(self, data: bytes):
+        self.sent += 1
+
+    async def close(self):
+        pass
+
+
+def _make_messages():
+    """ Готовит тела сообщений так же, как их публикует симулятор (dict -> JSON bytes) """
+    messages = []
+    for i in range(MESSAGES):
+        payload = {"parameter_id": 1, "parameter_value": round(80 + i / 100, 2),
+                   "data_timestamp": datetime.now(timezone.utc).isoformat()}
+        messages.append((payload, json.dumps(payload).encode("utf-8")))
+    return messages
+
+
+async def _bench_sequential_dumps_once(messages) -> float:
+    """ До очередей на соединение: один json.dumps на сообщение, send_text каждому подписчику по очереди """
+    sockets = [_FakeWebSocket() for _ in range(SUBSCRIBERS)]
+    start = time.process_time()
+    for payload, _ in messages:
+        message_json = json.dumps(payload)
+        for ws in sockets:
+            await ws.send_text(message_json)
+    return time.process_time() - start
+
+
+async def _bench_queued(messages, *, from_body: bool, binary: bool = False) -> float:
+    """ Очереди и писатели на соединение, один кадр на всех подписчиков. from_body=False - как было до LiveFrame:
+    тело разбирается в dict и сериализуется json.dumps один раз на сообщение; True - кадр собирается из сырого тела """
+    manager = ConnectionManager()
+    sockets = [_FakeWebSocket() for _ in range(SUBSCRIBERS)]
+    for ws in sockets:
+        await manager.connect(ws, 1, binary=binary)
+    start = time.process_time()
+    for payload, body in messages:
+        if from_body:
+            manager.broadcast_to_parameter_subscribers(LiveFrame.from_body(1, body))
+        else:
+            manager.broadcast_to_parameter_subscribers(LiveFrame.from_body(1, json.dumps(payload).encode("utf-8")))
+        for _ in range(3):  # Даёт писателям отправить кадр (иначе conflation схлопнет сообщения)
+            await asyncio.sleep(0)
+    elapsed = time.process_time() - start
+
+    assert all(ws.sent == MESSAGES for ws in sockets), "Часть кадров не была отправлена"
+    for ws in sockets:
+        manager.disconnect(ws, 1)
+    await asyncio.sleep(0)
+    return elapsed
+
+
+async def _bench_burst(messages, *, queued: bool) -> float:
+    """ Пачка: каждый подписчик подписан на BURST_PARAMETERS параметров, и по одному показанию каждого
+    приходит за один тик. Писатель будится один раз на пачку, а не на каждое показание """
+    sockets = [_FakeWebSocket() for _ in range(SUBSCRIBERS)]
+    bursts = [messages[i:i + BURST_PARAMETERS] for i in range(0, len(messages), BURST_PARAMETERS)]
+    if not queued:
+        start = time.process_time()
+        for burst in bursts:
+            for parameter_id, (payload, _) in enumerate(burst):
+                message_json = json.dumps(payload)
+                for ws in sockets:
+                    await ws.send_text(message_json)
+        return time.process_time() - start
+
+    manager = ConnectionManager()
+    connections = [await manager.connect_multiplexed(ws) for ws in sockets]
+    for connection in connections:
+        manager.subscribe(connection, range(BURST_PARAMETERS))
+    start = time.process_time()
+    for burst in bursts:
+        for parameter_id, (_, body) in enumerate(burst):
+            manager.broadcast_to_parameter_subscribers(LiveFrame.from_body(parameter_id, body))
+        for _ in range(3):
+            await asyncio.sleep(0)
+    elapsed = time.process_time() - start
+
+    assert all(ws.sent == MESSAGES for ws in sockets), "Часть кадров не была отправлена"
+    for ws in sockets:
+        manager.disconnect(ws)
+    await asyncio.sleep(0)
+    return elapsed
+
+
+def _bench_parts(messages):
+    """ Отдельно измеряет то, что экономит LiveFrame: json.dumps на сообщение, и то, что остаётся
+    у текстовых кадров: кодирование str в UTF-8 на каждый сокет (бинарные кадры его не требуют) """
+    start = time.process_time()
+    for payload, _ in messages:
+        json.dumps(payload)
+    dumps_seconds = time.process_time() - start
+
+    texts = [body.decode("utf-8") for _, body in messages]
+    start = time.process_time()
+    for text in texts:
+        for _ in range(SUBSCRIBERS):
+            text.encode("utf-8")
+    return dumps_seconds, time.process_time() - start
+
+
+async def main():
+    """ Запускает все варианты и печатает CPU-время на одно сообщение для 1000 подписчиков """
+    messages = _make_messages()
+    results = {
+        "без очередей, json.dumps один раз": await _bench_sequential_dumps_once(messages),
+        "очереди, json.dumps на сообщение (было)": await _bench_queued(messages, from_body=False),
+        "очереди, LiveFrame из тела, текст (стало)": await _bench_queued(messages, from_body=True),
+        "очереди, LiveFrame из тела, бинарные (стало)": await _bench_queued(messages, from_body=True, binary=True),
+        f"пачки по {BURST_PARAMETERS} параметров, без очередей": await _bench_burst(messages, queued=False),
+        f"пачки по {BURST_PARAMETERS} параметров, очереди": await _bench_burst(messages, queued=True),
+    }
+    dumps_seconds, encode_seconds = _bench_parts(messages)
+    results["отдельно: json.dumps на сообщение"] = dumps_seconds
+    results["отдельно: кодирование текста на каждый сокет"] = encode_seconds
+    print(f"\nПодписчиков: {SUBSCRIBERS}, сообщений: {MESSAGES}")
+    for name, seconds in results.items():
+        print(f"  {name:<48} {seconds / MESSAGES * 1000:8.3f} мс CPU на сообщение / 1000 подписчиков")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
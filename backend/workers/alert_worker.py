@@ -1,15 +1,18 @@
 import asyncio, signal
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from faststream import FastStream
 from faststream.rabbit import ExchangeType, RabbitBroker, RabbitExchange, RabbitMessage, RabbitQueue
-from sqlalchemy.orm import Session
 
 import app.db.base  # noqa F401
 from app.core.config import settings
 from app.db.session import SessionLocal
 from app.repositories.parameter_repository import parameter_data_repository
-from app.services.alert_service import process_new_parameter_data
+from app.services.alert_service import process_parameter_readings_batch
+from app.services.cache_invalidation import cache_invalidation_listener
+from app.services.notification_service import alarm_types_cache, notification_dispatcher
+from app.services.parameter_context import EQUIPMENT_TABLES, parameter_context_cache
+from app.services.rule_engine import rule_index
 from app.schemas.parameter import ParameterDataCreate
 
 
@@ -37,6 +40,9 @@ print(f"[WORKER]  Брокер RabbitMQ '{settings.RABBITMQ_URL}' и очере
 async def on_startup():
     """ Выполняется при старте приложения FastStream """
     print("[WORKER]  @app.on_startup - приложение FastStream запускается.")
+    await notification_dispatcher.start()
+    await cache_invalidation_listener.start()  # Сначала LISTEN, потом загрузка: изменения во время загрузки не потеряются
+    await asyncio.get_running_loop().run_in_executor(None, _warm_up_caches)
     try:
         print(f"[WORKER]  Попытка объявить fanout exchange '{worker_live_data_exchange.name}'...")
         await broker.declare_exchange(worker_live_data_exchange)
@@ -57,50 +63,204 @@ async def on_startup():
 async def on_shutdown():
     """ Выполняется при остановке приложения FastStream """
     print("[WORKER]  @app.on_shutdown - приложение FastStream останавливается.")
+    await data_batcher.close()
+    await notification_dispatcher.stop()  # После сброса буфера: тревоги последней пачки тоже будут доставлены
+    await cache_invalidation_listener.stop()
+
+
+# --- Синхронные функции работы с БД (выполняются в executor) ---
+def _store_parameter_data_batch(readings: List[ParameterDataCreate]) -> List[int]:
+    """ Сохраняет пачку данных параметров одним INSERT и одним commit.
+    Возвращает список parameter_data_id в порядке входных данных. """
+    db = SessionLocal()
+    try:
+        return parameter_data_repository.bulk_create(db=db, objs_in=readings)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _store_parameter_data_one_by_one(readings: List[ParameterDataCreate]) -> List[Optional[int]]:
+    """ Сохраняет данные параметров по одной записи (запасной путь, если пачка не записалась целиком).
+    Для записей, которые не удалось сохранить, возвращает None. """
+    created_ids: List[Optional[int]] = []
+    db = SessionLocal()
+    try:
+        for reading in readings:
+            try:
+                created_pd_entry = parameter_data_repository.create(db=db, obj_in=reading)
+                created_ids.append(created_pd_entry.parameter_data_id)
+            except Exception as e_single:
+                print(f"[WORKER]  !!! ОШИБКА сохранения ParameterData для param_id={reading.parameter_id}, data={reading.model_dump()}: '{type(e_single).__name__}' - '{e_single}'")
+                db.rollback()
+                created_ids.append(None)
+    finally:
+        db.close()
+    return created_ids
+
+
+def _warm_up_caches() -> None:
+    """ Строит индекс правил мониторинга и кэш контекстов параметров заранее,
+    чтобы первая пачка данных не ждала их загрузки """
+    db = SessionLocal()
+    try:
+        rule_index.rebuild(db)
+    except Exception as e_index:
+        print(f"[WORKER]  !!! ОШИБКА при построении индекса правил (будет построен при первой пачке): '{type(e_index).__name__}' - '{e_index}'")
+        db.rollback()
+    try:
+        parameter_context_cache.rebuild(db)
+    except Exception as e_context:
+        print(f"[WORKER]  !!! ОШИБКА при построении кэша контекстов параметров (будет построен при первой тревоге): '{type(e_context).__name__}' - '{e_context}'")
+        parameter_context_cache.mark_stale()
+    finally:
+        db.close()
+
+
+def _process_rules_for_batch(readings: List[ParameterDataCreate], parameter_data_ids: List[int]) -> None:
+    """ Запускает векторную проверку правил мониторинга сразу для всех сохранённых записей пачки.
+    Значения берутся прямо из сообщений, без повторного чтения ParameterData из БД. """
+    try:
+        process_parameter_readings_batch(
+            parameter_ids=[reading.parameter_id for reading in readings],
+            parameter_values=[reading.parameter_value for reading in readings],
+            data_timestamps=[reading.data_timestamp for reading in readings],
+            parameter_data_ids=parameter_data_ids
+        )
+    except Exception as e_process_alert:
+        print(f"[WORKER]  !!! КРИТИЧЕСКАЯ ОШИБКА Этапа 2 (alert_service) для пачки из {len(readings)} записей: '{type(e_process_alert).__name__}' - '{e_process_alert}'")
+
+
+# --- Буфер для пакетной записи входящих сообщений в БД ---
+class ParameterDataBatcher:
+    def __init__(self, batch_size: int, flush_interval_ms: int):
+        """ Накапливает сообщения до batch_size штук или до flush_interval_ms миллисекунд, затем записывает их пачкой """
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000
+        self._pending: List[Tuple[ParameterDataCreate, RabbitMessage]] = []
+        self._flush_lock = asyncio.Lock()
+        self._timer_task: Optional[asyncio.Task] = None
+
+    async def add(self, reading: ParameterDataCreate, message: RabbitMessage):
+        """ Добавляет сообщение в буфер. Если буфер заполнен, сразу записывает пачку """
+        self._ensure_timer()
+        self._pending.append((reading, message))
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    def _ensure_timer(self):
+        """ Запускает фоновую задачу периодической записи буфера (если она ещё не запущена) """
+        if self._timer_task is None or self._timer_task.done():
+            self._timer_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        """ Раз в flush_interval записывает накопившиеся сообщения, даже если пачка не заполнена """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e_flush:
+                print(f"[WORKER]  !!! ОШИБКА при периодической записи пачки: '{type(e_flush).__name__}' - '{e_flush}'")
+
+    async def flush(self):
+        """ Записывает текущий буфер в БД, подтверждает сообщения и запускает проверку правил """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            await self._write_batch(batch)
+
+    async def close(self):
+        """ Останавливает периодическую запись и записывает оставшиеся в буфере сообщения (graceful shutdown) """
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            try:
+                await self._timer_task
+            except asyncio.CancelledError:
+                pass
+            self._timer_task = None
+        await self.flush()
+        print("[WORKER]  Буфер пакетной записи сброшен в БД.")
+
+    @staticmethod
+    async def _write_batch(batch: List[Tuple[ParameterDataCreate, RabbitMessage]]):
+        """ Сохраняет пачку одним INSERT и подтверждает её одним multiple-ack.
+        Если пачка не записалась, сохраняет записи по одной и отклоняет только проблемные сообщения. """
+        loop = asyncio.get_running_loop()
+        readings = [reading for reading, _ in batch]
+        messages = [message for _, message in batch]
+
+        # 1: Сохранение пачки данных параметров в БД
+        created_ids: List[int] = []
+        stored_readings: List[ParameterDataCreate] = readings
+        try:
+            created_ids = await loop.run_in_executor(None, _store_parameter_data_batch, readings)
+            print(f"[WORKER]  Пачка из {len(created_ids)} записей ParameterData сохранена в БД.")
+            try:
+                last_message = max(messages, key=lambda m: m.raw_message.delivery_tag)
+                await last_message.ack(multiple=True)
+                print(f"[WORKER]  Сообщения пачки подтверждены (multiple ack).")
+            except Exception as e_ack:
+                print(f"[WORKER]  !!! ОШИБКА при подтверждении пачки сообщений: '{type(e_ack).__name__}' - '{e_ack}'")
+        except Exception as e_batch:
+            print(f"[WORKER]  !!! ОШИБКА Этапа 1 (пакетное сохранение {len(batch)} записей): '{type(e_batch).__name__}' - '{e_batch}'. Сохраняю по одной...")
+            single_ids = await loop.run_in_executor(None, _store_parameter_data_one_by_one, readings)
+            created_ids, stored_readings = [], []
+            for reading, message, pd_id in zip(readings, messages, single_ids):
+                if pd_id is not None:  # Запись уже в БД: правила проверяются, даже если подтверждение не удастся
+                    created_ids.append(pd_id)
+                    stored_readings.append(reading)
+                try:
+                    if pd_id is not None:
+                        await message.ack()
+                    else:
+                        await message.reject(requeue=False)
+                except Exception as e_settle:
+                    print(f"[WORKER]  !!! ОШИБКА при подтверждении/отклонении сообщения (ID={message.message_id}): '{e_settle}'")
+
+        # 2: Запуск обработки правил мониторинга
+        if created_ids:
+            print(f"[WORKER]  Начало Этапа 2 - запуск обработки правил для {len(created_ids)} записей ParameterData")
+            await loop.run_in_executor(None, _process_rules_for_batch, stored_readings, created_ids)
+            print(f"[WORKER]  Этап 2 - Обработка правил для {len(created_ids)} записей ParameterData - успешно завершён.")
+
+
+data_batcher = ParameterDataBatcher(
+    batch_size=settings.WORKER_BATCH_SIZE,
+    flush_interval_ms=settings.WORKER_BATCH_FLUSH_INTERVAL_MS
+)
+
+# --- Изменения правил и таблиц оборудования из любого процесса приходят через PostgreSQL NOTIFY ---
+cache_invalidation_listener.subscribe("monitoring_rules", rule_index.apply_row_change)
+for equipment_table in EQUIPMENT_TABLES:
+    cache_invalidation_listener.subscribe(equipment_table, parameter_context_cache.mark_stale)
+cache_invalidation_listener.subscribe("user_settings", alarm_types_cache.apply_row_change)
+cache_invalidation_listener.on_resync(_warm_up_caches)
+cache_invalidation_listener.on_resync(alarm_types_cache.clear)
 
 
 # --- Подписчик на очередь RabbitMQ ---
-@broker.subscriber(queue=worker_alert_queue, exchange=worker_live_data_exchange)
+@broker.subscriber(queue=worker_alert_queue, exchange=worker_live_data_exchange, no_ack=True)
 async def handle_data_message(msg_data: dict, message: RabbitMessage):
     """ Асинхронно обрабатывает входящие сообщения с данными параметров из RabbitMQ.
-    Сообщение сначала сохраняется в базу данных, затем передается в сервис для проверки правил мониторинга. """
+    Сообщение валидируется и попадает в буфер, который пачками сохраняется в БД и передаётся на проверку правил. """
     print(f"[WORKER]  ==> Получено сообщение (ID={message.message_id}): {msg_data}")
-    db_for_create: Optional[Session] = None
-    created_pd_id: Optional[int] = None
     parameter_id_for_log: Optional[int] = msg_data.get("parameter_id")
 
-    # 1: Сохранение данных параметра в БД
     try:
-        print(f"[WORKER]  Начало Этапа 1 для parameter_id = {parameter_id_for_log}")
         pd_create_schema = ParameterDataCreate(**msg_data)
-        db_for_create = SessionLocal()
-        created_pd_entry = parameter_data_repository.create(db=db_for_create, obj_in=pd_create_schema)
-        created_pd_id = created_pd_entry.parameter_data_id
-        await message.ack()
-        print(f"[WORKER]  ParameterData с ID = {created_pd_id} сохранён в БД. Сообщение подтверждено (acked).")
-    except Exception as e_stage1:
-        print(f"[WORKER]  !!! ОШИБКА Этапа 1 (сохранение ParameterData) для param_id={parameter_id_for_log}, data={msg_data}: '{type(e_stage1).__name__}' - '{e_stage1}'")
-        if db_for_create:
-            db_for_create.rollback()
+    except Exception as e_validate:
+        print(f"[WORKER]  !!! ОШИБКА валидации сообщения для param_id={parameter_id_for_log}, data={msg_data}: '{type(e_validate).__name__}' - '{e_validate}'")
         try:
             await message.reject(requeue=False)
             print(f"[WORKER]  Проблемное сообщение для param_id={parameter_id_for_log} отклонено.")
         except Exception as e_reject:
             print(f"[WORKER]  !!! ОШИБКА при отклонении проблемного сообщения для param_id={parameter_id_for_log}: '{e_reject}'")
         return
-    finally:
-        if db_for_create:
-            db_for_create.close()
 
-    # 2: Запуск обработки правил мониторинга
-    if created_pd_id is not None:
-        try:
-            print(f"[WORKER]  Начало Этапа 2 - запуск обработки правил для ParameterData с ID={created_pd_id}")
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, process_new_parameter_data, created_pd_id)
-            print(f"[WORKER]  Этап 2 - Обработка правил для ParameterData с ID = {created_pd_id} - успешно завершён.")
-        except Exception as e_process_alert:
-            print(f"[WORKER]  !!! КРИТИЧЕСКАЯ ОШИБКА Этапа 2 (alert_service) для pd_id={created_pd_id} (param_id={parameter_id_for_log}): '{type(e_process_alert).__name__}' - '{e_process_alert}'")
+    await data_batcher.add(pd_create_schema, message)
 
 
 # --- Главная асинхронная функция запуска воркера ---
@@ -115,8 +275,7 @@ async def run_worker_main_loop():
         """ Обрабатывает сигнал завершения `signal_name` и инициирует корректное завершение брокера """
         print(f"[WORKER]  Сигнал '{signal_name}' получен. Инициализирую graceful shutdown...")
         if not stop_event_main_loop.is_set():
-            stop_event_main_loop.set()
-            asyncio.create_task(broker.close())
+            stop_event_main_loop.set()  # Брокер закрывается в finally, после сброса буфера пакетной записи
 
     for sig in (signal.SIGINT, signal.SIGTERM):
         try:
@@ -126,6 +285,9 @@ async def run_worker_main_loop():
             signal.signal(sig, lambda s, f: _graceful_shutdown_signal_handler(signal.Signals(s).name))
 
     try:
+        await notification_dispatcher.start()
+        await cache_invalidation_listener.start()  # Сначала LISTEN, потом загрузка: изменения во время загрузки не потеряются
+        await loop.run_in_executor(None, _warm_up_caches)
         print("[WORKER]  Попытка запустить брокер RabbitMQ и активация подписчиков...")
         await broker.start()
         print("[WORKER]  Брокер успешно стартанул. Воркер активен и слушает сообщения.")
@@ -134,6 +296,12 @@ async def run_worker_main_loop():
     except Exception as e:
         print(f"[WORKER]  !!! ОШИБКА при запуске брокера или же в главном цикле работы брокера: '{type(e).__name__}' - '{e}'")
     finally:
+        try:
+            await data_batcher.close()
+        except Exception as e_flush:
+            print(f"[WORKER]  !!! ОШИБКА при сбросе буфера пакетной записи: '{type(e_flush).__name__}' - '{e_flush}'")
+        await notification_dispatcher.stop()  # После сброса буфера: тревоги последней пачки тоже будут доставлены
+        await cache_invalidation_listener.stop()
         if broker and hasattr(broker, 'close') and callable(broker.close):
             if getattr(broker, '_connection', None) is not None or getattr(broker, '_channel', None) is not None:
                 print("[WORKER]  Попытка закрыть брокер FastStream...")
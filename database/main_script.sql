@@ -12,6 +12,10 @@ DROP TABLE IF EXISTS actuator_types CASCADE;
 DROP TABLE IF EXISTS parameter_types CASCADE;
 DROP TABLE IF EXISTS job_titles CASCADE;
 
+-- Continuous aggregates
+DROP MATERIALIZED VIEW IF EXISTS parameter_data_1h CASCADE;
+DROP MATERIALIZED VIEW IF EXISTS parameter_data_1m CASCADE;
+
 -- Tables
 DROP TABLE IF EXISTS shops CASCADE;
 DROP TABLE IF EXISTS lines CASCADE;
@@ -23,6 +27,7 @@ DROP TABLE IF EXISTS users CASCADE;
 DROP TABLE IF EXISTS user_settings CASCADE;
 DROP TABLE IF EXISTS monitoring_rules CASCADE;
 DROP TABLE IF EXISTS alerts CASCADE;
+DROP TABLE IF EXISTS cache_invalidation_versions CASCADE;
 
 -- Indexes
 DROP INDEX IF EXISTS ix_actuators_aggregate_id;
@@ -35,10 +40,12 @@ DROP INDEX IF EXISTS ix_alerts_alert_timestamp;
 DROP INDEX IF EXISTS ix_users_job_title_id;
 
 -- Functions
--- DROP FUNCTION IF EXISTS func CASCADE;
+DROP FUNCTION IF EXISTS notify_cache_invalidation CASCADE;
+DROP SEQUENCE IF EXISTS cache_invalidation_seq;  -- Больше не создаётся, удаляется у старых установок
 
 -- Triggers
--- DROP TRIGGER IF EXISTS trig ON exam_function;
+DROP TRIGGER IF EXISTS trg_monitoring_rules_cache_invalidation ON monitoring_rules;
+DROP TRIGGER IF EXISTS trg_user_settings_cache_invalidation ON user_settings;
 
 -- Roles
 DO $$
@@ -249,12 +256,16 @@ CREATE TABLE monitoring_rules (
     rule_name VARCHAR(99),
     comparison_operator VARCHAR(2) NOT NULL,
     threshold FLOAT8 NOT NULL,
+    deadband FLOAT8,
+    min_duration_seconds INT,
     is_active BOOLEAN NOT NULL DEFAULT TRUE,
     created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
 
     CONSTRAINT pk_monitoring_rules PRIMARY KEY (rule_id),
     CONSTRAINT uq_monitoring_rules_user_parameter_operator_threshold UNIQUE (user_id, parameter_id, comparison_operator, threshold),
     CONSTRAINT ck_monitoring_rules_comparison_operator CHECK (comparison_operator IN ('>', '<')),
+    CONSTRAINT ck_monitoring_rules_deadband CHECK (deadband IS NULL OR deadband >= 0),
+    CONSTRAINT ck_monitoring_rules_min_duration_seconds CHECK (min_duration_seconds IS NULL OR min_duration_seconds >= 0),
     CONSTRAINT fk_monitoring_rules_user_id FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
     CONSTRAINT fk_monitoring_rules_parameter_id FOREIGN KEY (parameter_id) REFERENCES parameters(parameter_id) ON DELETE CASCADE
 );
@@ -274,6 +285,15 @@ CREATE TABLE alerts (
 );
 
 
+-- Таблица cache_invalidation_versions содержит номер последнего события инвалидации кэшей по каждой таблице
+CREATE TABLE cache_invalidation_versions (
+    table_name VARCHAR(63),
+    version BIGINT NOT NULL,
+
+    CONSTRAINT pk_cache_invalidation_versions PRIMARY KEY (table_name)
+);
+
+
 /*
     = = = = = = = = = =
         TimeScaleDb
@@ -297,6 +317,46 @@ SELECT add_compression_policy('parameter_data', INTERVAL '1 month');
   -- (Опционально) Настраиваем удаление данных старше 6 месяцев
 SELECT add_retention_policy('parameter_data', INTERVAL '6 months');
 
+  -- Непрерывные агрегаты (rollups) для длинных диапазонов: 1 минута и 1 час.
+  -- materialized_only = false: последние, ещё не материализованные интервалы досчитываются из сырых данных на лету
+CREATE MATERIALIZED VIEW parameter_data_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    parameter_id,
+    time_bucket(INTERVAL '1 minute', data_timestamp) AS bucket_start,
+    min(parameter_value) AS min_value,
+    max(parameter_value) AS max_value,
+    avg(parameter_value) AS avg_value,
+    count(*) AS samples_count,
+    last(parameter_value, data_timestamp) AS last_value
+FROM parameter_data
+GROUP BY parameter_id, bucket_start
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW parameter_data_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    parameter_id,
+    time_bucket(INTERVAL '1 hour', data_timestamp) AS bucket_start,
+    min(parameter_value) AS min_value,
+    max(parameter_value) AS max_value,
+    avg(parameter_value) AS avg_value,
+    count(*) AS samples_count,
+    last(parameter_value, data_timestamp) AS last_value
+FROM parameter_data
+GROUP BY parameter_id, bucket_start
+WITH NO DATA;
+
+  -- Политики обновления: пересчитываются только недавние интервалы (старые данные не меняются)
+SELECT add_continuous_aggregate_policy('parameter_data_1m',
+    start_offset => INTERVAL '2 hours', end_offset => INTERVAL '1 minute', schedule_interval => INTERVAL '1 minute');
+SELECT add_continuous_aggregate_policy('parameter_data_1h',
+    start_offset => INTERVAL '1 day', end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '30 minutes');
+
+  -- Индексы для выборки диапазона одного параметра
+CREATE INDEX IF NOT EXISTS ix_parameter_data_1m_parameter_id_bucket_start ON parameter_data_1m (parameter_id, bucket_start);
+CREATE INDEX IF NOT EXISTS ix_parameter_data_1h_parameter_id_bucket_start ON parameter_data_1h (parameter_id, bucket_start);
+
 -- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 /*
@@ -331,7 +391,39 @@ CREATE INDEX IF NOT EXISTS ix_users_job_title_id ON users (job_title_id);
 */
 
 
---
+-- Публикует изменённую строку в канал msm_cache_invalidation (уходит слушателям только после COMMIT).
+-- Для триггеров уровня оператора (FOR EACH STATEMENT) строка не передаётся: 'row' = null.
+-- Версия таблицы увеличивается в той же транзакции, а блокировка её строки держится до COMMIT: следующая транзакция
+-- получит номер только после коммита предыдущей, поэтому события таблицы приходят с номерами подряд (без дыр от ROLLBACK)
+CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS TRIGGER AS $$
+DECLARE
+    changed_row JSONB;
+    table_version BIGINT;
+BEGIN
+    IF TG_LEVEL = 'STATEMENT' THEN
+        changed_row := NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        changed_row := to_jsonb(OLD);
+    ELSE
+        changed_row := to_jsonb(NEW);
+    END IF;
+
+    INSERT INTO cache_invalidation_versions AS versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = versions.version + 1
+    RETURNING versions.version INTO table_version;
+
+    PERFORM pg_notify(
+        'msm_cache_invalidation',
+        jsonb_build_object(
+            'version', table_version,
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'row', changed_row
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
 
 /*
@@ -341,7 +433,31 @@ CREATE INDEX IF NOT EXISTS ix_users_job_title_id ON users (job_title_id);
 */
 
 
---
+CREATE TRIGGER trg_monitoring_rules_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON monitoring_rules
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+-- Настройки пользователя: воркер сбрасывает закэшированные alarm_types
+CREATE TRIGGER trg_user_settings_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON user_settings
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+-- Таблицы оборудования меняются редко, слушателю достаточно знать сам факт изменения таблицы
+DO $$
+DECLARE
+    equipment_table TEXT;
+BEGIN
+    FOREACH equipment_table IN ARRAY ARRAY[
+        'shops', 'lines', 'aggregates', 'actuators', 'parameters',
+        'aggregate_types', 'actuator_types', 'parameter_types'
+    ] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation();',
+            'trg_' || equipment_table || '_cache_invalidation', equipment_table
+        );
+    END LOOP;
+END $$;
 
 -- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -640,11 +756,12 @@ GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO app_user;
 GRANT SELECT ON TABLE
     shops, aggregate_types, actuator_types, parameter_types, job_titles,
     lines, aggregates, actuators, parameters,
-    parameter_data
+    parameter_data, parameter_data_1m, parameter_data_1h
 TO app_user;
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE
     users, user_settings, monitoring_rules, alerts
 TO app_user;
+GRANT SELECT, INSERT, UPDATE ON TABLE cache_invalidation_versions TO app_user;  -- Триггеры инвалидации кэшей
 
 -- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -717,6 +834,9 @@ COMMENT ON TABLE parameter_data IS 'Гипертаблица (TimescaleDB) дл
     COMMENT ON COLUMN parameter_data.parameter_value IS 'Измеренное значение параметра.';
     COMMENT ON COLUMN parameter_data.data_timestamp IS 'Временная метка измерения. Часть первичного ключа гипертаблицы и ключ партиционирования.';
 
+COMMENT ON MATERIALIZED VIEW parameter_data_1m IS 'Непрерывный агрегат (TimescaleDB) parameter_data по 1-минутным интервалам: min/max/avg/count/last.';
+COMMENT ON MATERIALIZED VIEW parameter_data_1h IS 'Непрерывный агрегат (TimescaleDB) parameter_data по 1-часовым интервалам: min/max/avg/count/last.';
+
 
 -- Таблица пользователей
 COMMENT ON TABLE users IS 'Таблица пользователей системы мониторинга.';
@@ -748,6 +868,8 @@ COMMENT ON TABLE monitoring_rules IS 'Таблица правил монитор
     COMMENT ON COLUMN monitoring_rules.rule_name IS 'Необязательное пользовательское название правила.';
     COMMENT ON COLUMN monitoring_rules.comparison_operator IS 'Оператор сравнения (">" и "<").';
     COMMENT ON COLUMN monitoring_rules.threshold IS 'Пороговое значение для срабатывания правила.';
+    COMMENT ON COLUMN monitoring_rules.deadband IS 'Необязательная зона нечувствительности (гистерезис): тревога снимается, только когда значение отойдёт от порога дальше, чем на deadband.';
+    COMMENT ON COLUMN monitoring_rules.min_duration_seconds IS 'Необязательная минимальная длительность нарушения в секундах, после которой поднимается тревога (защита от дребезга).';
     COMMENT ON COLUMN monitoring_rules.is_active IS 'Флаг активности правила (включено/выключено).';
     COMMENT ON COLUMN monitoring_rules.created_at IS 'Временная метка создания правила.';
     COMMENT ON CONSTRAINT uq_monitoring_rules_user_parameter_operator_threshold ON monitoring_rules IS 'Гарантия пиздюлей для пользователя, если он захочет продублировать правило: создать такое же для того же параметра с тем же оператором сравнения и тем же пороговым значением';
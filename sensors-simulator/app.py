@@ -30,6 +30,13 @@ simulator_live_data_exchange = RabbitExchange(
     durable=True
 )
 
+# --- Определение topic exchange (ключ - parameter_id, для экземпляров API) ---
+simulator_live_data_topic_exchange = RabbitExchange(
+    name=settings.RABBITMQ_LIVE_DATA_TOPIC_EXCHANGE_NAME,
+    type=ExchangeType.TOPIC,
+    durable=True
+)
+
 
 '''
 ===============
@@ -114,13 +121,18 @@ async def generate_data_for_parameter(parameter_id: int, param_type: str):
                 "data_timestamp": timestamp.isoformat()
             }
 
-            # Публикует в RabbitMQ exchange
+            # Публикует в RabbitMQ exchange (fanout - для воркера, topic - для экземпляров API с подписчиками параметра)
             await broker.publish(
                 payload_dict,
                 exchange=simulator_live_data_exchange,
                 routing_key=""
             )
-            print(f"[SIMULATOR]  Опубликовано в RabbitMQ exchange '{simulator_live_data_exchange.name}': {payload_dict}")
+            await broker.publish(
+                payload_dict,
+                exchange=simulator_live_data_topic_exchange,
+                routing_key=settings.RABBITMQ_LIVE_DATA_ROUTING_KEY_TEMPLATE.format(parameter_id=parameter_id)
+            )
+            print(f"[SIMULATOR]  Опубликовано в RabbitMQ exchanges '{simulator_live_data_exchange.name}' и '{simulator_live_data_topic_exchange.name}': {payload_dict}")
 
             # Асинхронная пауза
             sleep_duration = random.uniform(DEFAULT_SLEEP_MIN, DEFAULT_SLEEP_MAX)
@@ -154,6 +166,8 @@ async def main_async():
         print(f"[SIMULATOR]  Объявляю fanout exchange '{simulator_live_data_exchange.name}'...")
         await broker.declare_exchange(simulator_live_data_exchange)
         print(f"[SIMULATOR]  Fanout exchange '{simulator_live_data_exchange.name}' успешно объявлен.")
+        await broker.declare_exchange(simulator_live_data_topic_exchange)
+        print(f"[SIMULATOR]  Topic exchange '{simulator_live_data_topic_exchange.name}' успешно объявлен.")
         print("[SIMULATOR]  Успешно подключено к RabbitMQ через FastStream.")
 
         # 3. Запускает задачи генерации